@@ -0,0 +1,255 @@
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import FileResponse
+from typing import Optional
+import hmac
+import os
+from pydantic import BaseModel
+
+from utils.logger import get_logger
+from utils.profiling import profiler_manager, MODE_CPROFILE
+from utils.deadline import deadline_stats, DEFAULT_TIMEOUT_MS, ROUTE_TIMEOUTS_MS
+from utils.thread_budget import effective_thread_settings
+from utils.memory import memory_accountant
+from utils.traffic_capture import traffic_capture
+from api.ml_routes import shadow_evaluator, content_recommender
+from models.profile_store import ShardedProfileStore
+
+router = APIRouter()
+logger = get_logger(__name__)
+
+# Admin endpoints are disabled unless a token is configured
+ADMIN_TOKEN = os.getenv("ML_ADMIN_TOKEN", "")
+
+
+async def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """
+    Reject requests without the configured X-Admin-Token.
+    """
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin API is disabled")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+# Pydantic models for request validation
+class ProfileArmRequest(BaseModel):
+    route: str
+    count: Optional[int] = None
+    duration_seconds: Optional[float] = None
+    mode: Optional[str] = MODE_CPROFILE
+
+class TracemallocRequest(BaseModel):
+    enabled: bool
+    frames: Optional[int] = 10
+
+class CaptureRequest(BaseModel):
+    enabled: bool
+    sample_rate: Optional[float] = None
+
+class ProfileNodeRequest(BaseModel):
+    name: str
+    url: str
+    migrate: Optional[bool] = True
+
+
+@router.post("/profiling/arm", dependencies=[Depends(require_admin)])
+async def arm_profiling(request: ProfileArmRequest):
+    """
+    Profile the next `count` requests and/or every request for `duration_seconds` on a route.
+    """
+    try:
+        arm = profiler_manager.arm(
+            request.route,
+            count=request.count,
+            duration=request.duration_seconds,
+            mode=request.mode
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return {"arm": arm.to_dict(), "status": "success"}
+
+
+@router.delete("/profiling/arm", dependencies=[Depends(require_admin)])
+async def disarm_profiling():
+    """
+    Cancel all pending profiling requests.
+    """
+    profiler_manager.disarm()
+    return {"status": "success"}
+
+
+@router.get("/profiling", dependencies=[Depends(require_admin)])
+async def list_profiles():
+    """
+    List active arms and stored profiles with their time attribution.
+    """
+    return {
+        "arms": profiler_manager.arms(),
+        "profiles": profiler_manager.list_profiles(),
+        "stats": profiler_manager.stats(),
+        "status": "success"
+    }
+
+
+@router.get("/profiling/{profile_id}", dependencies=[Depends(require_admin)])
+async def download_profile(profile_id: str, format: str = "pstats"):
+    """
+    Download a stored profile as pstats, flamegraph-collapsed stacks or its JSON summary.
+    """
+    path = profiler_manager.profile_path(profile_id, format)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+
+    return FileResponse(path, filename=path.name, media_type="application/octet-stream")
+
+
+@router.get("/deadlines", dependencies=[Depends(require_admin)])
+async def get_deadline_stats():
+    """
+    Counters of inference work that was started, completed, shed before it ran or cancelled midway.
+    """
+    return {
+        "counters": deadline_stats.snapshot(),
+        "default_timeout_ms": DEFAULT_TIMEOUT_MS,
+        "route_timeouts_ms": ROUTE_TIMEOUTS_MS,
+        "status": "success"
+    }
+
+
+@router.get("/threads", dependencies=[Depends(require_admin)])
+async def get_thread_settings():
+    """
+    The worker's thread budget and the torch, BLAS and affinity settings actually in effect.
+    """
+    return {**effective_thread_settings(), "status": "success"}
+
+
+@router.get("/shadow", dependencies=[Depends(require_admin)])
+async def get_shadow_report():
+    """
+    Compare the shadow candidate model with the serving model on sampled live inputs.
+    """
+    if shadow_evaluator is None:
+        return {"enabled": False, "status": "success"}
+
+    return {"enabled": True, **shadow_evaluator.report(), "status": "success"}
+
+
+def _sharded_profile_store() -> ShardedProfileStore:
+    store = content_recommender.profile_store
+    if not isinstance(store, ShardedProfileStore):
+        raise HTTPException(status_code=400, detail="Profile store is not sharded")
+    return store
+
+
+@router.get("/profiles", dependencies=[Depends(require_admin)])
+async def get_profile_store_stats():
+    """
+    Backend, shard layout and write-behind counters of the user profile store.
+    """
+    return {**content_recommender.profile_store.stats(), "status": "success"}
+
+
+@router.post("/profiles/nodes", dependencies=[Depends(require_admin)])
+def add_profile_node(request: ProfileNodeRequest):
+    """
+    Add a node to the profile ring and move the profiles it now owns.
+
+    The change is stored for every worker of this node. Send it to one worker of
+    every node; set migrate on only one of them.
+    """
+    store = _sharded_profile_store()
+    try:
+        moved = store.add_node(request.name, request.url, migrate=request.migrate)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return {"moved": moved, "nodes": list(store.nodes), "ring_version": store.ring_version, "status": "success"}
+
+
+@router.delete("/profiles/nodes/{name}", dependencies=[Depends(require_admin)])
+def remove_profile_node(name: str, migrate: bool = True):
+    """
+    Remove a node from the profile ring, moving its profiles to their new owners.
+
+    Like adding a node, the change is stored for every worker of this node.
+    """
+    store = _sharded_profile_store()
+    try:
+        moved = store.remove_node(name, migrate=migrate)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Unknown profile node")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return {"moved": moved, "nodes": list(store.nodes), "ring_version": store.ring_version, "status": "success"}
+
+
+@router.get("/memory", dependencies=[Depends(require_admin)])
+def get_memory_report():
+    """
+    Estimated bytes per model, cache tier and profile store, against process and cgroup memory.
+    """
+    return {**memory_accountant.report(), "status": "success"}
+
+
+@router.post("/memory/shrink", dependencies=[Depends(require_admin)])
+def shrink_memory():
+    """
+    Shrink every shrinkable cache once, regardless of the soft limit.
+    """
+    return {**memory_accountant.shrink(force=True), "status": "success"}
+
+
+@router.post("/memory/tracemalloc", dependencies=[Depends(require_admin)])
+def set_tracemalloc(request: TracemallocRequest):
+    """
+    Start or stop tracemalloc. Allocations are slower while it runs.
+    """
+    if request.enabled:
+        memory_accountant.start_tracing(request.frames)
+    else:
+        memory_accountant.stop_tracing()
+    return {"enabled": request.enabled, "status": "success"}
+
+
+@router.get("/memory/tracemalloc", dependencies=[Depends(require_admin)])
+def get_tracemalloc_diff(top: int = 20, group_by: str = "lineno"):
+    """
+    Take a tracemalloc snapshot and return the allocation sites that grew since the previous one.
+    """
+    if group_by not in ("lineno", "filename", "traceback"):
+        raise HTTPException(status_code=400, detail="group_by must be lineno, filename or traceback")
+    try:
+        return {**memory_accountant.snapshot_diff(top, group_by), "status": "success"}
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@router.get("/capture", dependencies=[Depends(require_admin)])
+def get_capture():
+    """
+    Get the traffic capture settings and counters of this worker.
+    """
+    return {**traffic_capture.stats(), "status": "success"}
+
+
+@router.post("/capture", dependencies=[Depends(require_admin)])
+def set_capture(request: CaptureRequest):
+    """
+    Start or stop capturing traffic on this worker, optionally changing the sample rate.
+    """
+    if request.sample_rate is not None:
+        if not 0.0 <= request.sample_rate <= 1.0:
+            raise HTTPException(status_code=400, detail="sample_rate must be between 0 and 1")
+        traffic_capture.sample_rate = request.sample_rate
+    traffic_capture.enabled = request.enabled
+    if request.enabled:
+        traffic_capture.start()
+    else:
+        # Writes what is queued and closes the file, so it can be copied off for replay
+        traffic_capture.stop()
+    return {**traffic_capture.stats(), "status": "success"}
@@ -1,20 +1,100 @@
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends, Body
-from typing import Optional, List, Dict, Any
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends, Body, Header, Request
+from fastapi.responses import JSONResponse
+from typing import Optional, List, Dict, Any, Union
+import hmac
 import os
+import time
 from pydantic import BaseModel
 import json
 
 # Import models
 from models.classifier_model import TechContentClassifier, ContentRecommender, TECH_CATEGORIES
+from models.cascade_classifier import CascadeClassifier
+from models.recommendation_store import MaterializedRecommendations
+from models.near_duplicate import NearDuplicateIndex
+from models.shadow import ShadowEvaluator
+from models.profile_store import profile_store_from_env
+from models.catalog import ContentCatalog, CursorConflict
 from utils.logger import get_logger
-from utils.cache import cached
+from utils.cache import Cache, cached
+from utils.deadline import WorkCancelled, run_inference
+from utils.batching import MicroBatcher
+from utils.text_preprocessing import prepare_text_async, preprocessing_stats
 
 router = APIRouter()
 logger = get_logger(__name__)
 
+# Shared secret of the backend that writes the content catalog
+CATALOG_TOKEN = os.getenv("ML_CATALOG_TOKEN", "")
+
+
+async def require_catalog_writer(x_catalog_token: Optional[str] = Header(None)):
+    """
+    Reject catalog writes without the configured X-Catalog-Token.
+    """
+    if not CATALOG_TOKEN:
+        raise HTTPException(status_code=403, detail="Catalog sync is disabled")
+    if not x_catalog_token or not hmac.compare_digest(x_catalog_token, CATALOG_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid catalog token")
+
+# Classifier mode: "traditional", "transformer" or "cascade"
+CLASSIFIER_MODE = os.getenv("ML_CLASSIFIER_MODE", "traditional").lower()
+
 # Initialize models
-tech_classifier = TechContentClassifier(model_type="traditional")
-content_recommender = ContentRecommender(classifier=tech_classifier)
+if CLASSIFIER_MODE == "cascade":
+    tech_classifier = CascadeClassifier.from_env()
+else:
+    tech_classifier = TechContentClassifier(model_type=CLASSIFIER_MODE)
+near_duplicates = NearDuplicateIndex.from_env()
+# Compares a candidate model on sampled live inputs when ML_SHADOW_MODEL_PATH is set
+shadow_evaluator = ShadowEvaluator.from_env(tech_classifier)
+# Content items kept in sync by the backend, so recommendation requests need not ship a pool
+content_catalog = ContentCatalog.from_env()
+content_recommender = ContentRecommender(
+    classifier=tech_classifier,
+    materialized=MaterializedRecommendations.from_env(),
+    candidate_min_pool=int(os.getenv("ML_RECOMMEND_CANDIDATE_MIN_POOL", 200)),
+    candidate_categories=int(os.getenv("ML_RECOMMEND_CANDIDATE_CATEGORIES", 5)),
+    exploration=float(os.getenv("ML_RECOMMEND_EXPLORATION", 0.1)),
+    near_duplicates=near_duplicates,
+    profile_store=profile_store_from_env(TECH_CATEGORIES),
+    item_cache_size=int(os.getenv("ML_RECOMMEND_ITEM_CACHE_SIZE", 50000)),
+    catalog=content_catalog
+)
+
+# Served when a request names no pool and the catalog is still empty
+DEFAULT_CONTENT_POOL = [
+    {
+        "id": "vid123", 
+        "type": "video", 
+        "title": "Introduction to Python Programming", 
+        "description": "Learn the basics of Python programming language"
+    },
+    {
+        "id": "art456", 
+        "type": "article", 
+        "title": "Advanced React Hooks", 
+        "description": "Deep dive into React hooks and how to use them effectively"
+    },
+    {
+        "id": "vid789", 
+        "type": "short", 
+        "title": "Quick Git Tips", 
+        "description": "Essential git commands every developer should know"
+    },
+    {
+        "id": "art101", 
+        "type": "article", 
+        "title": "Introduction to Machine Learning", 
+        "description": "Understanding the basics of machine learning algorithms"
+    },
+    {
+        "id": "vid102", 
+        "type": "video", 
+        "title": "Building RESTful APIs", 
+        "description": "How to design and implement robust REST APIs"
+    }
+]
 
 # Pydantic models for request validation
 class TextAnalysisRequest(BaseModel):
@@ -43,49 +123,117 @@ class UserInteractionRequest(BaseModel):
     text: Optional[str] = None
     interaction_type: str  # view, like, comment, share, save, dislike
 
+class CatalogFilter(BaseModel):
+    types: Optional[List[str]] = None
+    ids: Optional[List[str]] = None
+    exclude_ids: Optional[List[str]] = None
+    published_after: Optional[Union[float, str]] = None
+    max_age_days: Optional[float] = None
+    limit: Optional[int] = None
+
 class RecommendationRequest(BaseModel):
     user_id: str
     count: Optional[int] = 10
     content_pool: Optional[List[Dict[str, Any]]] = None
+    catalog: Optional[CatalogFilter] = None
+
+class CatalogDeltaRequest(BaseModel):
+    upserts: List[Dict[str, Any]] = []
+    deletes: List[str] = []
+    cursor: Optional[str] = None
+    base_cursor: Optional[str] = None
+    reset: bool = False
+
+def _classify_batch(texts: List[str], threshold: float, top_k: Optional[int]) -> List[Dict[str, float]]:
+    """
+    Classify a micro-batch of prepared texts that share prediction parameters.
+    """
+    if near_duplicates is not None:
+        return near_duplicates.predict_batch(tech_classifier.predict_batch, texts, threshold=threshold, top_k=top_k)
+    return tech_classifier.predict_batch(texts, threshold=threshold, top_k=top_k)
+
+# Groups concurrent classifications of streaming clients into predict_batch calls
+classify_batcher = MicroBatcher.from_env(_classify_batch)
+
+async def _classify_fields(fields: Dict[str, Optional[str]], threshold: float, http_request: Optional[Request],
+                           top_k: Optional[int] = None, expiration: int = 3600,
+                           batched: bool = False) -> Dict[str, float]:
+    """
+    Classify content fields through the shared preprocessing stage.
+    
+    Results are cached by the normalized text fingerprint, so requests that only
+    differ in markup, whitespace or repeated sentences share a cache entry. On a
+    cache miss, the categories of an indexed near-duplicate (repost, mirror or
+    lightly edited copy) are reused before falling back to inference. With
+    batched, inference is grouped with concurrent requests by the micro-batcher.
+    """
+    prepared = await prepare_text_async(fields)
+    if not prepared.text:
+        return {}
+    
+    cache_key = f"classify:{CLASSIFIER_MODE}:{prepared.fingerprint}:{threshold}:{top_k}"
+    found, categories = await Cache.aget(cache_key)
+    if found:
+        if shadow_evaluator is not None:
+            shadow_evaluator.submit(prepared.text, threshold, categories, top_k=top_k)
+        return categories
+    
+    start = time.perf_counter()
+    if batched:
+        categories = await classify_batcher.submit(prepared.text, threshold, top_k)
+    elif near_duplicates is not None:
+        categories = await run_inference(
+            near_duplicates.predict, tech_classifier.predict, prepared.text,
+            threshold=threshold, top_k=top_k, request=http_request
+        )
+    else:
+        categories = await run_inference(
+            tech_classifier.predict, prepared.text, threshold=threshold, top_k=top_k, request=http_request
+        )
+    if shadow_evaluator is not None:
+        # Micro-batched latencies include the batching window, so only their results are compared
+        latency_ms = None if batched else (time.perf_counter() - start) * 1000.0
+        shadow_evaluator.submit(prepared.text, threshold, categories, latency_ms, top_k=top_k)
+    await Cache.aset(cache_key, categories, expiration)
+    return categories
 
 @router.post("/classify", response_model=Dict[str, float])
-@cached(expiration=3600)  # Cache classification results for 1 hour
-async def classify_text(request: TextAnalysisRequest):
+async def classify_text(request: TextAnalysisRequest, http_request: Request):
     """
     Classify text content into tech categories.
     
     Returns a dictionary of category -> confidence score
     """
     try:
-        result = tech_classifier.predict(
-            request.text, 
-            threshold=request.threshold,
+        # Classification results are cached for 1 hour
+        result = await _classify_fields(
+            {"text": request.text},
+            request.threshold,
+            http_request,
             top_k=request.top_k
         )
         return result
+    except WorkCancelled:
+        raise
     except Exception as e:
         logger.error(f"Text classification error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Classification error: {str(e)}")
 
 @router.post("/analyze/video")
-@cached(expiration=3600)  # Cache video analysis for 1 hour
-async def analyze_video(request: VideoAnalysisRequest):
+async def analyze_video(request: VideoAnalysisRequest, http_request: Request):
     """
     Analyze a video to determine its tech categories.
     Uses title, description, and transcript for classification.
     """
     try:
-        # Combine all available text for classification
-        combined_text = ""
-        if request.title:
-            combined_text += f"Title: {request.title}\n"
-        if request.description:
-            combined_text += f"Description: {request.description}\n"
-        if request.transcript:
-            combined_text += f"Transcript: {request.transcript}"
+        fields = {
+            "title": request.title,
+            "description": request.description,
+            "transcript": request.transcript
+        }
         
         # If we don't have any text, return empty
-        if not combined_text.strip():
+        if not any(value and value.strip() for value in fields.values()):
             return {
                 "categories": {},
                 "primary_category": None,
@@ -95,8 +243,8 @@ async def analyze_video(request: VideoAnalysisRequest):
                 "message": "No text content provided for analysis"
             }
         
-        # Classify the content
-        categories = tech_classifier.predict(combined_text, threshold=request.threshold)
+        # Classify the content (cached for 1 hour)
+        categories = await _classify_fields(fields, request.threshold, http_request)
         
         # Determine primary category if any
         primary_category = None
@@ -112,22 +260,22 @@ async def analyze_video(request: VideoAnalysisRequest):
             "is_tech_content": bool(categories),
             "status": "success"
         }
+    except WorkCancelled:
+        raise
     except Exception as e:
         logger.error(f"Video analysis error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Video analysis error: {str(e)}")
 
 @router.post("/analyze/article")
-@cached(expiration=3600)  # Cache article analysis for 1 hour
-async def analyze_article(request: ArticleAnalysisRequest):
+async def analyze_article(request: ArticleAnalysisRequest, http_request: Request):
     """
     Analyze an article to determine its tech categories.
     """
     try:
-        # Combine title and content for classification
-        combined_text = f"Title: {request.title}\nContent: {request.content}"
-        
-        # Classify the content
-        categories = tech_classifier.predict(combined_text, threshold=request.threshold)
+        # Classify title and content together (cached for 1 hour)
+        categories = await _classify_fields(
+            {"title": request.title, "content": request.content}, request.threshold, http_request
+        )
         
         # Determine primary category if any
         primary_category = None
@@ -143,106 +291,153 @@ async def analyze_article(request: ArticleAnalysisRequest):
             "is_tech_content": bool(categories),
             "status": "success"
         }
+    except WorkCancelled:
+        raise
     except Exception as e:
         logger.error(f"Article analysis error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Article analysis error: {str(e)}")
 
 @router.post("/user/interaction")
-async def process_user_interaction(request: UserInteractionRequest):
+async def process_user_interaction(request: UserInteractionRequest, http_request: Request):
     """
     Process a user interaction with content and update their profile for recommendations.
     """
     try:
-        # Combine all available text for the content
-        content_text = ""
-        if request.title:
-            content_text += f"Title: {request.title}\n"
-        if request.description:
-            content_text += f"Description: {request.description}\n"
-        if request.text:
-            content_text += f"Content: {request.text}"
+        # Normalize all available text for the content
+        prepared = await prepare_text_async({
+            "title": request.title,
+            "description": request.description,
+            "text": request.text
+        })
         
         # Create interaction data
         interaction = {
-            "text": content_text,
+            "text": prepared.text,
             "interaction_type": request.interaction_type,
             "content_id": request.content_id,
             "content_type": request.content_type
         }
         
         # Update user profile
-        content_recommender.update_user_profile(request.user_id, interaction)
+        await run_inference(
+            content_recommender.update_user_profile, request.user_id, interaction, request=http_request
+        )
         
         return {
             "status": "success",
             "message": f"Updated user profile for {request.user_id}"
         }
+    except WorkCancelled:
+        raise
     except Exception as e:
         logger.error(f"User interaction processing error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"User interaction error: {str(e)}")
 
+def _recommend(request: RecommendationRequest) -> List[Dict[str, Any]]:
+    """
+    Resolve the request's content pool and rank it for the user.
+    """
+    if request.content_pool:
+        content_pool = request.content_pool
+    elif request.catalog is not None or len(content_catalog):
+        content_filter = request.catalog or CatalogFilter()
+        content_pool = content_catalog.query(**content_filter.model_dump())
+    else:
+        content_pool = DEFAULT_CONTENT_POOL
+    
+    return content_recommender.get_recommendations(request.user_id, content_pool, request.count)
+
 @router.post("/recommend")
-async def get_recommendations(request: RecommendationRequest):
+async def get_recommendations(request: RecommendationRequest, http_request: Request):
     """
     Get content recommendations for a specific user.
     
     If content_pool is provided, recommendations are filtered from that pool.
-    Otherwise, returns recommendations from a predefined list (in a production environment, 
-    this would query a database for available content).
+    Otherwise the pool is selected from the content catalog with the `catalog`
+    filter (type, recency, ids), most recently published first. Until the
+    backend has synced the catalog, a small predefined pool is used.
     """
     try:
-        # If content pool is not provided, use a default pool
-        if not request.content_pool:
-            # This would typically fetch from a database
-            request.content_pool = [
-                {
-                    "id": "vid123", 
-                    "type": "video", 
-                    "title": "Introduction to Python Programming", 
-                    "description": "Learn the basics of Python programming language"
-                },
-                {
-                    "id": "art456", 
-                    "type": "article", 
-                    "title": "Advanced React Hooks", 
-                    "description": "Deep dive into React hooks and how to use them effectively"
-                },
-                {
-                    "id": "vid789", 
-                    "type": "short", 
-                    "title": "Quick Git Tips", 
-                    "description": "Essential git commands every developer should know"
-                },
-                {
-                    "id": "art101", 
-                    "type": "article", 
-                    "title": "Introduction to Machine Learning", 
-                    "description": "Understanding the basics of machine learning algorithms"
-                },
-                {
-                    "id": "vid102", 
-                    "type": "video", 
-                    "title": "Building RESTful APIs", 
-                    "description": "How to design and implement robust REST APIs"
-                }
-            ]
-        
         # Get recommendations
-        recommendations = content_recommender.get_recommendations(
-            request.user_id, 
-            request.content_pool,
-            request.count
-        )
+        recommendations = await run_inference(_recommend, request, request=http_request)
         
         return {
             "user_id": request.user_id,
             "recommendations": recommendations,
             "status": "success"
         }
+    except WorkCancelled:
+        raise
     except Exception as e:
         logger.error(f"Recommendation error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Recommendation error: {str(e)}")
 
+@router.post("/catalog/sync", dependencies=[Depends(require_catalog_writer)])
+def sync_catalog(request: CatalogDeltaRequest):
+    """
+    Apply a batch of catalog upserts and deletes sent by the backend.
+    
+    `cursor` is the backend's position after this batch. If `base_cursor` is
+    given and the catalog is at a different cursor, batches were lost and 409 is
+    returned with the catalog's cursor to resume from. `reset` clears the catalog
+    first, to start a full resync. Requires the X-Catalog-Token header.
+    """
+    try:
+        result = content_catalog.apply_delta(
+            request.upserts, request.deletes,
+            cursor=request.cursor, base_cursor=request.base_cursor, reset=request.reset
+        )
+        return {**result, "items": len(content_catalog), "status": "success"}
+    except CursorConflict as e:
+        return JSONResponse(status_code=409, content={"detail": "cursor_mismatch", "cursor": e.cursor})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Catalog sync error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Catalog sync error: {str(e)}")
+
+@router.get("/catalog")
+def get_catalog_stats():
+    """
+    Get the catalog size, version and the backend cursor to resume syncing from.
+    """
+    return {**content_catalog.stats(), "status": "success"}
+
+@router.get("/recommend/stats")
+async def get_recommendation_stats():
+    """
+    Get counters of the materialized recommendations and the category candidate index.
+    """
+    return {
+        **content_recommender.materialized.stats(),
+        "candidate_index": content_recommender.category_index.stats(),
+        "status": "success"
+    }
+
+@router.get("/preprocess/stats")
+async def get_preprocessing_stats():
+    """
+    Get how much input text the preprocessing stage removed and its cache hit rate.
+    """
+    return {
+        **preprocessing_stats(),
+        "status": "success"
+    }
+
+@router.get("/near-duplicates/stats")
+async def get_near_duplicate_stats():
+    """
+    Get how many classifications were reused from near-duplicate content and how often audits agreed.
+    """
+    if near_duplicates is None:
+        return {"enabled": False, "status": "success"}
+    
+    return {
+        "enabled": True,
+        **near_duplicates.stats(),
+        "status": "success"
+    }
+
 @router.get("/categories")
 @cached(expiration=86400)  # Cache categories for 24 hours
 async def get_categories():
@@ -254,3 +449,22 @@ async def get_categories():
         "count": len(TECH_CATEGORIES),
         "status": "success"
     }
+
+@router.get("/cascade/stats")
+async def get_cascade_stats():
+    """
+    Get per-stage exit counts and rates of the cascaded classifier.
+    """
+    if not isinstance(tech_classifier, CascadeClassifier):
+        return {
+            "enabled": False,
+            "classifier_mode": CLASSIFIER_MODE,
+            "status": "success"
+        }
+    
+    return {
+        "enabled": True,
+        "classifier_mode": CLASSIFIER_MODE,
+        **tech_classifier.stats(),
+        "status": "success"
+    }
@@ -0,0 +1,93 @@
+from fastapi import APIRouter, Depends, Header, HTTPException
+from typing import Optional, List, Dict, Tuple
+import hmac
+import os
+from pydantic import BaseModel
+
+from utils.logger import get_logger
+from api.ml_routes import content_recommender
+
+router = APIRouter()
+logger = get_logger(__name__)
+
+# Shared secret of the nodes serving profile shards to each other
+CLUSTER_TOKEN = os.getenv("ML_CLUSTER_TOKEN", "")
+
+
+async def require_cluster(x_cluster_token: Optional[str] = Header(None)):
+    """
+    Reject requests without the configured X-Cluster-Token.
+    """
+    if not CLUSTER_TOKEN:
+        raise HTTPException(status_code=403, detail="Cluster API is disabled")
+    if not x_cluster_token or not hmac.compare_digest(x_cluster_token, CLUSTER_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid cluster token")
+
+
+def _local_shard():
+    """
+    The profile shard this node owns.
+    """
+    store = content_recommender.profile_store
+    shard = getattr(store, "local_shard", store)
+    if shard is None:
+        raise HTTPException(status_code=404, detail="This node owns no profile shard")
+    return shard
+
+
+# Pydantic models for request validation
+class ProfileIdsRequest(BaseModel):
+    user_ids: List[str]
+
+class ProfileUpdatesRequest(BaseModel):
+    updates: Dict[str, Dict[str, Tuple[float, float]]]
+    source: Optional[str] = None
+    batch_id: Optional[str] = None
+
+class ProfilePutRequest(BaseModel):
+    profiles: Dict[str, Dict[str, float]]
+
+
+@router.post("/get", dependencies=[Depends(require_cluster)])
+def get_profiles(request: ProfileIdsRequest):
+    """
+    Read a batch of profiles from this node's shard.
+    """
+    return {"profiles": _local_shard().get_many(request.user_ids)}
+
+
+@router.post("/apply", dependencies=[Depends(require_cluster)])
+def apply_profile_updates(request: ProfileUpdatesRequest):
+    """
+    Apply a batch of profile updates flushed by another node.
+
+    A retried batch that was already applied is acknowledged without applying it again.
+    """
+    _local_shard().apply_many(request.updates, source=request.source, batch_id=request.batch_id)
+    return {"status": "success"}
+
+
+@router.post("/put", dependencies=[Depends(require_cluster)])
+def put_profiles(request: ProfilePutRequest):
+    """
+    Store profiles moved to this node by a rebalance.
+    """
+    _local_shard().put_many(request.profiles)
+    return {"status": "success"}
+
+
+@router.post("/delete", dependencies=[Depends(require_cluster)])
+def delete_profiles(request: ProfileIdsRequest):
+    """
+    Delete profiles moved away from this node by a rebalance.
+    """
+    _local_shard().delete_many(request.user_ids)
+    return {"status": "success"}
+
+
+@router.get("/ids", dependencies=[Depends(require_cluster)])
+def list_profile_ids():
+    """
+    List the users whose profiles this node's shard holds.
+    """
+    return {"user_ids": _local_shard().user_ids()}
@@ -0,0 +1,191 @@
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import json
+import os
+import threading
+
+from utils.logger import get_logger
+from utils.text_preprocessing import FIELD_SPECS
+from api.ml_routes import _classify_fields, classify_batcher
+
+router = APIRouter()
+logger = get_logger(__name__)
+
+# Items a client may have in flight per connection; each response returns one credit
+STREAM_CREDITS = int(os.getenv("ML_STREAM_CREDITS", 64))
+# Results completed together are sent as one frame, up to this many
+STREAM_MAX_FRAME_ITEMS = int(os.getenv("ML_STREAM_MAX_FRAME_ITEMS", 256))
+# Unsent protocol errors (no_credit, invalid JSON) tolerated before a client that
+# keeps sending without reading is disconnected
+STREAM_MAX_PENDING_ERRORS = int(os.getenv("ML_STREAM_MAX_PENDING_ERRORS", 64))
+
+# Close code for clients that ignore flow control
+POLICY_VIOLATION = 1008
+
+
+class StreamStats:
+    """
+    Process-wide counters of streaming classification connections.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {
+            "connections": 0, "open_connections": 0, "items": 0, "errors": 0,
+            "rejected_no_credit": 0, "closed_overflow": 0, "frames_in": 0, "frames_out": 0
+        }
+
+    def increment(self, name: str, value: int = 1):
+        with self._lock:
+            self._counts[name] += value
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counts)
+
+
+stream_stats = StreamStats()
+
+
+async def _classify_item(item: Any) -> Dict[str, Any]:
+    """
+    Classify one streamed item into a result or error message tagged with its id.
+    """
+    if not isinstance(item, dict):
+        return {"type": "error", "id": None, "detail": "Items must be JSON objects"}
+
+    item_id = item.get("id")
+    try:
+        fields = {name: item.get(name) for name in FIELD_SPECS}
+        threshold = float(item.get("threshold", 0.5))
+        top_k = item.get("top_k")
+        categories = await _classify_fields(
+            fields, threshold, None, top_k=int(top_k) if top_k is not None else None, batched=True
+        )
+        return {"type": "result", "id": item_id, "categories": categories}
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        stream_stats.increment("errors")
+        return {"type": "error", "id": item_id, "detail": str(e)}
+
+
+@router.websocket("/classify/stream")
+async def classify_stream(websocket: WebSocket):
+    """
+    Classify many items over one WebSocket connection.
+
+    After the `ready` message, the client sends items as JSON objects, or arrays
+    of objects, with an `id`, content fields (title, description, text, content,
+    transcript) and optionally `threshold` and `top_k`. Results are sent as soon
+    as they complete, tagged with the item's id and possibly several to a frame.
+
+    Flow control is credit based and end to end: the client starts with
+    `credits` items it may have in flight, and an item holds its credit until
+    its result or error has been sent. Items sent without credit are rejected
+    with a `no_credit` error instead of queued. A client that keeps sending
+    without reading its responses runs out of credit, and once too many
+    rejections are waiting to be sent, it is disconnected with close code 1008.
+    """
+    await websocket.accept()
+    stream_stats.increment("connections")
+    stream_stats.increment("open_connections")
+
+    # (message, whether it answers an accepted item); results are bounded by the credits
+    # and rejections by STREAM_MAX_PENDING_ERRORS, so neither can take the other's slots
+    outbox: "asyncio.Queue[Tuple[Dict[str, Any], bool]]" = asyncio.Queue(
+        maxsize=STREAM_CREDITS + STREAM_MAX_PENDING_ERRORS
+    )
+    in_flight = set()
+    # Accepted items whose response has not been sent yet
+    outstanding = 0
+    # Rejections queued in the outbox and not sent yet
+    pending_errors = 0
+
+    async def send_results():
+        nonlocal outstanding, pending_errors
+        # Results that completed together go out as one frame
+        while True:
+            entries = [await outbox.get()]
+            while not outbox.empty() and len(entries) < STREAM_MAX_FRAME_ITEMS:
+                entries.append(outbox.get_nowait())
+            messages = [message for message, _ in entries]
+            await websocket.send_text(json.dumps(messages[0] if len(messages) == 1 else messages))
+            # Credits return only once the responses are on their way to the client
+            answered = sum(1 for _, answers_item in entries if answers_item)
+            outstanding -= answered
+            pending_errors -= len(entries) - answered
+            stream_stats.increment("frames_out")
+
+    async def respond(item: Any):
+        # Never blocks: at most STREAM_CREDITS results and STREAM_MAX_PENDING_ERRORS
+        # rejections are queued at once
+        outbox.put_nowait((await _classify_item(item), True))
+
+    def reject(message: Dict[str, Any]) -> bool:
+        nonlocal pending_errors
+        if pending_errors >= STREAM_MAX_PENDING_ERRORS:
+            return False
+        pending_errors += 1
+        outbox.put_nowait((message, False))
+        return True
+
+    sender = asyncio.ensure_future(send_results())
+    try:
+        await websocket.send_text(json.dumps({"type": "ready", "credits": STREAM_CREDITS}))
+        while True:
+            frame = await websocket.receive_text()
+            stream_stats.increment("frames_in")
+            try:
+                payload = json.loads(frame)
+                items = payload if isinstance(payload, list) else [payload]
+            except ValueError:
+                items = None
+
+            accepted = True
+            if items is None:
+                accepted = reject({"type": "error", "id": None, "detail": "Invalid JSON"})
+            else:
+                for item in items:
+                    if outstanding >= STREAM_CREDITS:
+                        stream_stats.increment("rejected_no_credit")
+                        item_id = item.get("id") if isinstance(item, dict) else None
+                        accepted = reject({"type": "error", "id": item_id, "detail": "no_credit"})
+                        if not accepted:
+                            break
+                        continue
+                    stream_stats.increment("items")
+                    outstanding += 1
+                    task = asyncio.ensure_future(respond(item))
+                    in_flight.add(task)
+                    task.add_done_callback(in_flight.discard)
+
+            if not accepted:
+                # The client ignores flow control and does not read its responses
+                stream_stats.increment("closed_overflow")
+                await websocket.close(code=POLICY_VIOLATION)
+                break
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logger.error(f"Classification stream error: {str(e)}")
+    finally:
+        # Pending items of a closed connection are dropped before they reach inference
+        for task in list(in_flight):
+            task.cancel()
+        sender.cancel()
+        stream_stats.increment("open_connections", -1)
+
+
+@router.get("/classify/stream/stats")
+async def get_stream_stats():
+    """
+    Get streaming connection counters and the micro-batcher's batch sizes.
+    """
+    return {
+        "credits": STREAM_CREDITS,
+        "connections": stream_stats.snapshot(),
+        "batching": classify_batcher.stats(),
+        "status": "success"
+    }
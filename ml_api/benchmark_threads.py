@@ -0,0 +1,215 @@
+"""
+Thread budget benchmark
+
+Sweeps thread budget configurations under full load and reports throughput and
+latency percentiles for each, so the ML_WORKERS / ML_INFERENCE_THREADS /
+ML_TORCH_THREADS / ML_BLAS_THREADS settings can be chosen from measurements.
+Every configuration runs `workers` separate processes at once, like uvicorn
+workers sharing the machine, each driving its inference executor at full
+concurrency.
+
+Usage:
+    python benchmark_threads.py --workers 1,2,4 --executor-threads 1,2,4 --intra-op-threads 1,2 --duration 20
+"""
+
+import argparse
+import itertools
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+
+from utils.logger import get_logger
+from utils.thread_budget import ThreadBudget, apply_thread_budget, available_cores
+
+logger = get_logger("benchmark_threads")
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+
+def run_child(args) -> Dict:
+    """
+    Load a model under the budget given on the command line and drive it at full load.
+
+    Returns:
+        Dict: Completed request count, wall time and per-request latencies in milliseconds
+    """
+    budget = apply_thread_budget(ThreadBudget(
+        cores=args.cores,
+        workers=args.worker_count,
+        executor_threads=args.child_executor_threads,
+        intra_op_threads=args.child_intra_op_threads,
+        blas_threads=args.child_blas_threads,
+        pin_cores=args.pin_cores
+    ))
+
+    # Imported after the budget is applied so BLAS and torch pick it up
+    from reclassify import _load_classifier
+    from utils.text_preprocessing import prepare_text
+    from utils.thread_budget import get_inference_executor
+    from utils.warmup import WARMUP_TEXTS
+
+    classifier = _load_classifier(args.model_type, args.model_path)
+    texts = [prepare_text({"text": text}).text for text in WARMUP_TEXTS]
+    for text in texts:
+        classifier.predict(text)
+
+    executor = get_inference_executor()
+    latencies: List[float] = []
+    lock = threading.Lock()
+    stop_at = time.time() + args.duration
+
+    def client(index: int):
+        # One closed-loop client per executor slot plus one queued, so the executor never idles
+        i = index
+        while time.time() < stop_at:
+            start = time.perf_counter()
+            executor.submit(classifier.predict, texts[i % len(texts)]).result()
+            elapsed = (time.perf_counter() - start) * 1000.0
+            with lock:
+                latencies.append(elapsed)
+            i += 1
+
+    started = time.time()
+    clients = [threading.Thread(target=client, args=(i,)) for i in range(budget.executor_threads + 1)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+
+    return {"requests": len(latencies), "seconds": time.time() - started, "latencies_ms": latencies}
+
+
+def run_config(args, workers: int, executor_threads: int, intra_op_threads: int,
+               blas_threads: Optional[int]) -> Dict:
+    """
+    Run one configuration with `workers` concurrent child processes.
+
+    Returns:
+        Dict: The configuration with its throughput and latency percentiles
+    """
+    budget = ThreadBudget(
+        cores=args.cores, workers=workers, executor_threads=executor_threads,
+        intra_op_threads=intra_op_threads, blas_threads=blas_threads, pin_cores=args.pin_cores
+    )
+
+    command = [
+        sys.executable, os.path.abspath(__file__), "--child",
+        "--cores", str(args.cores),
+        "--worker-count", str(workers),
+        "--child-executor-threads", str(budget.executor_threads),
+        "--child-intra-op-threads", str(budget.intra_op_threads),
+        "--child-blas-threads", str(budget.blas_threads),
+        "--model-type", args.model_type,
+        "--duration", str(args.duration)
+    ]
+    if args.model_path:
+        command += ["--model-path", args.model_path]
+    if args.pin_cores:
+        command.append("--pin-cores")
+
+    children = [
+        subprocess.Popen(command, stdout=subprocess.PIPE, cwd=os.path.dirname(os.path.abspath(__file__)))
+        for _ in range(workers)
+    ]
+
+    latencies: List[float] = []
+    requests = 0
+    seconds = 0.0
+    for child in children:
+        output, _ = child.communicate()
+        if child.returncode != 0:
+            raise RuntimeError(f"Benchmark worker failed with exit code {child.returncode}")
+        result = json.loads(output.decode("utf-8").strip().splitlines()[-1])
+        latencies.extend(result["latencies_ms"])
+        requests += result["requests"]
+        seconds = max(seconds, result["seconds"])
+
+    return {
+        **budget.to_dict(),
+        "requests_per_second": round(requests / seconds, 1) if seconds else 0.0,
+        "p50_ms": round(_percentile(latencies, 50), 2),
+        "p95_ms": round(_percentile(latencies, 95), 2),
+        "p99_ms": round(_percentile(latencies, 99), 2),
+        "max_ms": round(max(latencies), 2) if latencies else 0.0
+    }
+
+
+def run(args) -> List[Dict]:
+    """
+    Sweep all configurations and print a table sorted by p99 latency.
+
+    Returns:
+        List[Dict]: Results of every configuration
+    """
+    results = []
+    grid = itertools.product(args.workers, args.executor_threads, args.intra_op_threads, args.blas_threads)
+    for workers, executor_threads, intra_op_threads, blas_threads in grid:
+        logger.info(
+            f"Benchmarking workers={workers} executor={executor_threads} "
+            f"intra_op={intra_op_threads} blas={blas_threads or 'auto'}"
+        )
+        results.append(run_config(args, workers, executor_threads, intra_op_threads, blas_threads))
+
+    results.sort(key=lambda result: result["p99_ms"])
+    print(f"{'workers':>7} {'exec':>4} {'intra':>5} {'blas':>4} {'over':>5} {'req/s':>8} "
+          f"{'p50':>8} {'p95':>8} {'p99':>8}")
+    for result in results:
+        print(f"{result['workers']:>7} {result['executor_threads']:>4} {result['intra_op_threads']:>5} "
+              f"{result['blas_threads']:>4} {result['oversubscription']:>5} {result['requests_per_second']:>8} "
+              f"{result['p50_ms']:>8} {result['p95_ms']:>8} {result['p99_ms']:>8}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        logger.info(f"Wrote results to {args.output}")
+
+    return results
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(item) for item in value.split(",") if item.strip()]
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Sweep thread budget configurations under load")
+    parser.add_argument("--workers", type=_int_list, default=[1, 2], help="Comma separated worker counts")
+    parser.add_argument("--executor-threads", type=_int_list, default=[1, 2, 4],
+                        help="Comma separated inference executor sizes")
+    parser.add_argument("--intra-op-threads", type=_int_list, default=[1, 2],
+                        help="Comma separated torch intra-op thread counts")
+    parser.add_argument("--blas-threads", type=_int_list, default=[0],
+                        help="Comma separated BLAS thread counts (0: same as intra-op)")
+    parser.add_argument("--cores", type=int, default=len(available_cores()), help="Cores to split")
+    parser.add_argument("--pin-cores", action="store_true", help="Pin each worker to its own cores")
+    parser.add_argument("--model-type", choices=["traditional", "transformer", "cascade"], default="traditional")
+    parser.add_argument("--model-path", help="Path to a saved traditional model")
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds of load per configuration")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+
+    # Internal: run a single benchmark worker
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--worker-count", type=int, default=1, help=argparse.SUPPRESS)
+    parser.add_argument("--child-executor-threads", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--child-intra-op-threads", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--child-blas-threads", type=int, help=argparse.SUPPRESS)
+
+    args = parser.parse_args(argv)
+    args.blas_threads = [threads or None for threads in args.blas_threads]
+    return args
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    if arguments.child:
+        print(json.dumps(run_child(arguments)))
+    else:
+        run(arguments)
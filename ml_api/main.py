@@ -6,19 +6,39 @@ from fastapi.openapi.docs import get_swagger_ui_html
 from fastapi.responses import HTMLResponse, JSONResponse
 from pydantic import BaseModel
 from typing import Optional, Dict, List
+import asyncio
 import time
 import os
 from dotenv import load_dotenv
 
+# Load environment variables before the routes read their configuration
+load_dotenv()
+
+# Limit torch/BLAS thread pools before the models import them
+from utils.thread_budget import apply_thread_budget
+apply_thread_budget()
+
 # Import API routes
-from api.ml_routes import router as ml_router
+from api.ml_routes import (
+    router as ml_router, tech_classifier, content_recommender, shadow_evaluator, near_duplicates, content_catalog
+)
+from api.admin_routes import router as admin_router
+from api.profile_routes import router as profile_router
+from api.stream_routes import router as stream_router
 
 # Import utilities and models
 from utils.logger import get_logger, configure_logging
-from models.classifier_model import TechContentClassifier, TECH_CATEGORIES
-
-# Load environment variables
-load_dotenv()
+from models.classifier_model import TECH_CATEGORIES, TechContentClassifier, ContentRecommender
+from models.cascade_classifier import CascadeClassifier
+from utils.profiling import profiler_manager, PROFILE_HEADER
+from utils.warmup import readiness, warm_up, save_snapshot
+from utils.text_preprocessing import prepare_text_async, clean_cache_memory_usage, shrink_clean_cache
+from utils.memory import memory_accountant, model_footprint
+from utils.cache import Cache
+from utils.traffic_capture import traffic_capture
+from utils.deadline import (
+    WorkCancelled, deadline_from_headers, deadline_stats, set_deadline, reset_deadline, run_inference
+)
 
 # Initialize logger
 logger = get_logger(__name__)
@@ -45,19 +65,87 @@ configure_logging()
 # Mount static files directory
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
-# Initialize models
-tech_classifier = TechContentClassifier(model_type="traditional")
-
 # Include routers
 app.include_router(ml_router, prefix="/api/ml", tags=["ML Operations"])
+app.include_router(stream_router, prefix="/api/ml", tags=["Streaming"])
+app.include_router(admin_router, prefix="/admin", tags=["Admin"])
+app.include_router(profile_router, prefix="/internal/profiles", tags=["Cluster"])
+
+# Attribute profiled time to the model classes
+profiler_manager.attribute_classes([TechContentClassifier, CascadeClassifier, ContentRecommender])
+
+# Account memory of models, caches and stores; caches are shrunk cheapest-to-rebuild first
+def _classifier_memory_usage():
+    parts = model_footprint(tech_classifier)
+    return {"bytes": sum(parts.values()), "parts": parts}
+
+memory_accountant.register("classifier", "model", _classifier_memory_usage)
+if shadow_evaluator is not None:
+    memory_accountant.register(
+        "shadow_candidate", "model",
+        lambda: sum(model_footprint(shadow_evaluator.candidate).values()) if shadow_evaluator.candidate else 0
+    )
+memory_accountant.register("text_clean_cache", "cache", clean_cache_memory_usage, shrink_clean_cache, priority=0)
+if near_duplicates is not None:
+    memory_accountant.register(
+        "near_duplicates", "cache", near_duplicates.memory_usage, near_duplicates.shrink, priority=1
+    )
+memory_accountant.register(
+    "materialized_recommendations", "cache",
+    content_recommender.materialized.memory_usage, content_recommender.materialized.shrink, priority=2
+)
+memory_accountant.register(
+    "item_categories", "cache",
+    content_recommender.item_cache_memory_usage, content_recommender.shrink_item_cache, priority=3
+)
+memory_accountant.register("category_index", "cache", content_recommender.category_index.memory_usage)
+memory_accountant.register("result_cache", "cache", Cache.memory_usage)
+memory_accountant.register("profile_store", "store", content_recommender.profile_store.memory_usage)
+memory_accountant.register("content_catalog", "store", content_catalog.memory_usage)
+
+# Dropped or cancelled inference work
+@app.exception_handler(WorkCancelled)
+async def work_cancelled_handler(request: Request, exc: WorkCancelled):
+    return JSONResponse(status_code=exc.status_code, content={"detail": exc.reason})
 
 # Request timing middleware
 @app.middleware("http")
 async def add_process_time_header(request: Request, call_next):
     start_time = time.time()
-    response = await call_next(request)
+    
+    # Record a sample of requests for offline replay (ML_CAPTURE_ENABLED)
+    captured_body = None
+    capture = traffic_capture.sampled(request.method, request.url.path)
+    if capture:
+        request, captured_body = await traffic_capture.buffer_request(request)
+    
+    # Shed requests that arrive after their deadline; otherwise make it visible to the handlers
+    deadline = deadline_from_headers(request.url.path, request.headers)
+    if deadline.cancelled_reason():
+        deadline_stats.increment("shed")
+        logger.info(f"Request: {request.method} {request.url.path} -> shed (deadline passed)")
+        if capture:
+            traffic_capture.record(request, captured_body, start_time, 504, time.time() - start_time)
+        return JSONResponse(status_code=504, content={"detail": "deadline_exceeded"})
+    deadline_token = set_deadline(deadline)
+    try:
+        # Capture a profile if this route is armed or the request carries a signed header
+        profile_session = profiler_manager.start(request.url.path, request.headers.get(PROFILE_HEADER))
+        if profile_session is None:
+            response = await call_next(request)
+        else:
+            try:
+                response = await call_next(request)
+            finally:
+                profiler_manager.finish(profile_session)
+            response.headers["X-Profile-Id"] = profile_session.id
+    finally:
+        reset_deadline(deadline_token)
+    
     process_time = time.time() - start_time
     response.headers["X-Process-Time"] = str(process_time)
+    if capture:
+        traffic_capture.record(request, captured_body, start_time, response.status_code, process_time)
     
     # Log request details
     status_code = response.status_code
@@ -70,7 +158,20 @@ async def add_process_time_header(request: Request, call_next):
 # Health check endpoint
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "services": {"classifier": "online"}}
+    state = readiness.to_dict()
+    if state["ready"]:
+        classifier_status = "online"
+    elif state["phase"] == "failed":
+        classifier_status = "error"
+    else:
+        classifier_status = "loading"
+    return {"status": "healthy", "services": {"classifier": classifier_status}}
+
+# Readiness probe: only ready once models are loaded, validated and warmed up
+@app.get("/ready")
+async def readiness_check():
+    state = readiness.to_dict()
+    return JSONResponse(status_code=200 if state["ready"] else 503, content=state)
 
 # Custom OpenAPI docs
 @app.get("/docs", include_in_schema=False)
@@ -105,19 +206,30 @@ class TextClassificationRequest(BaseModel):
     top_k: Optional[int] = 5
 
 @app.post("/classify", response_model=Dict[str, float])
-async def classify_text(request: TextClassificationRequest):
+async def classify_text(request: TextClassificationRequest, http_request: Request):
     """
     Classify text content into tech categories.
     
     Returns a dictionary of category -> confidence score
     """
     try:
-        result = tech_classifier.predict(
-            request.text, 
+        text = (await prepare_text_async({"text": request.text})).text
+        
+        start = time.perf_counter()
+        result = await run_inference(
+            tech_classifier.predict,
+            text,
             threshold=request.threshold,
-            top_k=request.top_k
+            top_k=request.top_k,
+            request=http_request
         )
+        if shadow_evaluator is not None:
+            shadow_evaluator.submit(
+                text, request.threshold, result, (time.perf_counter() - start) * 1000.0, top_k=request.top_k
+            )
         return result
+    except WorkCancelled:
+        raise
     except Exception as e:
         logger.error(f"Text classification error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Classification error: {str(e)}")
@@ -132,6 +244,14 @@ async def get_categories():
         "count": len(TECH_CATEGORIES)
     }
 
+def _warm_up_and_precompute():
+    warm_up(tech_classifier, content_recommender)
+    if not readiness.ready:
+        return
+    # Classify catalog items as they change, then the ones already synced
+    content_catalog.add_listener(content_recommender.on_catalog_change)
+    content_recommender.on_catalog_change(content_catalog.items(), [])
+
 # Handle model loading during startup
 @app.on_event("startup")
 async def startup_event():
@@ -143,14 +263,41 @@ async def startup_event():
         os.makedirs(cache_dir)
         logger.info(f"Created cache directory at {cache_dir}")
     
-    # Initialize any resources needed at startup
+    # Load, validate and warm up the models without blocking the event loop,
+    # so /health and /ready answer while warm-up is in progress
+    loop = asyncio.get_running_loop()
+    loop.run_in_executor(None, _warm_up_and_precompute)
+    
+    # Follow catalog deltas applied by other workers
+    content_catalog.start()
+    
+    # Start comparing the candidate model on sampled traffic, off the request path
+    if shadow_evaluator is not None:
+        shadow_evaluator.start()
+    
+    # Shrink caches before the process reaches its memory limit
+    memory_accountant.start()
+    
+    if traffic_capture.enabled:
+        traffic_capture.start()
+    
     logger.info("ML API Started Successfully")
 
 # Handle cleanup during shutdown
 @app.on_event("shutdown")
 async def shutdown_event():
     logger.info("ML API Shutting Down...")
-    # Clean up any resources
+    
+    if shadow_evaluator is not None:
+        shadow_evaluator.stop()
+    content_catalog.stop()
+    traffic_capture.stop()
+    
+    # Write buffered profile updates through before the process exits
+    content_recommender.profile_store.close()
+    
+    # Keep hot item classifications for the next startup
+    save_snapshot(content_recommender)
     logger.info("ML API Shutdown Complete")
 
 if __name__ == "__main__":
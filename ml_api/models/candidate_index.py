@@ -0,0 +1,242 @@
+"""
+Category-Inverted Candidate Index
+
+Maps each tech category to the content items predicted to belong to it, sorted by
+confidence. Recommendation uses it to run threshold-algorithm style candidate
+generation over a user's strongest categories, so only items that can still reach
+the top-N are scored instead of the whole pool.
+"""
+
+import bisect
+import heapq
+import random
+import threading
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from utils.logger import get_logger
+from utils.memory import sampled_sizeof
+
+logger = get_logger(__name__)
+
+
+class CategoryIndex:
+    """
+    Inverted index from category to (confidence, item id) postings.
+    """
+
+    def __init__(self):
+        # Postings hold (-confidence, item_id) so ascending order is descending confidence
+        self._postings: Dict[str, List[Tuple[float, str]]] = {}
+        self._items: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.RLock()
+        self._stats = {"queries": 0, "scored": 0, "pool": 0}
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __contains__(self, item_id: str) -> bool:
+        return item_id in self._items
+
+    def get(self, item_id: str) -> Optional[Dict[str, float]]:
+        """
+        Get the indexed categories of an item.
+        """
+        return self._items.get(item_id)
+
+    def add(self, item_id: str, categories: Dict[str, float]):
+        """
+        Index an item, replacing any previous postings for it.
+
+        Args:
+            item_id (str): Content item ID
+            categories (Dict[str, float]): Category -> confidence
+        """
+        with self._lock:
+            if item_id in self._items:
+                self.remove(item_id)
+
+            self._items[item_id] = dict(categories)
+            for category, confidence in categories.items():
+                bisect.insort(self._postings.setdefault(category, []), (-confidence, item_id))
+
+    def remove(self, item_id: str):
+        """
+        Remove an item from the index.
+
+        Args:
+            item_id (str): Content item ID
+        """
+        with self._lock:
+            categories = self._items.pop(item_id, None)
+            if not categories:
+                return
+
+            for category, confidence in categories.items():
+                postings = self._postings.get(category, [])
+                position = bisect.bisect_left(postings, (-confidence, item_id))
+                if position < len(postings) and postings[position] == (-confidence, item_id):
+                    del postings[position]
+
+    def _score(self, profile: Dict[str, float], item_id: str) -> float:
+        return sum(
+            confidence * profile.get(category, 0.0)
+            for category, confidence in self._items[item_id].items()
+        )
+
+    def top_candidates(self, profile: Dict[str, float], n: int,
+                       pool_ids: Optional[Set[str]] = None,
+                       max_categories: int = 5) -> List[Tuple[float, str]]:
+        """
+        Find the n highest scoring items with the threshold algorithm.
+
+        Posting lists of the user's strongest categories are read in parallel.
+        Every newly seen item is scored exactly; scanning stops once the n-th best
+        score reaches the upper bound any unseen item could still achieve. Weaker
+        categories are only scanned if the strongest ones cannot fill the top-N.
+
+        Args:
+            profile (Dict[str, float]): User interest profile (category -> weight)
+            n (int): Number of items to return
+            pool_ids (Set[str], optional): Restrict results to these item ids
+            max_categories (int): Number of strongest categories scanned up front
+
+        Returns:
+            List[Tuple[float, str]]: (score, item_id) pairs sorted by score, descending.
+                                     Only items sharing a positively weighted category
+                                     with the profile are returned.
+        """
+        with self._lock:
+            # Negative weights can only lower a score, so they are left out of the bound
+            weighted = sorted(
+                ((weight, category) for category, weight in profile.items()
+                 if weight > 0 and self._postings.get(category)),
+                reverse=True
+            )
+            active = weighted[:max_categories]
+            waiting = weighted[max_categories:]
+
+            def head_bound(entries):
+                return sum(weight * -self._postings[category][0][0] for weight, category in entries)
+
+            waiting_bound = head_bound(waiting)
+            positions = {category: 0 for _, category in active}
+            last_seen = {category: -self._postings[category][0][0] for _, category in active}
+            seen: Set[str] = set()
+            heap: List[Tuple[float, str]] = []
+
+            while True:
+                progressed = False
+                for weight, category in active:
+                    postings = self._postings[category]
+                    position = positions[category]
+                    while position < len(postings) and pool_ids is not None \
+                            and postings[position][1] not in pool_ids:
+                        position += 1
+
+                    if position >= len(postings):
+                        positions[category] = position
+                        last_seen[category] = 0.0
+                        continue
+
+                    negative_confidence, item_id = postings[position]
+                    positions[category] = position + 1
+                    last_seen[category] = -negative_confidence
+                    progressed = True
+
+                    if item_id in seen:
+                        continue
+                    seen.add(item_id)
+
+                    entry = (self._score(profile, item_id), item_id)
+                    if len(heap) < n:
+                        heapq.heappush(heap, entry)
+                    elif entry > heap[0]:
+                        heapq.heapreplace(heap, entry)
+
+                threshold = waiting_bound + sum(weight * last_seen[category] for weight, category in active)
+                if len(heap) >= n and heap[0][0] >= threshold:
+                    break
+
+                if not progressed:
+                    if not waiting:
+                        break
+                    # Strongest categories are exhausted; widen the scan to the next one
+                    weight, category = waiting.pop(0)
+                    waiting_bound = head_bound(waiting)
+                    active.append((weight, category))
+                    positions[category] = 0
+                    last_seen[category] = -self._postings[category][0][0]
+
+            self._stats["queries"] += 1
+            self._stats["scored"] += len(seen)
+            self._stats["pool"] += len(pool_ids) if pool_ids is not None else len(self._items)
+
+        return sorted(heap, reverse=True)
+
+    def explore(self, profile: Dict[str, float], k: int, pool_ids: Optional[Set[str]] = None,
+                exclude: Iterable[str] = (), max_categories: int = 5) -> List[str]:
+        """
+        Pick items from categories outside the user's strongest ones.
+
+        Args:
+            profile (Dict[str, float]): User interest profile
+            k (int): Number of items to pick
+            pool_ids (Set[str], optional): Restrict picks to these item ids
+            exclude (Iterable[str]): Item ids that must not be picked
+            max_categories (int): Number of strongest categories to avoid
+
+        Returns:
+            List[str]: Up to k item ids, each from a different category where possible
+        """
+        if k <= 0:
+            return []
+
+        strongest = {
+            category for _, category in sorted(
+                ((weight, category) for category, weight in profile.items() if weight > 0),
+                reverse=True
+            )[:max_categories]
+        }
+        excluded = set(exclude)
+        picks: List[str] = []
+
+        with self._lock:
+            categories = [category for category in self._postings if category not in strongest]
+            random.shuffle(categories)
+            for category in categories:
+                for _, item_id in self._postings[category]:
+                    if item_id in excluded or (pool_ids is not None and item_id not in pool_ids):
+                        continue
+                    picks.append(item_id)
+                    excluded.add(item_id)
+                    break
+                if len(picks) >= k:
+                    break
+
+        return picks
+
+    def memory_usage(self) -> Dict[str, int]:
+        """
+        Estimated bytes held by the indexed items and their postings.
+        """
+        with self._lock:
+            item_bytes = sampled_sizeof(self._items.items(), len(self._items))
+            posting_bytes = sum(sampled_sizeof(postings, len(postings)) for postings in self._postings.values())
+        return {"bytes": item_bytes + posting_bytes, "entries": len(self._items)}
+
+    def stats(self) -> Dict:
+        """
+        Get index size and how much of the pool candidate generation had to score.
+
+        Returns:
+            Dict: Item/category counts, query count and average scored fraction
+        """
+        with self._lock:
+            pool = self._stats["pool"]
+            return {
+                "items": len(self._items),
+                "categories": len(self._postings),
+                "queries": self._stats["queries"],
+                "scored": self._stats["scored"],
+                "scored_fraction": self._stats["scored"] / pool if pool else 0.0
+            }
@@ -0,0 +1,263 @@
+"""
+Cascaded Tech Content Classifier
+
+This module chains cheap and expensive classifiers so that only ambiguous texts
+pay for transformer inference:
+
+1. Keyword gate (Aho-Corasick over curated terms per category)
+2. TF-IDF + LinearSVC pipeline
+3. Transformer model
+
+Each stage exits early when its scores fall inside a configurable confidence band.
+"""
+
+import os
+import threading
+from typing import Dict, List, Optional
+
+from models.classifier_model import TechContentClassifier, TECH_CATEGORIES
+from models.keyword_gate import KeywordGate
+from utils.deadline import check_cancelled
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Stage names used for exit accounting
+STAGE_KEYWORD = "keyword"
+STAGE_KEYWORD_REJECT = "keyword_reject"
+STAGE_TFIDF_ACCEPT = "tfidf_accept"
+STAGE_TFIDF_REJECT = "tfidf_reject"
+STAGE_TRANSFORMER = "transformer"
+STAGES = [STAGE_KEYWORD, STAGE_KEYWORD_REJECT, STAGE_TFIDF_ACCEPT, STAGE_TFIDF_REJECT, STAGE_TRANSFORMER]
+
+
+class CascadeClassifier:
+    """
+    A classifier that routes text through increasingly expensive models.
+
+    Exposes the same predict interface as TechContentClassifier so it can be used
+    anywhere a classifier is expected (e.g. by ContentRecommender).
+    """
+
+    def __init__(self,
+                 fast_classifier: Optional[TechContentClassifier] = None,
+                 slow_classifier: Optional[TechContentClassifier] = None,
+                 keyword_gate: Optional[KeywordGate] = None,
+                 keyword_min_hits: int = 3,
+                 keyword_accept: float = 0.75,
+                 reject_without_keywords: bool = True,
+                 tfidf_accept: float = 0.8,
+                 tfidf_margin: float = 0.3,
+                 tfidf_reject: float = 0.2):
+        """
+        Initialize the cascade.
+
+        Args:
+            fast_classifier (TechContentClassifier, optional): Traditional TF-IDF classifier
+            slow_classifier (TechContentClassifier, optional): Transformer classifier
+            keyword_gate (KeywordGate, optional): Keyword matcher for the first stage
+            keyword_min_hits (int): Minimum keyword hits before the keyword stage may answer
+            keyword_accept (float): Share of hits the top category needs to exit at the keyword stage
+            reject_without_keywords (bool): Treat texts without any keyword hit as non-tech
+                                            when the TF-IDF stage is unavailable
+            tfidf_accept (float): Top TF-IDF score needed to exit at the TF-IDF stage
+            tfidf_margin (float): Required gap between the top two TF-IDF scores to exit
+            tfidf_reject (float): Texts whose top TF-IDF score is below this are non-tech
+        """
+        self.fast_classifier = fast_classifier or TechContentClassifier(model_type="traditional")
+        self.slow_classifier = slow_classifier or TechContentClassifier(model_type="transformer")
+        self.keyword_gate = keyword_gate or KeywordGate()
+        self.model_type = "cascade"
+
+        self.keyword_min_hits = keyword_min_hits
+        self.keyword_accept = keyword_accept
+        self.reject_without_keywords = reject_without_keywords
+        self.tfidf_accept = tfidf_accept
+        self.tfidf_margin = tfidf_margin
+        self.tfidf_reject = tfidf_reject
+
+        self._lock = threading.Lock()
+        self._exits = {stage: 0 for stage in STAGES}
+
+    @classmethod
+    def from_env(cls, **kwargs) -> "CascadeClassifier":
+        """
+        Build a cascade with confidence bands read from environment variables.
+
+        Returns:
+            CascadeClassifier: Configured cascade
+        """
+        return cls(
+            keyword_min_hits=int(os.getenv("ML_CASCADE_KEYWORD_MIN_HITS", 3)),
+            keyword_accept=float(os.getenv("ML_CASCADE_KEYWORD_ACCEPT", 0.75)),
+            reject_without_keywords=os.getenv("ML_CASCADE_REJECT_WITHOUT_KEYWORDS", "true").lower() == "true",
+            tfidf_accept=float(os.getenv("ML_CASCADE_TFIDF_ACCEPT", 0.8)),
+            tfidf_margin=float(os.getenv("ML_CASCADE_TFIDF_MARGIN", 0.3)),
+            tfidf_reject=float(os.getenv("ML_CASCADE_TFIDF_REJECT", 0.2)),
+            **kwargs
+        )
+
+    def _record_exit(self, stage: str):
+        with self._lock:
+            self._exits[stage] += 1
+
+    @staticmethod
+    def _finalize(scores: Dict[str, float], threshold: float, top_k: Optional[int]) -> Dict[str, float]:
+        """
+        Apply threshold, ordering and top_k the same way TechContentClassifier.predict does.
+        """
+        predictions = {category: score for category, score in scores.items() if score >= threshold}
+        predictions = dict(sorted(predictions.items(), key=lambda x: x[1], reverse=True))
+
+        if top_k and len(predictions) > top_k:
+            predictions = dict(list(predictions.items())[:top_k])
+
+        return predictions
+
+    def predict(self, text: str, threshold: float = 0.5, top_k: Optional[int] = None) -> Dict[str, float]:
+        """
+        Predict tech categories for the given text, exiting at the cheapest confident stage.
+
+        Args:
+            text (str): The text to classify
+            threshold (float): Confidence threshold for including a category
+            top_k (int, optional): Return only top k predictions
+
+        Returns:
+            Dict[str, float]: Dictionary mapping category names to confidence scores
+        """
+        if not text or text.strip() == "":
+            return {}
+
+        # Stage 1: keyword gate
+        keyword_scores, keyword_hits = self.keyword_gate.score(text)
+        if keyword_hits >= self.keyword_min_hits:
+            top_share = next(iter(keyword_scores.values()))
+            if top_share >= self.keyword_accept:
+                self._record_exit(STAGE_KEYWORD)
+                return self._finalize(keyword_scores, threshold, top_k)
+
+        # Stage 2: TF-IDF model
+        if self.fast_classifier.is_fitted():
+            tfidf_scores = self.fast_classifier.traditional_scores([text])[0]
+            ranked = sorted((float(score) for score in tfidf_scores), reverse=True)
+            top_score = ranked[0]
+            runner_up = ranked[1] if len(ranked) > 1 else 0.0
+
+            if top_score < self.tfidf_reject and not keyword_hits:
+                self._record_exit(STAGE_TFIDF_REJECT)
+                return {}
+
+            if top_score >= self.tfidf_accept and top_score - runner_up >= self.tfidf_margin:
+                self._record_exit(STAGE_TFIDF_ACCEPT)
+                scores = {
+                    TECH_CATEGORIES[i]: float(score) for i, score in enumerate(tfidf_scores)
+                }
+                return self._finalize(scores, threshold, top_k)
+        elif not keyword_hits and self.reject_without_keywords:
+            self._record_exit(STAGE_KEYWORD_REJECT)
+            return {}
+
+        # Stage 3: transformer
+        self._record_exit(STAGE_TRANSFORMER)
+        return self.slow_classifier.predict(text, threshold=threshold, top_k=top_k)
+
+    def predict_batch(self, texts: List[str], threshold: float = 0.5, top_k: Optional[int] = None,
+                      batch_size: int = 32) -> List[Dict[str, float]]:
+        """
+        Predict tech categories for many texts, batching each model stage.
+
+        Args:
+            texts (List[str]): The texts to classify
+            threshold (float): Confidence threshold for including a category
+            top_k (int, optional): Return only top k predictions
+            batch_size (int): Number of texts sent to a model per call
+
+        Returns:
+            List[Dict[str, float]]: Predictions for each text, in input order
+        """
+        results: List[Dict[str, float]] = [{} for _ in texts]
+        pending = []
+        keyword_hits = {}
+
+        # Stage 1: keyword gate, per text
+        for i, text in enumerate(texts):
+            if not text or text.strip() == "":
+                continue
+            scores, hits = self.keyword_gate.score(text)
+            if hits >= self.keyword_min_hits and next(iter(scores.values())) >= self.keyword_accept:
+                self._record_exit(STAGE_KEYWORD)
+                results[i] = self._finalize(scores, threshold, top_k)
+                continue
+            keyword_hits[i] = hits
+            pending.append(i)
+
+        # Stage 2: TF-IDF model, batched
+        if self.fast_classifier.is_fitted():
+            remaining = []
+            for start in range(0, len(pending), batch_size):
+                check_cancelled()
+                chunk = pending[start:start + batch_size]
+                rows = self.fast_classifier.traditional_scores([texts[i] for i in chunk])
+                for i, row in zip(chunk, rows):
+                    ranked = sorted((float(score) for score in row), reverse=True)
+                    runner_up = ranked[1] if len(ranked) > 1 else 0.0
+                    if ranked[0] < self.tfidf_reject and not keyword_hits[i]:
+                        self._record_exit(STAGE_TFIDF_REJECT)
+                    elif ranked[0] >= self.tfidf_accept and ranked[0] - runner_up >= self.tfidf_margin:
+                        self._record_exit(STAGE_TFIDF_ACCEPT)
+                        scores = {TECH_CATEGORIES[j]: float(score) for j, score in enumerate(row)}
+                        results[i] = self._finalize(scores, threshold, top_k)
+                    else:
+                        remaining.append(i)
+            pending = remaining
+        elif self.reject_without_keywords:
+            for i in pending:
+                if not keyword_hits[i]:
+                    self._record_exit(STAGE_KEYWORD_REJECT)
+            pending = [i for i in pending if keyword_hits[i]]
+
+        # Stage 3: transformer, batched
+        if pending:
+            check_cancelled()
+            for _ in pending:
+                self._record_exit(STAGE_TRANSFORMER)
+            predictions = self.slow_classifier.predict_batch(
+                [texts[i] for i in pending], threshold=threshold, top_k=top_k, batch_size=batch_size
+            )
+            for i, prediction in zip(pending, predictions):
+                results[i] = prediction
+
+        return results
+
+    def stats(self) -> Dict:
+        """
+        Get per-stage exit counts and rates.
+
+        Returns:
+            Dict: Total classifications, exits per stage and exit rate per stage
+        """
+        with self._lock:
+            exits = dict(self._exits)
+
+        total = sum(exits.values())
+        return {
+            "total": total,
+            "exits": exits,
+            "exit_rates": {stage: (count / total if total else 0.0) for stage, count in exits.items()},
+            "bands": {
+                "keyword_min_hits": self.keyword_min_hits,
+                "keyword_accept": self.keyword_accept,
+                "reject_without_keywords": self.reject_without_keywords,
+                "tfidf_accept": self.tfidf_accept,
+                "tfidf_margin": self.tfidf_margin,
+                "tfidf_reject": self.tfidf_reject,
+            }
+        }
+
+    def reset_stats(self):
+        """
+        Reset exit counters.
+        """
+        with self._lock:
+            self._exits = {stage: 0 for stage in STAGES}
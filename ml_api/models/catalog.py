@@ -0,0 +1,550 @@
+"""
+Content Catalog
+
+Server-side copy of the recommendable content items, kept in sync by the backend
+with batched upsert/delete deltas instead of shipping the whole pool with every
+recommendation request. Recommendation requests select a pool from the catalog
+with filters (type, recency, ids).
+
+The catalog is stored in a local SQLite file shared by every worker process on
+the machine. Each delta batch gets the next catalog version; every worker keeps
+an in-memory mirror and catches up by reading the rows changed since its
+version, so filters are answered from memory. The backend passes its own opaque
+cursor with each batch, which lets it detect lost batches and resume after
+restarts from the last cursor the catalog applied.
+
+Listeners that derive per-item features run on the background sync thread only.
+A delta applied by a request updates the mirror and wakes that thread, so the
+backend's sync call never waits for them.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Set
+
+from utils.logger import get_logger
+from utils.memory import sampled_sizeof
+from utils.text_preprocessing import prepare_text
+
+logger = get_logger(__name__)
+
+CATALOG_DB_PATH = Path(os.getenv(
+    "ML_CATALOG_DB", str(Path(__file__).parent.parent / "cache" / "catalog.db")
+))
+
+# Called with the upserted items and the deleted ids after the mirror changed
+CatalogListener = Callable[[List[Dict[str, Any]], List[str]], None]
+
+
+class CursorConflict(Exception):
+    """
+    A delta batch does not continue from the cursor the catalog last applied.
+    """
+
+    def __init__(self, cursor: Optional[str]):
+        super().__init__(f"Catalog is at cursor {cursor!r}")
+        self.cursor = cursor
+
+
+def parse_timestamp(value: Any) -> Optional[float]:
+    """
+    Convert epoch seconds or an ISO 8601 string to epoch seconds.
+
+    Args:
+        value: Timestamp as a number, an ISO 8601 string or None
+
+    Returns:
+        float or None: Epoch seconds, or None if the value is empty
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    return datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp()
+
+
+class ContentCatalog:
+    """
+    Versioned content catalog with an in-memory mirror per worker process.
+    """
+
+    _SCHEMA = """
+    CREATE TABLE IF NOT EXISTS items (
+        item_id TEXT PRIMARY KEY,
+        item TEXT,
+        item_type TEXT,
+        published_at REAL,
+        deleted INTEGER NOT NULL DEFAULT 0,
+        version INTEGER NOT NULL,
+        updated_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS items_version ON items (version);
+    CREATE TABLE IF NOT EXISTS meta (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    );
+    """
+
+    def __init__(self, path: Path = CATALOG_DB_PATH, sync_interval: float = 1.0,
+                 max_pool: int = 5000, tombstone_ttl: float = 86400.0):
+        """
+        Initialize the catalog.
+
+        Args:
+            path (Path): SQLite file shared by the worker processes
+            sync_interval (float): Seconds between checks for changes made by other workers
+            max_pool (int): Maximum number of items a filter returns, most recent first
+            tombstone_ttl (float): Seconds deleted items are remembered for workers that are behind
+        """
+        self.path = Path(path)
+        self.sync_interval = sync_interval
+        self.max_pool = max_pool
+        self.tombstone_ttl = tombstone_ttl
+
+        self._local = threading.local()
+        self._lock = threading.RLock()
+        # Serializes syncs, which read and parse changes outside the mirror lock
+        self._sync_lock = threading.Lock()
+        self._listeners: List[CatalogListener] = []
+        # Changes not yet passed to the listeners, merged across syncs
+        self._notify_upserts: Dict[str, Dict[str, Any]] = {}
+        self._notify_deletes: Set[str] = set()
+        self._notify_lock = threading.Lock()
+
+        # In-memory mirror as of self._version
+        self._version = 0
+        self._items: Dict[str, Dict[str, Any]] = {}
+        self._published: Dict[str, float] = {}
+        self._types: Dict[str, Optional[str]] = {}
+        self._fingerprints: Dict[str, str] = {}
+        # Item ids sorted by publication time, most recent first; rebuilt lazily after changes
+        self._recent: Optional[List[str]] = None
+        self._last_sync = 0.0
+
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._stats = {"batches": 0, "upserted": 0, "deleted": 0, "conflicts": 0, "syncs": 0, "reloads": 0}
+
+    @classmethod
+    def from_env(cls) -> "ContentCatalog":
+        """
+        Build a catalog configured from environment variables.
+
+        Returns:
+            ContentCatalog: Configured catalog
+        """
+        return cls(
+            sync_interval=float(os.getenv("ML_CATALOG_SYNC_INTERVAL", 1.0)),
+            max_pool=int(os.getenv("ML_CATALOG_MAX_POOL", 5000)),
+            tombstone_ttl=float(os.getenv("ML_CATALOG_TOMBSTONE_TTL", 86400))
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        Get this thread's connection, reopening it after a fork.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.path), timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            conn.executescript(self._SCHEMA)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def _meta(conn: sqlite3.Connection, key: str) -> Optional[str]:
+        row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    @staticmethod
+    def _set_meta(conn: sqlite3.Connection, key: str, value: Optional[str]):
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def add_listener(self, listener: CatalogListener):
+        """
+        Register a callback run after items entered or left this worker's mirror.
+
+        Listeners run on the background sync thread, or on the syncing thread
+        when the sync thread is not started, so they can precompute per-item
+        features without holding up requests.
+
+        Args:
+            listener (CatalogListener): Called with the upserted items and the deleted ids
+        """
+        self._listeners.append(listener)
+
+    def apply_delta(self, upserts: Sequence[Dict[str, Any]] = (), deletes: Iterable[str] = (),
+                    cursor: Optional[str] = None, base_cursor: Optional[str] = None,
+                    reset: bool = False) -> Dict[str, Any]:
+        """
+        Apply a batch of upserts and deletes as the next catalog version.
+
+        Args:
+            upserts (Sequence[Dict]): Items with an `id` and optionally `type` and `published_at`
+            deletes (Iterable[str]): Ids of items to remove
+            cursor (str, optional): Backend cursor after this batch, returned by stats()
+            base_cursor (str, optional): Backend cursor this batch continues from; checked unless None
+            reset (bool): Remove all items before applying the batch (start of a full resync)
+
+        Returns:
+            Dict[str, Any]: Catalog version and cursor after the batch, and whether it was applied
+
+        Raises:
+            CursorConflict: base_cursor does not match the cursor the catalog last applied
+            ValueError: An upserted item has no id
+        """
+        rows = []
+        for item in upserts:
+            item_id = item.get("id")
+            if item_id is None or item_id == "":
+                raise ValueError("Catalog items need an id")
+            # Ids are compared as strings, so deletes match whatever type the backend used
+            item = {**item, "id": str(item_id)}
+            rows.append((
+                item["id"], json.dumps(item), item.get("type"), parse_timestamp(item.get("published_at"))
+            ))
+        deleted_ids = [str(item_id) for item_id in deletes]
+
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            current_cursor = self._meta(conn, "cursor")
+            if base_cursor is not None and not reset and base_cursor != current_cursor:
+                conn.execute("ROLLBACK")
+                if cursor is not None and cursor == current_cursor:
+                    # A retry of the batch that was already applied
+                    return {"version": self._version, "cursor": current_cursor, "applied": False}
+                with self._lock:
+                    self._stats["conflicts"] += 1
+                raise CursorConflict(current_cursor)
+
+            version = int(self._meta(conn, "version") or 0) + 1
+            now = time.time()
+            if reset:
+                conn.execute(
+                    "UPDATE items SET item = NULL, deleted = 1, version = ?, updated_at = ? WHERE deleted = 0",
+                    (version, now)
+                )
+            conn.executemany(
+                "INSERT OR REPLACE INTO items (item_id, item, item_type, published_at, deleted, version, updated_at) "
+                "VALUES (?, ?, ?, ?, 0, ?, ?)",
+                [row + (version, now) for row in rows]
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO items (item_id, item, item_type, published_at, deleted, version, updated_at) "
+                "VALUES (?, NULL, NULL, NULL, 1, ?, ?)",
+                [(item_id, version, now) for item_id in deleted_ids]
+            )
+            self._set_meta(conn, "version", str(version))
+            if cursor is not None or reset:
+                self._set_meta(conn, "cursor", cursor)
+            self._prune_tombstones(conn, now)
+            conn.execute("COMMIT")
+        except CursorConflict:
+            raise
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        with self._lock:
+            self._stats["batches"] += 1
+            self._stats["upserted"] += len(rows)
+            self._stats["deleted"] += len(deleted_ids)
+
+        # This worker sees its own writes immediately; the others on their next sync.
+        # Listeners are left to the sync thread, woken here.
+        self.sync(force=True)
+        self._wake.set()
+        return {"version": version, "cursor": cursor, "applied": True}
+
+    def _prune_tombstones(self, conn: sqlite3.Connection, now: float):
+        """
+        Drop expired tombstones; workers that are older than the pruned versions reload fully.
+        """
+        row = conn.execute(
+            "SELECT MAX(version) FROM items WHERE deleted = 1 AND updated_at < ?", (now - self.tombstone_ttl,)
+        ).fetchone()
+        if row[0] is None:
+            return
+        conn.execute("DELETE FROM items WHERE deleted = 1 AND version <= ?", (row[0],))
+        pruned = int(self._meta(conn, "pruned_version") or 0)
+        self._set_meta(conn, "pruned_version", str(max(pruned, row[0])))
+
+    def sync(self, force: bool = False) -> int:
+        """
+        Bring this worker's mirror up to the latest catalog version.
+
+        Items are parsed outside the mirror lock, so queries keep being answered
+        from the previous version while a large batch is loaded.
+
+        Args:
+            force (bool): Wait for a sync in progress and check for changes even if
+                the last check was under sync_interval ago
+
+        Returns:
+            int: Number of changed items applied to the mirror
+        """
+        if not force and time.time() - self._last_sync < self.sync_interval:
+            return 0
+        if not self._sync_lock.acquire(blocking=force):
+            # Another thread is syncing; serve from the current mirror
+            return 0
+
+        try:
+            self._last_sync = time.time()
+            conn = self._connection()
+            # One read transaction, so the rows and the version come from the same snapshot
+            conn.execute("BEGIN")
+            try:
+                version = int(self._meta(conn, "version") or 0)
+                pruned = int(self._meta(conn, "pruned_version") or 0)
+                since = self._version if self._version >= pruned else 0
+                rows = conn.execute(
+                    "SELECT item_id, item, item_type, published_at, deleted FROM items "
+                    "WHERE version > ? ORDER BY version",
+                    (since,)
+                ).fetchall()
+            finally:
+                conn.execute("COMMIT")
+            if version == self._version and since == self._version:
+                return 0
+
+            changes = []
+            for item_id, item_json, item_type, published_at, is_deleted in rows:
+                if is_deleted:
+                    changes.append((item_id, None, None, None, None))
+                    continue
+                item = json.loads(item_json)
+                fingerprint = prepare_text(
+                    {"title": item.get("title"), "description": item.get("description")}
+                ).fingerprint
+                changes.append((item_id, item, item_type, published_at or 0.0, fingerprint))
+
+            upserted: Dict[str, Dict[str, Any]] = {}
+            deleted: Set[str] = set()
+            with self._lock:
+                if since < self._version:
+                    # Deletes this mirror has not seen may have been pruned; start over
+                    deleted = set(self._items)
+                    self._clear()
+                    self._stats["reloads"] += 1
+
+                for item_id, item, item_type, published_at, fingerprint in changes:
+                    if item is None:
+                        if self._items.pop(item_id, None) is not None:
+                            deleted.add(item_id)
+                        upserted.pop(item_id, None)
+                        self._published.pop(item_id, None)
+                        self._types.pop(item_id, None)
+                        self._fingerprints.pop(item_id, None)
+                    else:
+                        self._items[item_id] = item
+                        self._published[item_id] = published_at
+                        self._types[item_id] = item_type
+                        self._fingerprints[item_id] = fingerprint
+                        upserted[item_id] = item
+                        deleted.discard(item_id)
+
+                self._version = version
+                self._recent = None
+                self._stats["syncs"] += 1
+        finally:
+            self._sync_lock.release()
+
+        with self._notify_lock:
+            for item_id in deleted:
+                self._notify_upserts.pop(item_id, None)
+                self._notify_deletes.add(item_id)
+            for item_id, item in upserted.items():
+                self._notify_deletes.discard(item_id)
+                self._notify_upserts[item_id] = item
+
+        if self._thread is None or threading.current_thread() is self._thread:
+            self._notify()
+        return len(upserted) + len(deleted)
+
+    def _notify(self):
+        """
+        Pass the changes accumulated since the last call to the listeners.
+        """
+        with self._notify_lock:
+            changed = list(self._notify_upserts.values())
+            removed = sorted(self._notify_deletes)
+            self._notify_upserts = {}
+            self._notify_deletes = set()
+        if not changed and not removed:
+            return
+
+        for listener in self._listeners:
+            try:
+                listener(changed, removed)
+            except Exception as e:
+                logger.error(f"Catalog listener failed: {str(e)}")
+
+    def _clear(self):
+        self._items = {}
+        self._published = {}
+        self._types = {}
+        self._fingerprints = {}
+        self._recent = None
+
+    def _recent_ids(self) -> List[str]:
+        if self._recent is None:
+            self._recent = sorted(self._items, key=lambda item_id: self._published[item_id], reverse=True)
+        return self._recent
+
+    def query(self, types: Optional[Sequence[str]] = None, ids: Optional[Sequence[str]] = None,
+              exclude_ids: Optional[Sequence[str]] = None, published_after: Any = None,
+              max_age_days: Optional[float] = None, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Select catalog items, most recently published first.
+
+        Args:
+            types (Sequence[str], optional): Content types to include (video, article, short)
+            ids (Sequence[str], optional): Restrict the pool to these item ids
+            exclude_ids (Sequence[str], optional): Item ids to leave out, e.g. already seen items
+            published_after (optional): Epoch seconds or ISO 8601 timestamp of the oldest item
+            max_age_days (float, optional): Only items published within this many days
+            limit (int, optional): Maximum number of items, capped at max_pool
+
+        Returns:
+            List[Dict[str, Any]]: Matching items as upserted by the backend
+        """
+        self.sync()
+
+        cutoff = parse_timestamp(published_after)
+        if max_age_days is not None:
+            age_cutoff = time.time() - max_age_days * 86400.0
+            cutoff = age_cutoff if cutoff is None else max(cutoff, age_cutoff)
+        limit = min(limit or self.max_pool, self.max_pool)
+        type_set = set(types) if types else None
+        excluded = set(exclude_ids) if exclude_ids else ()
+
+        with self._lock:
+            if ids is not None:
+                candidates = sorted(
+                    (item_id for item_id in set(ids) if item_id in self._items),
+                    key=lambda item_id: self._published[item_id], reverse=True
+                )
+            else:
+                candidates = self._recent_ids()
+
+            pool = []
+            for item_id in candidates:
+                if cutoff is not None and self._published[item_id] < cutoff:
+                    # Candidates are ordered by publication time, so the rest are older
+                    break
+                if item_id in excluded or (type_set is not None and self._types[item_id] not in type_set):
+                    continue
+                pool.append(self._items[item_id])
+                if len(pool) >= limit:
+                    break
+            return pool
+
+    def fingerprint(self, item: Dict[str, Any]) -> Optional[str]:
+        """
+        Text fingerprint of an item returned by query(), computed once when it was synced.
+
+        Args:
+            item (Dict[str, Any]): Item as returned by query()
+
+        Returns:
+            str or None: Fingerprint of the item's title and description, or None if
+                the item is not this catalog's current copy
+        """
+        item_id = item.get("id")
+        with self._lock:
+            if item_id is None or self._items.get(str(item_id)) is not item:
+                return None
+            return self._fingerprints.get(str(item_id))
+
+    def items(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Most recently published items of the mirror.
+
+        Args:
+            limit (int, optional): Maximum number of items
+
+        Returns:
+            List[Dict[str, Any]]: Items, most recent first
+        """
+        self.sync()
+        with self._lock:
+            return [self._items[item_id] for item_id in self._recent_ids()[:limit]]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._items)
+
+    def start(self):
+        """
+        Start the background thread that keeps the mirror in sync.
+        """
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="catalog-sync", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """
+        Stop the sync thread.
+        """
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.clear()
+            try:
+                self.sync(force=True)
+            except Exception as e:
+                logger.error(f"Catalog sync failed: {str(e)}")
+            self._notify()
+            # Woken early by deltas this worker applied
+            self._wake.wait(self.sync_interval)
+
+    def memory_usage(self) -> Dict[str, Any]:
+        """
+        Estimated bytes held by this worker's mirror.
+        """
+        with self._lock:
+            entries = len(self._items)
+            size = sampled_sizeof(self._items.items(), entries)
+            size += sampled_sizeof(self._fingerprints.items(), entries)
+        return {"bytes": size, "entries": entries}
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Catalog size, versions and sync counters.
+
+        Returns:
+            Dict[str, Any]: Statistics, including the backend cursor to resume syncing from
+        """
+        conn = self._connection()
+        with self._lock:
+            types: Dict[str, int] = {}
+            for item_type in self._types.values():
+                types[item_type or "unknown"] = types.get(item_type or "unknown", 0) + 1
+            return {
+                "items": len(self._items),
+                "types": types,
+                "version": int(self._meta(conn, "version") or 0),
+                "mirror_version": self._version,
+                "cursor": self._meta(conn, "cursor"),
+                "path": str(self.path),
+                **self._stats
+            }
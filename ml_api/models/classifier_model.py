@@ -6,11 +6,13 @@ It can classify content into various tech categories like Python, JavaScript, We
 """
 
 import os
+import threading
 import numpy as np
 import pandas as pd
 import pickle
 import joblib
-from typing import List, Dict, Union, Optional
+from collections import OrderedDict
+from typing import List, Dict, Union, Optional, Tuple
 from pathlib import Path
 
 from sklearn.pipeline import Pipeline
@@ -19,6 +21,8 @@ from sklearn.multiclass import OneVsRestClassifier
 from sklearn.svm import LinearSVC
 from sklearn.preprocessing import MultiLabelBinarizer
 from sklearn.metrics import f1_score, precision_score, recall_score
+from sklearn.exceptions import NotFittedError
+from sklearn.utils.validation import check_is_fitted
 
 # For deep learning based classification
 import torch
@@ -27,6 +31,14 @@ from sentence_transformers import SentenceTransformer
 
 # Local imports
 from utils.logger import get_logger
+from models.recommendation_store import MaterializedRecommendations
+from models.candidate_index import CategoryIndex
+from models.near_duplicate import NearDuplicateIndex
+from models.profile_store import InMemoryProfileStore, ProfileStore
+from models.catalog import ContentCatalog
+from utils.deadline import check_cancelled
+from utils.text_preprocessing import prepare_text
+from utils.memory import sampled_sizeof
 
 logger = get_logger(__name__)
 
@@ -59,6 +71,7 @@ class TechContentClassifier:
         self.model_type = model_type
         self.model = None
         self.tokenizer = None
+        self._category_embeddings = None
         self.label_binarizer = MultiLabelBinarizer()
         self.label_binarizer.fit([TECH_CATEGORIES])
         
@@ -149,6 +162,58 @@ class TechContentClassifier:
         
         return metrics
     
+    def category_embeddings(self):
+        """
+        Get sentence embeddings of TECH_CATEGORIES, encoding them only once.
+        
+        Returns:
+            torch.Tensor or None: Category embeddings, or None if the model is not a sentence transformer
+        """
+        if not isinstance(self.model, SentenceTransformer):
+            return None
+        
+        if self._category_embeddings is None:
+            self._category_embeddings = self.model.encode(TECH_CATEGORIES, convert_to_tensor=True)
+        return self._category_embeddings
+    
+    def is_fitted(self) -> bool:
+        """
+        Check whether the traditional pipeline has been fitted.
+        
+        Returns:
+            bool: True if the TF-IDF pipeline can produce predictions
+        """
+        if self.model_type != "traditional" or self.model is None:
+            return False
+        
+        try:
+            check_is_fitted(self.model.named_steps['classifier'])
+            return True
+        except NotFittedError:
+            return False
+    
+    def traditional_scores(self, texts: List[str]) -> np.ndarray:
+        """
+        Score texts against every category with the traditional pipeline.
+        
+        LinearSVC does not expose predict_proba, so decision function margins
+        are squashed through a sigmoid to get comparable [0, 1] scores.
+        
+        Args:
+            texts (List[str]): Texts to score
+        
+        Returns:
+            np.ndarray: Array of shape (len(texts), len(TECH_CATEGORIES))
+        """
+        if hasattr(self.model, 'predict_proba'):
+            try:
+                return np.asarray(self.model.predict_proba(texts))
+            except AttributeError:
+                pass
+        
+        margins = np.asarray(self.model.decision_function(texts))
+        return 1.0 / (1.0 + np.exp(-margins))
+    
     def predict(self, text: str, threshold: float = 0.5, top_k: Optional[int] = None) -> Dict[str, float]:
         """
         Predict tech categories for the given text.
@@ -166,7 +231,7 @@ class TechContentClassifier:
         
         if self.model_type == "traditional":
             # For traditional model
-            y_pred = self.model.predict_proba([text])[0]
+            y_pred = self.traditional_scores([text])[0]
             
             # Map probabilities to categories
             predictions = {
@@ -180,10 +245,8 @@ class TechContentClassifier:
                 # This is a simplified approach
                 text_embedding = self.model.encode(text, convert_to_tensor=True)
                 
-                # Compute similarity with category embeddings
-                # In a real implementation, we'd have pre-computed embeddings for categories
-                # or a more sophisticated approach
-                category_embeddings = self.model.encode(TECH_CATEGORIES, convert_to_tensor=True)
+                # Compute similarity with the (cached) category embeddings
+                category_embeddings = self.category_embeddings()
                 
                 # Compute cosine similarity
                 similarities = torch.nn.functional.cosine_similarity(
@@ -217,7 +280,76 @@ class TechContentClassifier:
             predictions = dict(list(predictions.items())[:top_k])
         
         return predictions
-    
+
+    def _batch_scores(self, texts: List[str]) -> List[List[float]]:
+        """
+        Score a batch of non-empty texts against every category in one model call.
+
+        Args:
+            texts (List[str]): Texts to score
+
+        Returns:
+            List[List[float]]: One row of scores per text, in TECH_CATEGORIES order
+        """
+        if self.model_type == "traditional":
+            return self.traditional_scores(texts).tolist()
+
+        if isinstance(self.model, SentenceTransformer):
+            text_embeddings = self.model.encode(texts, convert_to_tensor=True)
+            category_embeddings = self.category_embeddings()
+            similarities = torch.nn.functional.cosine_similarity(
+                text_embeddings.unsqueeze(1), category_embeddings.unsqueeze(0), dim=-1
+            )
+            return similarities.tolist()
+
+        inputs = self.tokenizer(texts, return_tensors="pt", truncation=True, padding=True, max_length=512)
+        with torch.no_grad():
+            outputs = self.model(**inputs)
+        return torch.sigmoid(outputs.logits).tolist()
+
+    def _format_predictions(self, scores: List[float], threshold: float,
+                            top_k: Optional[int]) -> Dict[str, float]:
+        """
+        Turn a row of category scores into a sorted, thresholded prediction dict.
+        """
+        predictions = {
+            self.idx_to_category[i]: float(score)
+            for i, score in enumerate(scores) if score >= threshold
+        }
+        predictions = dict(sorted(predictions.items(), key=lambda x: x[1], reverse=True))
+
+        if top_k and len(predictions) > top_k:
+            predictions = dict(list(predictions.items())[:top_k])
+
+        return predictions
+
+    def predict_batch(self, texts: List[str], threshold: float = 0.5, top_k: Optional[int] = None,
+                      batch_size: int = 32) -> List[Dict[str, float]]:
+        """
+        Predict tech categories for many texts, running the model once per batch.
+
+        Args:
+            texts (List[str]): The texts to classify
+            threshold (float): Confidence threshold for including a category
+            top_k (int, optional): Return only top k predictions
+            batch_size (int): Number of texts sent to the model per call
+
+        Returns:
+            List[Dict[str, float]]: Predictions for each text, in input order
+        """
+        results: List[Dict[str, float]] = [{} for _ in texts]
+        indices = [i for i, text in enumerate(texts) if text and text.strip()]
+
+        for start in range(0, len(indices), batch_size):
+            # Stop between batches if the request was abandoned
+            check_cancelled()
+            chunk = indices[start:start + batch_size]
+            scores = self._batch_scores([texts[i] for i in chunk])
+            for i, row in zip(chunk, scores):
+                results[i] = self._format_predictions(row, threshold, top_k)
+
+        return results
+
     def save(self, path: Optional[str] = None):
         """
         Save the model to disk.
@@ -249,6 +381,8 @@ class TechContentClassifier:
         if not path:
             path = MODEL_DIR / f"tech_classifier_{self.model_type}"
         
+        self._category_embeddings = None
+        
         if self.model_type == "traditional":
             try:
                 self.model = joblib.load(path)
@@ -269,15 +403,45 @@ class ContentRecommender:
     A recommender system for tech content based on user preferences.
     """
     
-    def __init__(self, classifier: TechContentClassifier = None):
+    def __init__(self, classifier: TechContentClassifier = None,
+                 materialized: Optional[MaterializedRecommendations] = None,
+                 item_cache_size: int = 50000,
+                 candidate_min_pool: int = 200,
+                 candidate_categories: int = 5,
+                 exploration: float = 0.1,
+                 near_duplicates: Optional[NearDuplicateIndex] = None,
+                 profile_store: Optional[ProfileStore] = None,
+                 catalog: Optional[ContentCatalog] = None):
         """
         Initialize the content recommender.
         
         Args:
             classifier (TechContentClassifier, optional): Classifier to use for content analysis
+            materialized (MaterializedRecommendations, optional): Store of per-user top-N lists
+            item_cache_size (int): Maximum number of content items whose categories are cached
+            candidate_min_pool (int): Pool size from which candidates come from the category index
+            candidate_categories (int): Number of a user's strongest categories scanned for candidates
+            exploration (float): Fraction of recommendation slots filled from other categories
+            near_duplicates (NearDuplicateIndex, optional): Index used to reuse the categories of reposts
+            profile_store (ProfileStore, optional): Storage of user interest profiles, in memory by default
+            catalog (ContentCatalog, optional): Server-side catalog whose items carry precomputed text fingerprints
         """
         self.classifier = classifier or TechContentClassifier()
-        self.user_profiles = {}  # Maps user_id to their interest profile
+        self.profile_store = profile_store or InMemoryProfileStore(TECH_CATEGORIES)
+        self.materialized = materialized or MaterializedRecommendations()
+        self.category_index = CategoryIndex()
+        self.candidate_min_pool = candidate_min_pool
+        self.candidate_categories = candidate_categories
+        self.exploration = exploration
+        self.near_duplicates = near_duplicates
+        self.catalog = catalog
+        
+        # Maps item id to (text hash, predicted categories) so pool items are classified once
+        self.item_cache_size = item_cache_size
+        self._item_categories: "OrderedDict[object, Tuple[str, Dict[str, float]]]" = OrderedDict()
+        
+        # Requests are served from worker threads, so shared state is guarded
+        self._lock = threading.RLock()
     
     def update_user_profile(self, user_id: str, content_interaction: Dict):
         """
@@ -287,26 +451,30 @@ class ContentRecommender:
             user_id (str): User ID
             content_interaction (Dict): Details of the content interaction
         """
-        if user_id not in self.user_profiles:
-            self.user_profiles[user_id] = {category: 0.0 for category in TECH_CATEGORIES}
-        
         content_text = content_interaction.get('text', '')
         interaction_type = content_interaction.get('interaction_type', 'view')
         
         # Get content categories
-        categories = self.classifier.predict(content_text)
+        categories = self._predict(content_text)
         
         # Update weights based on interaction type
         weight = self._get_interaction_weight(interaction_type)
         
-        # Update user profile
-        for category, confidence in categories.items():
-            if category in self.user_profiles[user_id]:
-                # Gradually update the profile using weighted average
-                current_weight = self.user_profiles[user_id][category]
-                self.user_profiles[user_id][category] = (
-                    0.8 * current_weight + 0.2 * confidence * weight
-                )
+        # Gradually update the profile using weighted average; the store applies
+        # the update so concurrent interactions of a user are not lost
+        update = {
+            category: (0.8, 0.2 * confidence * weight)
+            for category, confidence in categories.items() if category in TECH_CATEGORIES
+        }
+        self.profile_store.apply(user_id, update)
+    
+    def _predict(self, text: str) -> Dict[str, float]:
+        """
+        Classify content text, reusing the categories of a near-duplicate if one is known.
+        """
+        if self.near_duplicates is None:
+            return self.classifier.predict(text)
+        return self.near_duplicates.predict(self.classifier.predict, text)
     
     def _get_interaction_weight(self, interaction_type: str) -> float:
         """
@@ -329,11 +497,164 @@ class ContentRecommender:
         
         return weights.get(interaction_type.lower(), 0.5)
     
+    def _get_item_categories(self, item: Dict) -> Dict[str, float]:
+        """
+        Get the predicted categories of a content item, classifying it only once.
+        
+        Args:
+            item (Dict): Content item with title and description
+            
+        Returns:
+            Dict[str, float]: Category -> confidence
+        """
+        # Catalog items carry the fingerprint computed when they were synced
+        text_hash = self.catalog.fingerprint(item) if self.catalog is not None else None
+        prepared = None
+        if text_hash is None:
+            prepared = prepare_text({'title': item.get('title'), 'description': item.get('description')})
+            # Stable across processes so snapshots taken before a restart stay valid
+            text_hash = prepared.fingerprint
+        item_id = item.get('id')
+        key = item_id if item_id is not None else ('text', text_hash)
+        
+        with self._lock:
+            cached = self._item_categories.get(key)
+            if cached is not None and cached[0] == text_hash:
+                self._item_categories.move_to_end(key)
+                return cached[1]
+        
+        if prepared is None:
+            prepared = prepare_text({'title': item.get('title'), 'description': item.get('description')})
+        categories = self._predict(prepared.text)
+        
+        with self._lock:
+            self._item_categories[key] = (text_hash, categories)
+            self._item_categories.move_to_end(key)
+            if item_id is not None:
+                self.category_index.add(item_id, categories)
+            
+            if len(self._item_categories) > self.item_cache_size:
+                evicted_key, _ = self._item_categories.popitem(last=False)
+                if not isinstance(evicted_key, tuple):
+                    self.category_index.remove(evicted_key)
+        
+        return categories
+    
+    def on_catalog_change(self, items: List[Dict], deleted_ids: List[str]):
+        """
+        Precompute the categories of changed catalog items and forget deleted ones.
+        
+        Registered as a catalog listener once the models are warm, so it runs on
+        the catalog's sync thread, off the request path. At most item_cache_size
+        of the most recently published items are classified.
+        
+        Args:
+            items (List[Dict]): Items that were added or changed
+            deleted_ids (List[str]): Ids of items that left the catalog
+        """
+        with self._lock:
+            for item_id in deleted_ids:
+                if self._item_categories.pop(item_id, None) is not None:
+                    self.category_index.remove(item_id)
+        
+        if len(items) > self.item_cache_size:
+            recent = {id(item) for item in self.catalog.items(self.item_cache_size)}
+            items = [item for item in items if id(item) in recent]
+        for item in items:
+            try:
+                self._get_item_categories(item)
+            except Exception as e:
+                logger.warning(f"Could not precompute categories of catalog item {item.get('id')}: {str(e)}")
+    
+    def snapshot_items(self, limit: int = 10000) -> List[Dict]:
+        """
+        Export the most recently used item classifications.
+        
+        Args:
+            limit (int): Maximum number of items to export
+            
+        Returns:
+            List[Dict]: Entries with id, text_hash and categories
+        """
+        with self._lock:
+            entries = list(self._item_categories.items())[-limit:]
+        
+        return [
+            {'id': key, 'text_hash': text_hash, 'categories': categories}
+            for key, (text_hash, categories) in entries if not isinstance(key, tuple)
+        ]
+    
+    def restore_items(self, entries: List[Dict]) -> int:
+        """
+        Prefill the item classification cache and category index from a snapshot.
+        
+        Args:
+            entries (List[Dict]): Entries produced by snapshot_items
+            
+        Returns:
+            int: Number of restored items
+        """
+        with self._lock:
+            for entry in entries[-self.item_cache_size:]:
+                self._item_categories[entry['id']] = (entry['text_hash'], entry['categories'])
+                self.category_index.add(entry['id'], entry['categories'])
+        return len(entries[-self.item_cache_size:])
+    
+    def shrink_item_cache(self, fraction: float):
+        """
+        Drop the given fraction of the least recently used item classifications.
+        
+        Args:
+            fraction (float): Fraction of cached items to drop
+        """
+        with self._lock:
+            for _ in range(int(len(self._item_categories) * fraction)):
+                evicted_key, _ = self._item_categories.popitem(last=False)
+                if not isinstance(evicted_key, tuple):
+                    self.category_index.remove(evicted_key)
+    
+    def item_cache_memory_usage(self) -> Dict[str, int]:
+        """
+        Estimated bytes held by cached item classifications.
+        """
+        with self._lock:
+            entries = len(self._item_categories)
+            return {"bytes": sampled_sizeof(self._item_categories.items(), entries), "entries": entries}
+    
+    def _score_items(self, user_profile: Dict[str, float], 
+                     content_items: List[Dict]) -> List[Tuple[float, int]]:
+        """
+        Score content items against a user profile.
+        
+        Returns:
+            List[Tuple[float, int]]: (score, index into content_items) pairs sorted by score, descending
+        """
+        scored_items = []
+        for index, item in enumerate(content_items):
+            if index % 256 == 0:
+                check_cancelled()
+            categories = self._get_item_categories(item)
+            
+            # Calculate similarity score with user profile
+            score = 0
+            for category, confidence in categories.items():
+                if category in user_profile:
+                    score += confidence * user_profile[category]
+            
+            scored_items.append((score, index))
+        
+        # Sort by score (descending), keeping pool order for ties
+        scored_items.sort(key=lambda x: x[0], reverse=True)
+        return scored_items
+    
     def get_recommendations(self, user_id: str, content_items: List[Dict], 
                            num_recommendations: int = 10) -> List[Dict]:
         """
         Get content recommendations for a user.
         
+        Rankings are materialized per user: while the user's profile stays within
+        tolerance and the pool only gains items, only the new items are scored.
+        
         Args:
             user_id (str): User ID
             content_items (List[Dict]): Pool of content items to recommend from
@@ -342,32 +663,106 @@ class ContentRecommender:
         Returns:
             List[Dict]: Recommended content items
         """
-        if user_id not in self.user_profiles:
+        user_profile = self.profile_store.get(user_id)
+        if user_profile is None:
             # No profile, return random recommendations
             import random
             return random.sample(content_items, min(num_recommendations, len(content_items)))
         
-        user_profile = self.user_profiles[user_id]
-        
-        # Calculate scores for each content item
-        scored_items = []
-        for item in content_items:
-            text = item.get('title', '') + ' ' + item.get('description', '')
-            categories = self.classifier.predict(text)
+        # Items without ids cannot be tracked between calls, so rank them from scratch
+        items_by_id = {item.get('id'): item for item in content_items}
+        if None in items_by_id or len(items_by_id) != len(content_items):
+            scored_items = self._score_items(user_profile, content_items)
+            return [content_items[index] for _, index in scored_items[:num_recommendations]]
+        
+        pool_ids = frozenset(items_by_id)
+        pool_version = self.materialized.pool_version(pool_ids)
+        use_index = len(content_items) >= self.candidate_min_pool
+        entry = self.materialized.get(user_id, user_profile)
+        
+        if entry is not None and num_recommendations <= self.materialized.top_n:
+            if entry.pool_version == pool_version:
+                self.materialized.record("hits")
+                return self._select(user_profile, entry.ranked, items_by_id, num_recommendations, use_index)
             
-            # Calculate similarity score with user profile
-            score = 0
-            for category, confidence in categories.items():
-                if category in user_profile:
-                    score += confidence * user_profile[category]
-            
-            scored_items.append((item, score))
-        
-        # Sort by score (descending)
-        scored_items.sort(key=lambda x: x[1], reverse=True)
+            # The previous pool is only known while it is among the recent pools
+            previous_ids = self.materialized.pool(entry.pool_version)
+            if previous_ids is not None:
+                removed_ids = previous_ids - pool_ids
+                ranked = [(score, item_id) for score, item_id in entry.ranked if item_id not in removed_ids]
+                
+                # Removing an item the ranking never kept cannot change the top-N. Removing
+                # a kept one promotes an item that was never stored, so only a full
+                # recompute can fill the gap, unless the ranking covered its whole pool.
+                if len(ranked) == len(entry.ranked) or len(entry.ranked) == entry.pool_size:
+                    new_ids = pool_ids - previous_ids
+                    if new_ids:
+                        new_items = [items_by_id[item_id] for item_id in new_ids]
+                        scored_new = [
+                            (score, new_items[index]['id']) 
+                            for score, index in self._score_items(entry.profile, new_items)
+                        ]
+                        ranked = sorted(ranked + scored_new, key=lambda x: x[0], reverse=True)
+                    self.materialized.put(
+                        user_id, ranked, pool_version, len(pool_ids), entry.profile, entry.computed_at
+                    )
+                    self.materialized.record("incremental" if new_ids else "hits")
+                    return self._select(user_profile, ranked, items_by_id, num_recommendations, use_index)
+        
+        ranked = None
+        if use_index:
+            # Make sure every pool item is indexed, then only score items that can reach the top-N
+            for index, item in enumerate(content_items):
+                if index % 256 == 0:
+                    check_cancelled()
+                self._get_item_categories(item)
+            ranked = self.category_index.top_candidates(
+                user_profile, self.materialized.top_n, pool_ids, self.candidate_categories
+            )
+            if len(ranked) < min(self.materialized.top_n, len(pool_ids)):
+                # Profile too sparse to fill the top-N from its categories
+                ranked = None
+        
+        if ranked is None:
+            # Calculate scores for each content item
+            scored_items = self._score_items(user_profile, content_items)
+            ranked = [(score, content_items[index]['id']) for score, index in scored_items]
+        
+        self.materialized.put(user_id, ranked, pool_version, len(pool_ids), user_profile)
+        self.materialized.record("recomputed")
         
         # Return top N items
-        return [item for item, _ in scored_items[:num_recommendations]]
+        return self._select(user_profile, ranked, items_by_id, num_recommendations, use_index)
+    
+    def _select(self, user_profile: Dict[str, float], ranked: List[Tuple[float, str]],
+                items_by_id: Dict[str, Dict], num_recommendations: int, explore: bool) -> List[Dict]:
+        """
+        Take the top items of a ranking, reserving an exploration slice for other categories.
+        
+        Args:
+            user_profile (Dict[str, float]): User interest profile
+            ranked (List[Tuple[float, str]]): (score, item_id) pairs sorted by score, descending
+            items_by_id (Dict[str, Dict]): Pool items by id
+            num_recommendations (int): Number of recommendations to return
+            explore (bool): Whether to fill part of the list from outside the user's top categories
+            
+        Returns:
+            List[Dict]: Recommended content items
+        """
+        item_ids = [item_id for _, item_id in ranked[:num_recommendations]]
+        
+        slots = int(num_recommendations * self.exploration) if explore else 0
+        if slots:
+            keep = item_ids[:num_recommendations - slots]
+            picks = self.category_index.explore(
+                user_profile, slots, items_by_id.keys(), exclude=keep,
+                max_categories=self.candidate_categories
+            )
+            item_ids = keep + picks + [
+                item_id for item_id in item_ids[len(keep):] if item_id not in picks
+            ][:slots - len(picks)]
+        
+        return [items_by_id[item_id] for item_id in item_ids]
 
 
 # Example usage
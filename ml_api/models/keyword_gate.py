@@ -0,0 +1,176 @@
+"""
+Keyword Gate for Tech Content Classification
+
+This module contains a lightweight keyword matcher used as the first stage of the
+cascaded classifier. An Aho-Corasick automaton is built over curated terms for every
+entry in TECH_CATEGORIES so that a text can be scanned for all terms in a single pass.
+"""
+
+import re
+from collections import defaultdict, deque
+from typing import Dict, Iterable, List, Tuple
+
+from models.classifier_model import TECH_CATEGORIES
+
+# Curated terms per category. Terms are matched case-insensitively on word boundaries.
+CATEGORY_KEYWORDS: Dict[str, List[str]] = {
+    "Python": ["python", "django", "flask", "fastapi", "pandas", "numpy", "pip install", "pytest", "asyncio"],
+    "JavaScript": ["javascript", "typescript", "node.js", "nodejs", "npm", "es6", "react", "vue", "angular"],
+    "Java": ["java", "spring boot", "jvm", "maven", "gradle", "hibernate"],
+    "C#": ["c#", "csharp", ".net", "asp.net", "dotnet", "linq", "blazor"],
+    "C++": ["c++", "cpp", "stl", "cmake", "template metaprogramming"],
+    "Go": ["golang", "goroutine", "goroutines", "go modules"],
+    "Rust": ["rust", "cargo", "borrow checker", "rustc", "tokio"],
+    "PHP": ["php", "laravel", "symfony", "composer", "wordpress"],
+    "Swift": ["swift", "swiftui", "xcode", "cocoapods"],
+    "Kotlin": ["kotlin", "jetpack compose", "coroutines", "ktor"],
+    "Web Development": ["web development", "html", "css", "http", "rest api", "web app", "browser"],
+    "Mobile Development": ["mobile development", "android", "ios", "react native", "flutter", "mobile app"],
+    "Data Science": ["data science", "data analysis", "pandas", "jupyter", "visualization", "statistics", "dataset"],
+    "Machine Learning": ["machine learning", "neural network", "deep learning", "pytorch", "tensorflow",
+                         "scikit-learn", "model training", "gradient descent"],
+    "DevOps": ["devops", "ci/cd", "docker", "kubernetes", "jenkins", "terraform", "ansible", "github actions"],
+    "Cloud Computing": ["cloud computing", "aws", "azure", "gcp", "google cloud", "serverless", "lambda", "ec2", "s3"],
+    "Cybersecurity": ["cybersecurity", "security", "encryption", "penetration testing", "vulnerability",
+                      "malware", "xss", "sql injection", "owasp"],
+    "Blockchain": ["blockchain", "ethereum", "solidity", "smart contract", "bitcoin", "web3", "nft"],
+    "IoT": ["iot", "internet of things", "arduino", "raspberry pi", "mqtt", "embedded", "sensor"],
+    "Augmented Reality": ["augmented reality", "arkit", "arcore", "ar app"],
+    "Virtual Reality": ["virtual reality", "vr headset", "oculus", "openxr", "unity vr"],
+    "Frontend": ["frontend", "front-end", "react", "vue", "angular", "css", "tailwind", "dom", "svelte"],
+    "Backend": ["backend", "back-end", "api", "server", "express", "microservice", "rest api", "graphql"],
+    "Fullstack": ["fullstack", "full-stack", "full stack", "mern", "mean stack"],
+    "Database": ["database", "sql", "postgresql", "mysql", "mongodb", "redis", "query", "indexing", "nosql"],
+    "UI/UX Design": ["ui/ux", "user experience", "user interface", "figma", "wireframe", "prototype", "usability"],
+    "Testing": ["unit test", "unit testing", "integration test", "test driven", "tdd", "jest", "selenium",
+                "pytest", "cypress"],
+    "Game Development": ["game development", "unity", "unreal engine", "godot", "game engine", "gamedev"],
+    "Microservices": ["microservices", "microservice", "service mesh", "api gateway", "event driven"],
+    "Artificial Intelligence": ["artificial intelligence", "ai", "llm", "large language model", "gpt",
+                                "chatbot", "computer vision", "nlp"],
+}
+
+_WORD_CHAR = re.compile(r"\w")
+
+
+class KeywordAutomaton:
+    """
+    An Aho-Corasick automaton that finds every occurrence of a set of terms in one pass.
+    """
+
+    def __init__(self, terms: Dict[str, Iterable[str]]):
+        """
+        Build the automaton.
+
+        Args:
+            terms (Dict[str, Iterable[str]]): Maps a label to the terms that signal it
+        """
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[Tuple[str, int]]] = [[]]
+
+        for label, label_terms in terms.items():
+            for term in label_terms:
+                self._add(term.lower(), label)
+
+        self._build_failure_links()
+
+    def _add(self, term: str, label: str):
+        """
+        Add a term to the trie.
+        """
+        state = 0
+        for char in term:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            state = next_state
+        self._output[state].append((label, len(term)))
+
+    def _build_failure_links(self):
+        """
+        Compute failure links breadth-first and merge outputs along them.
+        """
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                if self._fail[next_state] == next_state:
+                    self._fail[next_state] = 0
+                self._output[next_state].extend(self._output[self._fail[next_state]])
+
+    def count_matches(self, text: str) -> Dict[str, int]:
+        """
+        Count whole-word term matches per label.
+
+        Args:
+            text (str): Text to scan
+
+        Returns:
+            Dict[str, int]: Maps label to number of matched terms
+        """
+        text = text.lower()
+        counts: Dict[str, int] = defaultdict(int)
+        state = 0
+
+        for end, char in enumerate(text):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+
+            for label, length in self._output[state]:
+                start = end - length + 1
+                # Only count whole-word matches so "go" does not fire inside "google"
+                if start > 0 and _WORD_CHAR.match(text[start - 1]) and _WORD_CHAR.match(text[start]):
+                    continue
+                if end + 1 < len(text) and _WORD_CHAR.match(text[end + 1]) and _WORD_CHAR.match(text[end]):
+                    continue
+                counts[label] += 1
+
+        return dict(counts)
+
+
+class KeywordGate:
+    """
+    Scores text against TECH_CATEGORIES using keyword hits only.
+    """
+
+    def __init__(self, keywords: Dict[str, List[str]] = None):
+        """
+        Initialize the keyword gate.
+
+        Args:
+            keywords (Dict[str, List[str]], optional): Terms per category, defaults to CATEGORY_KEYWORDS
+        """
+        keywords = keywords or CATEGORY_KEYWORDS
+        self.automaton = KeywordAutomaton(
+            {category: terms for category, terms in keywords.items() if category in TECH_CATEGORIES}
+        )
+
+    def score(self, text: str) -> Tuple[Dict[str, float], int]:
+        """
+        Score a text by keyword hits.
+
+        Args:
+            text (str): Text to score
+
+        Returns:
+            Tuple[Dict[str, float], int]: (category -> share of hits, total hits) pair.
+                                          Scores are sorted in descending order.
+        """
+        counts = self.automaton.count_matches(text)
+        total_hits = sum(counts.values())
+        if not total_hits:
+            return {}, 0
+
+        scores = {category: hits / total_hits for category, hits in counts.items()}
+        return dict(sorted(scores.items(), key=lambda x: x[1], reverse=True)), total_hits
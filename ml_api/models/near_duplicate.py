@@ -0,0 +1,322 @@
+"""
+Near-Duplicate Content Index
+
+Reposts, lightly edited article copies and re-uploaded videos carry almost the
+same text as content that was already classified. This index keeps a MinHash
+signature of every classified text in LSH buckets, so that before inference a
+near-duplicate above a Jaccard similarity threshold can be found and its stored
+categories reused.
+"""
+
+import os
+import random
+import re
+import sys
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from utils.logger import get_logger
+from utils.memory import sampled_sizeof
+
+logger = get_logger(__name__)
+
+# Mersenne prime used for the universal hash family of the MinHash permutations
+_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+_WORD = re.compile(r"\w+")
+
+
+class NearDuplicateIndex:
+    """
+    MinHash-LSH index from content text to its predicted categories.
+    """
+
+    def __init__(self, threshold: float = 0.8, bands: int = 16, rows: int = 4,
+                 shingle_size: int = 3, min_words: int = 20, max_entries: int = 20000,
+                 audit_rate: float = 0.0, seed: int = 1):
+        """
+        Initialize the index.
+
+        Args:
+            threshold (float): Estimated Jaccard similarity above which categories are reused
+            bands (int): Number of LSH bands
+            rows (int): Signature rows per band; bands * rows is the signature length
+            shingle_size (int): Words per shingle
+            min_words (int): Texts with fewer words are not indexed, their shingle sets are too small
+            max_entries (int): Maximum number of indexed texts; least recently used are evicted
+            audit_rate (float): Fraction of reuses that are re-classified to measure agreement
+            seed (int): Seed of the MinHash permutations
+        """
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = rows
+        self.shingle_size = shingle_size
+        self.min_words = min_words
+        self.max_entries = max_entries
+        self.audit_rate = audit_rate
+
+        # a, b < 2**32 keep a * x + b below 2**64 for 32-bit shingle hashes
+        rng = np.random.RandomState(seed)
+        num_perm = bands * rows
+        self._a = rng.randint(1, _MAX_HASH, size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, _MAX_HASH, size=num_perm, dtype=np.uint64)
+
+        # entry id -> (params, signature, categories)
+        self._entries: "OrderedDict[int, Tuple[Tuple, np.ndarray, Dict[str, float]]]" = OrderedDict()
+        # One bucket table per band: hash of the band -> entry ids. Hash collisions only
+        # add candidates, which are verified against the full signature.
+        self._buckets: List[Dict[int, List[int]]] = [{} for _ in range(bands)]
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._stats = {
+            "lookups": 0, "reused": 0, "inserted": 0, "evicted": 0, "skipped_short": 0,
+            "audited": 0, "audit_agreed": 0
+        }
+
+    @classmethod
+    def from_env(cls) -> Optional["NearDuplicateIndex"]:
+        """
+        Build an index configured from environment variables.
+
+        Returns:
+            NearDuplicateIndex or None: Configured index, or None if disabled
+        """
+        if os.getenv("ML_NEAR_DUP_ENABLED", "true").lower() != "true":
+            return None
+
+        return cls(
+            threshold=float(os.getenv("ML_NEAR_DUP_THRESHOLD", 0.8)),
+            bands=int(os.getenv("ML_NEAR_DUP_BANDS", 16)),
+            rows=int(os.getenv("ML_NEAR_DUP_ROWS", 4)),
+            min_words=int(os.getenv("ML_NEAR_DUP_MIN_WORDS", 20)),
+            max_entries=int(os.getenv("ML_NEAR_DUP_MAX_ENTRIES", 20000)),
+            audit_rate=float(os.getenv("ML_NEAR_DUP_AUDIT_RATE", 0.01))
+        )
+
+    def signature(self, text: str) -> Optional[np.ndarray]:
+        """
+        Compute the MinHash signature of a text's word shingles.
+
+        Args:
+            text (str): Normalized text
+
+        Returns:
+            np.ndarray or None: Signature of bands * rows values, or None if the text is too short
+        """
+        words = _WORD.findall(text.lower())
+        if len(words) < self.min_words:
+            return None
+
+        shingles = {
+            " ".join(words[i:i + self.shingle_size])
+            for i in range(len(words) - self.shingle_size + 1)
+        }
+        hashes = np.fromiter(
+            (zlib.crc32(shingle.encode("utf-8")) for shingle in shingles),
+            dtype=np.uint64, count=len(shingles)
+        )
+
+        permuted = (np.outer(hashes, self._a) + self._b) % _PRIME
+        return (permuted & _MAX_HASH).min(axis=0).astype(np.uint32)
+
+    def _band_keys(self, params: Tuple, signature: np.ndarray) -> List[int]:
+        return [
+            hash((params, signature[band * self.rows:(band + 1) * self.rows].tobytes()))
+            for band in range(self.bands)
+        ]
+
+    def lookup(self, text: str,
+               params: Tuple = ()) -> Tuple[Optional[Dict[str, float]], Optional[np.ndarray]]:
+        """
+        Find the categories of an indexed near-duplicate.
+
+        Args:
+            text (str): Normalized text
+            params (Tuple): Prediction parameters (threshold, top_k) that must match
+
+        Returns:
+            Tuple: (categories or None, signature or None for texts too short to index)
+        """
+        signature = self.signature(text)
+
+        with self._lock:
+            self._stats["lookups"] += 1
+            if signature is None:
+                self._stats["skipped_short"] += 1
+                return None, None
+
+            candidates = set()
+            for band, key in enumerate(self._band_keys(params, signature)):
+                candidates.update(self._buckets[band].get(key, ()))
+
+            best_id, best_similarity = None, self.threshold
+            for entry_id in candidates:
+                entry_params, entry_signature, _ = self._entries[entry_id]
+                if entry_params != params:
+                    continue
+                similarity = float(np.mean(entry_signature == signature))
+                if similarity >= best_similarity:
+                    best_id, best_similarity = entry_id, similarity
+
+            if best_id is None:
+                return None, signature
+
+            self._entries.move_to_end(best_id)
+            self._stats["reused"] += 1
+            return dict(self._entries[best_id][2]), signature
+
+    def add(self, signature: Optional[np.ndarray], categories: Dict[str, float], params: Tuple = ()):
+        """
+        Index the categories of a classified text.
+
+        Args:
+            signature (np.ndarray): Signature returned by lookup; None is ignored
+            categories (Dict[str, float]): Predicted categories
+            params (Tuple): Prediction parameters the categories were computed with
+        """
+        if signature is None:
+            return
+
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (params, signature, dict(categories))
+            for band, key in enumerate(self._band_keys(params, signature)):
+                self._buckets[band].setdefault(key, []).append(entry_id)
+            self._stats["inserted"] += 1
+
+            self._evict(len(self._entries) - self.max_entries)
+
+    def _evict(self, count: int):
+        """
+        Evict the least recently used entries; the caller holds the lock.
+        """
+        for _ in range(max(0, count)):
+            evicted_id, (evicted_params, evicted_signature, _) = self._entries.popitem(last=False)
+            for band, key in enumerate(self._band_keys(evicted_params, evicted_signature)):
+                bucket = self._buckets[band].get(key)
+                if bucket is not None and evicted_id in bucket:
+                    bucket.remove(evicted_id)
+                    if not bucket:
+                        del self._buckets[band][key]
+            self._stats["evicted"] += 1
+
+    def shrink(self, fraction: float):
+        """
+        Evict the given fraction of the least recently used entries.
+        """
+        with self._lock:
+            self._evict(int(len(self._entries) * fraction))
+
+    def memory_usage(self) -> Dict[str, int]:
+        """
+        Estimated bytes held by the entries and the LSH buckets.
+        """
+        with self._lock:
+            entries = len(self._entries)
+            entry_bytes = sampled_sizeof(self._entries.values(), entries)
+            bucket_bytes = sum(
+                sys.getsizeof(buckets) + sampled_sizeof(buckets.values(), len(buckets))
+                for buckets in self._buckets
+            )
+        return {"bytes": entry_bytes + bucket_bytes, "entries": entries}
+
+    def predict(self, predict: Callable[..., Dict[str, float]], text: str, **params) -> Dict[str, float]:
+        """
+        Classify a text, reusing the categories of a near-duplicate when one is indexed.
+
+        A sample of reuses (audit_rate) is classified anyway and compared by primary
+        category, so the agreement of reused results can be monitored.
+
+        Args:
+            predict (Callable): Classifier predict function
+            text (str): Normalized text
+            **params: Keyword arguments for predict, e.g. threshold and top_k
+
+        Returns:
+            Dict[str, float]: Category -> confidence
+        """
+        key = tuple(sorted(params.items()))
+        categories, signature = self.lookup(text, key)
+
+        if categories is not None:
+            if self.audit_rate <= 0 or random.random() >= self.audit_rate:
+                return categories
+
+            fresh = predict(text, **params)
+            agreed = self._primary(fresh) == self._primary(categories)
+            with self._lock:
+                self._stats["audited"] += 1
+                self._stats["audit_agreed"] += int(agreed)
+            return fresh
+
+        categories = predict(text, **params)
+        self.add(signature, categories, key)
+        return categories
+
+    def predict_batch(self, predict_batch: Callable[..., List[Dict[str, float]]], texts: List[str],
+                      **params) -> List[Dict[str, float]]:
+        """
+        Classify many texts, reusing near-duplicate categories and batching the rest.
+
+        Args:
+            predict_batch (Callable): Classifier predict_batch function
+            texts (List[str]): Normalized texts
+            **params: Keyword arguments for predict_batch, e.g. threshold and top_k
+
+        Returns:
+            List[Dict[str, float]]: Category -> confidence for each text, in input order
+        """
+        key = tuple(sorted(params.items()))
+        results: List[Optional[Dict[str, float]]] = [None] * len(texts)
+        signatures: List[Optional[np.ndarray]] = [None] * len(texts)
+        pending, audits = [], []
+
+        for i, text in enumerate(texts):
+            categories, signatures[i] = self.lookup(text, key)
+            if categories is None:
+                pending.append(i)
+            elif self.audit_rate > 0 and random.random() < self.audit_rate:
+                results[i] = categories
+                audits.append(i)
+            else:
+                results[i] = categories
+
+        classify = pending + audits
+        predictions = predict_batch([texts[i] for i in classify], **params) if classify else []
+        for i, categories in zip(classify, predictions):
+            if results[i] is None:
+                self.add(signatures[i], categories, key)
+            else:
+                agreed = self._primary(categories) == self._primary(results[i])
+                with self._lock:
+                    self._stats["audited"] += 1
+                    self._stats["audit_agreed"] += int(agreed)
+            results[i] = categories
+
+        return results
+
+    @staticmethod
+    def _primary(categories: Dict[str, float]) -> Optional[str]:
+        return max(categories, key=categories.get) if categories else None
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Get reuse and audit counters.
+
+        Returns:
+            Dict[str, float]: Counters, reuse rate and audit agreement rate
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+
+        indexed_lookups = stats["lookups"] - stats["skipped_short"]
+        stats["reuse_rate"] = stats["reused"] / indexed_lookups if indexed_lookups else 0.0
+        stats["audit_agreement"] = stats["audit_agreed"] / stats["audited"] if stats["audited"] else None
+        return stats
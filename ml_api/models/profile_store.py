@@ -0,0 +1,969 @@
+"""
+User Profile Store
+
+User interest profiles used to live in each worker's memory, so they were lost on
+restart and diverged between workers. Profiles now go through a ProfileStore:
+
+- InMemoryProfileStore: a single process, the previous behaviour
+- SQLiteProfileStore: a local file shared by all workers on one machine
+- HttpProfileStore: the shard owned by another node, reached over HTTP
+- ShardedProfileStore: routes users to shard owners with consistent hashing,
+  batches reads and writes, buffers writes behind, and rebalances when nodes
+  join or leave
+
+Profile updates are sent as per-category affine updates (value -> scale * value
++ offset) and applied by the shard owner, so concurrent interactions of one user
+from different workers or nodes are never lost to a read-modify-write race.
+Consecutive updates of a user compose into a single affine update, which keeps
+the write-behind buffer at one entry per user.
+
+Affine updates are not idempotent, so a batch that is sent again after a timeout
+must not be applied twice. Every flushed batch carries its source and an id,
+the owner records the last batch it applied per source, and a batch whose
+outcome is unknown is retried unchanged before anything newer is sent to that
+owner.
+
+Ring membership is stored next to the local shard (ProfileRing), so every worker
+on a machine and every restarted process route users the same way, and flushes
+are fenced off while a membership change moves profiles.
+"""
+
+import abc
+import bisect
+import contextlib
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from utils.logger import get_logger
+from utils.memory import sampled_sizeof
+
+logger = get_logger(__name__)
+
+# Category -> (scale, offset): the new value is scale * old value + offset
+ProfileUpdate = Dict[str, Tuple[float, float]]
+
+PROFILE_DB_PATH = Path(os.getenv(
+    "ML_PROFILE_DB", str(Path(__file__).parent.parent / "cache" / "profiles.sqlite3")
+))
+
+# Applied batch ids of sources that have not flushed for this long are forgotten
+APPLIED_BATCH_TTL = 7 * 86400
+
+
+def apply_update(profile: Dict[str, float], update: ProfileUpdate) -> Dict[str, float]:
+    """
+    Apply an affine update to a profile in place.
+    """
+    for category, (scale, offset) in update.items():
+        profile[category] = scale * profile.get(category, 0.0) + offset
+    return profile
+
+
+def compose_updates(first: ProfileUpdate, second: ProfileUpdate) -> ProfileUpdate:
+    """
+    The single update equivalent to applying first and then second.
+    """
+    composed = dict(first)
+    for category, (scale, offset) in second.items():
+        first_scale, first_offset = composed.get(category, (1.0, 0.0))
+        composed[category] = (first_scale * scale, first_offset * scale + offset)
+    return composed
+
+
+class ProfileStore(abc.ABC):
+    """
+    Interface of user profile storage backends.
+    """
+
+    def __init__(self, categories: Sequence[str] = ()):
+        """
+        Args:
+            categories (Sequence[str]): Categories a new profile starts with at 0.0
+        """
+        self.categories = list(categories)
+
+    def new_profile(self) -> Dict[str, float]:
+        return {category: 0.0 for category in self.categories}
+
+    def get(self, user_id: str) -> Optional[Dict[str, float]]:
+        """
+        Get a user's profile, or None if the user has no profile.
+        """
+        return self.get_many([user_id]).get(user_id)
+
+    @abc.abstractmethod
+    def get_many(self, user_ids: Iterable[str]) -> Dict[str, Dict[str, float]]:
+        """
+        Get the profiles of several users; users without a profile are left out.
+        """
+
+    def apply(self, user_id: str, update: ProfileUpdate):
+        """
+        Apply an update to a user's profile, creating the profile if needed.
+        """
+        self.apply_many({user_id: update})
+
+    @abc.abstractmethod
+    def apply_many(self, updates: Dict[str, ProfileUpdate], source: Optional[str] = None,
+                   batch_id: Optional[str] = None):
+        """
+        Apply updates to several profiles.
+
+        A batch with the same id as the last one applied from its source is skipped,
+        so a batch retried after a timeout is applied once.
+
+        Args:
+            updates (Dict[str, ProfileUpdate]): User id -> update
+            source (str, optional): Name of the sender of the batch
+            batch_id (str, optional): Id of the batch, unique per source
+        """
+
+    @abc.abstractmethod
+    def put_many(self, profiles: Dict[str, Dict[str, float]]):
+        """
+        Overwrite the profiles of several users.
+        """
+
+    @abc.abstractmethod
+    def delete_many(self, user_ids: Iterable[str]):
+        """
+        Delete the profiles of several users.
+        """
+
+    @abc.abstractmethod
+    def user_ids(self) -> List[str]:
+        """
+        Ids of all users with a profile in this store.
+        """
+
+    def flush(self):
+        """
+        Write buffered updates through; a no-op for stores without a buffer.
+        """
+
+    def close(self):
+        self.flush()
+
+    def memory_usage(self) -> Dict:
+        """
+        Estimated bytes held by this store; "resident" is False for data kept on disk.
+        """
+        return {"bytes": 0}
+
+    def stats(self) -> Dict:
+        return {"backend": type(self).__name__}
+
+
+class InMemoryProfileStore(ProfileStore):
+    """
+    Profiles in this process's memory.
+    """
+
+    def __init__(self, categories: Sequence[str] = ()):
+        super().__init__(categories)
+        self._profiles: Dict[str, Dict[str, float]] = {}
+        # Source -> id of the last batch applied from it
+        self._applied: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def get_many(self, user_ids: Iterable[str]) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {
+                user_id: dict(self._profiles[user_id]) for user_id in user_ids if user_id in self._profiles
+            }
+
+    def apply_many(self, updates: Dict[str, ProfileUpdate], source: Optional[str] = None,
+                   batch_id: Optional[str] = None):
+        with self._lock:
+            if source is not None:
+                if self._applied.get(source) == batch_id:
+                    return
+                self._applied[source] = batch_id
+            for user_id, update in updates.items():
+                profile = self._profiles.setdefault(user_id, self.new_profile())
+                apply_update(profile, update)
+
+    def put_many(self, profiles: Dict[str, Dict[str, float]]):
+        with self._lock:
+            for user_id, profile in profiles.items():
+                self._profiles[user_id] = dict(profile)
+
+    def delete_many(self, user_ids: Iterable[str]):
+        with self._lock:
+            for user_id in user_ids:
+                self._profiles.pop(user_id, None)
+
+    def user_ids(self) -> List[str]:
+        with self._lock:
+            return list(self._profiles)
+
+    def memory_usage(self) -> Dict:
+        with self._lock:
+            return {"bytes": sampled_sizeof(self._profiles.items(), len(self._profiles)),
+                    "entries": len(self._profiles)}
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"backend": type(self).__name__, "users": len(self._profiles)}
+
+
+class SQLiteProfileStore(ProfileStore):
+    """
+    Profiles in a local SQLite file, shared by every worker process on the machine.
+
+    Updates run in an immediate transaction, so the read-modify-write of a profile
+    is atomic across processes.
+    """
+
+    _SCHEMA = """
+    CREATE TABLE IF NOT EXISTS profiles (
+        user_id TEXT PRIMARY KEY,
+        profile TEXT NOT NULL,
+        updated_at REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS applied_batches (
+        source TEXT PRIMARY KEY,
+        batch_id TEXT NOT NULL,
+        applied_at REAL NOT NULL
+    );
+    """
+
+    def __init__(self, path: Path = PROFILE_DB_PATH, categories: Sequence[str] = ()):
+        super().__init__(categories)
+        self.path = Path(path)
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        Get this thread's connection, reopening it after a fork.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.path), timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            conn.executescript(self._SCHEMA)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _select(self, conn: sqlite3.Connection, user_ids: List[str]) -> Dict[str, Dict[str, float]]:
+        profiles = {}
+        # Stay below SQLite's limit on bound parameters
+        for start in range(0, len(user_ids), 500):
+            chunk = user_ids[start:start + 500]
+            rows = conn.execute(
+                f"SELECT user_id, profile FROM profiles WHERE user_id IN ({','.join('?' * len(chunk))})",
+                chunk
+            ).fetchall()
+            profiles.update((user_id, json.loads(profile)) for user_id, profile in rows)
+        return profiles
+
+    def get_many(self, user_ids: Iterable[str]) -> Dict[str, Dict[str, float]]:
+        return self._select(self._connection(), list(user_ids))
+
+    def apply_many(self, updates: Dict[str, ProfileUpdate], source: Optional[str] = None,
+                   batch_id: Optional[str] = None):
+        if not updates:
+            return
+
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            if source is not None:
+                # Recorded in the same transaction as the updates, so a batch is applied exactly once
+                row = conn.execute("SELECT batch_id FROM applied_batches WHERE source = ?", (source,)).fetchone()
+                if row is not None and row[0] == batch_id:
+                    conn.execute("ROLLBACK")
+                    logger.info(f"Skipped profile batch {batch_id} from {source}, it was already applied")
+                    return
+                conn.execute(
+                    "INSERT OR REPLACE INTO applied_batches (source, batch_id, applied_at) VALUES (?, ?, ?)",
+                    (source, batch_id, now)
+                )
+                conn.execute("DELETE FROM applied_batches WHERE applied_at < ?", (now - APPLIED_BATCH_TTL,))
+
+            profiles = self._select(conn, list(updates))
+            rows = []
+            for user_id, update in updates.items():
+                profile = apply_update(profiles.get(user_id) or self.new_profile(), update)
+                rows.append((user_id, json.dumps(profile), now))
+            conn.executemany("INSERT OR REPLACE INTO profiles (user_id, profile, updated_at) VALUES (?, ?, ?)", rows)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def put_many(self, profiles: Dict[str, Dict[str, float]]):
+        now = time.time()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT OR REPLACE INTO profiles (user_id, profile, updated_at) VALUES (?, ?, ?)",
+                [(user_id, json.dumps(profile), now) for user_id, profile in profiles.items()]
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def delete_many(self, user_ids: Iterable[str]):
+        conn = self._connection()
+        conn.executemany("DELETE FROM profiles WHERE user_id = ?", [(user_id,) for user_id in user_ids])
+
+    def user_ids(self) -> List[str]:
+        return [row[0] for row in self._connection().execute("SELECT user_id FROM profiles")]
+
+    def memory_usage(self) -> Dict:
+        size = self.path.stat().st_size if self.path.exists() else 0
+        return {"bytes": size, "resident": False}
+
+    def stats(self) -> Dict:
+        users = self._connection().execute("SELECT COUNT(*) FROM profiles").fetchone()[0]
+        return {"backend": type(self).__name__, "path": str(self.path), "users": users}
+
+
+class HttpProfileStore(ProfileStore):
+    """
+    The profile shard owned by another node, served by its /internal/profiles endpoints.
+    """
+
+    def __init__(self, base_url: str, token: str = "", timeout: float = 2.0, categories: Sequence[str] = ()):
+        super().__init__(categories)
+        import requests
+
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self._session = requests.Session()
+        if token:
+            self._session.headers["X-Cluster-Token"] = token
+
+    def _post(self, path: str, payload: Dict) -> Dict:
+        response = self._session.post(f"{self.base_url}/internal/profiles/{path}", json=payload, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def get_many(self, user_ids: Iterable[str]) -> Dict[str, Dict[str, float]]:
+        return self._post("get", {"user_ids": list(user_ids)})["profiles"]
+
+    def apply_many(self, updates: Dict[str, ProfileUpdate], source: Optional[str] = None,
+                   batch_id: Optional[str] = None):
+        self._post("apply", {"updates": updates, "source": source, "batch_id": batch_id})
+
+    def put_many(self, profiles: Dict[str, Dict[str, float]]):
+        self._post("put", {"profiles": profiles})
+
+    def delete_many(self, user_ids: Iterable[str]):
+        self._post("delete", {"user_ids": list(user_ids)})
+
+    def user_ids(self) -> List[str]:
+        response = self._session.get(f"{self.base_url}/internal/profiles/ids", timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()["user_ids"]
+
+    def stats(self) -> Dict:
+        return {"backend": type(self).__name__, "url": self.base_url}
+
+
+class ProfileRing:
+    """
+    Profile ring membership shared by every worker process on the machine.
+
+    The membership is kept in SQLite next to the local shard, so every worker, and
+    every process after a restart, routes users the same way. Each change gets the
+    next version, which the workers poll to rebuild their ring. A change holds the
+    ring lock exclusively while profiles move, and flushes hold it shared, so no
+    worker writes to an old owner during a migration.
+    """
+
+    _SCHEMA = """
+    CREATE TABLE IF NOT EXISTS ring (
+        name TEXT PRIMARY KEY,
+        url TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS ring_meta (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    );
+    """
+
+    def __init__(self, path: Path = PROFILE_DB_PATH):
+        self.path = Path(path)
+        self.lock_path = self.path.with_name(f"{self.path.name}.ring.lock")
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        Get this thread's connection, reopening it after a fork.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.path), timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            conn.executescript(self._SCHEMA)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def _version(conn: sqlite3.Connection) -> int:
+        row = conn.execute("SELECT value FROM ring_meta WHERE key = 'version'").fetchone()
+        return int(row[0]) if row else 0
+
+    def version(self) -> int:
+        """
+        Version of the stored membership; 0 if none was stored yet.
+        """
+        return self._version(self._connection())
+
+    def load(self) -> Tuple[int, Dict[str, str]]:
+        """
+        The stored membership and its version.
+
+        Returns:
+            Tuple[int, Dict[str, str]]: Version and node name -> url
+        """
+        conn = self._connection()
+        # One read transaction, so the nodes and the version come from the same snapshot
+        conn.execute("BEGIN")
+        try:
+            version = self._version(conn)
+            nodes = dict(conn.execute("SELECT name, url FROM ring").fetchall())
+        finally:
+            conn.execute("COMMIT")
+        return version, nodes
+
+    def _write(self, nodes: Dict[str, str], only_if_empty: bool) -> Optional[int]:
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = self._version(conn)
+            if only_if_empty and version:
+                conn.execute("ROLLBACK")
+                return None
+            conn.execute("DELETE FROM ring")
+            conn.executemany("INSERT INTO ring (name, url) VALUES (?, ?)", list(nodes.items()))
+            conn.execute(
+                "INSERT OR REPLACE INTO ring_meta (key, value) VALUES ('version', ?)", (str(version + 1),)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return version + 1
+
+    def seed(self, nodes: Dict[str, str]) -> bool:
+        """
+        Store an initial membership unless one is stored already.
+
+        Returns:
+            bool: Whether the membership was stored
+        """
+        return bool(nodes) and self._write(nodes, only_if_empty=True) is not None
+
+    def save(self, nodes: Dict[str, str]) -> int:
+        """
+        Replace the membership.
+
+        Returns:
+            int: The new version
+        """
+        return self._write(nodes, only_if_empty=False)
+
+    @contextlib.contextmanager
+    def lock(self, exclusive: bool = False, wait: bool = True):
+        """
+        Hold the ring lock across processes.
+
+        Yields:
+            bool: Whether the lock is held; False if wait is off and another process holds it
+        """
+        try:
+            import fcntl
+        except ImportError:
+            yield True
+            return
+
+        self.lock_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.lock_path, "a") as f:
+            flags = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+            try:
+                fcntl.flock(f, flags if wait else flags | fcntl.LOCK_NB)
+            except OSError:
+                yield False
+                return
+            # Closing the file releases the lock
+            yield True
+
+
+class ShardedProfileStore(ProfileStore):
+    """
+    Profiles sharded across nodes with consistent hashing and a write-behind buffer.
+
+    Updates are buffered per user and flushed to the owning shards in batches every
+    flush_interval seconds, or sooner once max_pending users are buffered. Reads
+    apply a user's buffered update, so a node sees its own writes before they are
+    flushed.
+
+    A batch whose send failed may still have been applied by its owner, so it is
+    kept unchanged and retried with the same id until the owner acknowledges it.
+    Until then, newer updates for that owner stay in the buffer.
+
+    With a ProfileRing, the membership is shared by every worker on the machine:
+    a node added or removed by one worker is picked up by the others within
+    flush_interval, and their flushes wait while profiles move.
+    """
+
+    def __init__(self, nodes: Dict[str, str], local_node: Optional[str] = None,
+                 virtual_nodes: int = 64, flush_interval: float = 0.5, max_pending: int = 1000,
+                 token: str = "", ring: Optional[ProfileRing] = None, categories: Sequence[str] = ()):
+        """
+        Initialize the store.
+
+        Args:
+            nodes (Dict[str, str]): Node name -> url ("file:<path>" for a local SQLite shard);
+                with a ring that already stores a membership, the stored one is used instead
+            local_node (str, optional): Name of this node; its shard is served to the other nodes
+            virtual_nodes (int): Points per node on the hash ring
+            flush_interval (float): Seconds between write-behind flushes and ring version checks
+            max_pending (int): Buffered users that trigger an early flush
+            token (str): X-Cluster-Token sent to the other nodes
+            ring (ProfileRing, optional): Membership shared with the other workers on the machine
+            categories (Sequence[str]): Categories a new profile starts with at 0.0
+        """
+        super().__init__(categories)
+        self.urls: Dict[str, str] = {}
+        self.nodes: Dict[str, ProfileStore] = {}
+        self.local_node = local_node
+        self.virtual_nodes = virtual_nodes
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.token = token
+        self.ring = ring
+        self.ring_version = 0
+        self._ring_checked = 0.0
+
+        self._ring: List[Tuple[int, str]] = []
+        self._ring_keys: List[int] = []
+        self._pending: Dict[str, ProfileUpdate] = {}
+        # Node -> (batch id, batch) sent but not acknowledged
+        self._unacked: Dict[str, Tuple[str, Dict[str, ProfileUpdate]]] = {}
+        self._pending_lock = threading.Lock()
+        # Names this process's batches on the shard owners
+        self.source = f"{local_node or 'node'}-{uuid.uuid4().hex[:12]}"
+        self._batch_sequence = 0
+        # Held while flushing or rebalancing, so updates stay buffered during a move
+        self._flush_lock = threading.RLock()
+        self._flush_requested = threading.Event()
+        self._stats = {
+            "reads": 0, "updates": 0, "flushes": 0, "flushed_users": 0, "flush_errors": 0, "retried_batches": 0,
+            "fenced_flushes": 0, "ring_reloads": 0, "moved": 0
+        }
+
+        if ring is not None:
+            ring.seed(nodes)
+            self.ring_version, stored = ring.load()
+            if nodes and stored != nodes:
+                logger.warning("ML_PROFILE_NODES differs from the stored profile ring; using the stored ring")
+            nodes = stored
+        if not nodes:
+            raise ValueError("A sharded profile store needs at least one node")
+        self._set_members(nodes)
+
+        self._flusher = threading.Thread(target=self._flush_loop, name="profile-flusher", daemon=True)
+        self._flusher.start()
+
+    @property
+    def local_shard(self) -> Optional[ProfileStore]:
+        return self.nodes.get(self.local_node) if self.local_node else None
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+    def _make_shard(self, name: str, url: str) -> ProfileStore:
+        if url.startswith("file:"):
+            return SQLiteProfileStore(Path(url[len("file:"):]), categories=self.categories)
+        if name == self.local_node:
+            return SQLiteProfileStore(PROFILE_DB_PATH, categories=self.categories)
+        return HttpProfileStore(url, token=self.token, categories=self.categories)
+
+    def _set_members(self, urls: Dict[str, str]):
+        """
+        Switch to a membership, keeping the shards of nodes whose url did not change.
+        """
+        self.nodes = {
+            name: self.nodes[name] if self.urls.get(name) == url else self._make_shard(name, url)
+            for name, url in urls.items()
+        }
+        self.urls = dict(urls)
+        self._build_ring()
+
+    def _build_ring(self):
+        ring = sorted(
+            (self._hash(f"{name}#{index}"), name)
+            for name in self.nodes for index in range(self.virtual_nodes)
+        )
+        self._ring = ring
+        self._ring_keys = [point for point, _ in ring]
+
+    def _sync_ring(self, force: bool = False):
+        """
+        Switch to the shared membership if another worker changed it.
+
+        Checked at most once per flush_interval unless forced. Batches that were
+        grouped under the old membership and not acknowledged go back to the buffer
+        and are sent to the new owners, so a lost acknowledgement from before the
+        change can apply an update twice.
+        """
+        if self.ring is None:
+            return
+        now = time.monotonic()
+        if not force and now - self._ring_checked < self.flush_interval:
+            return
+        self._ring_checked = now
+        if self.ring.version() == self.ring_version:
+            return
+
+        with self._flush_lock:
+            version, urls = self.ring.load()
+            if version == self.ring_version:
+                return
+            self._set_members(urls)
+            self.ring_version = version
+            with self._pending_lock:
+                for _, batch in self._unacked.values():
+                    for user_id, update in batch.items():
+                        pending = self._pending.get(user_id)
+                        self._pending[user_id] = compose_updates(update, pending) if pending else update
+                self._unacked = {}
+                self._stats["ring_reloads"] += 1
+        logger.info(f"Profile ring changed to version {version}: {', '.join(sorted(urls))}")
+
+    def _hold_ring(self, exclusive: bool = False, wait: bool = True):
+        return self.ring.lock(exclusive=exclusive, wait=wait) if self.ring else contextlib.nullcontext(True)
+
+    def owner(self, user_id: str) -> str:
+        """
+        Name of the node that owns a user's profile under the current membership.
+        """
+        index = bisect.bisect(self._ring_keys, self._hash(user_id)) % len(self._ring)
+        return self._ring[index][1]
+
+    def _group(self, user_ids: Iterable[str]) -> Dict[str, List[str]]:
+        groups: Dict[str, List[str]] = {}
+        for user_id in user_ids:
+            groups.setdefault(self.owner(user_id), []).append(user_id)
+        return groups
+
+    def get_many(self, user_ids: Iterable[str]) -> Dict[str, Dict[str, float]]:
+        self._sync_ring()
+        user_ids = list(user_ids)
+        profiles: Dict[str, Dict[str, float]] = {}
+        for node, node_user_ids in self._group(user_ids).items():
+            profiles.update(self.nodes[node].get_many(node_user_ids))
+
+        with self._pending_lock:
+            self._stats["reads"] += len(user_ids)
+            for user_id in user_ids:
+                # Unacknowledged updates come before the newer buffered ones; until the
+                # retry is acknowledged, one the owner already applied is counted twice
+                for _, batch in self._unacked.values():
+                    if user_id in batch:
+                        profiles[user_id] = apply_update(profiles.get(user_id) or self.new_profile(), batch[user_id])
+                update = self._pending.get(user_id)
+                if update is not None:
+                    profiles[user_id] = apply_update(profiles.get(user_id) or self.new_profile(), update)
+        return profiles
+
+    def apply_many(self, updates: Dict[str, ProfileUpdate], source: Optional[str] = None,
+                   batch_id: Optional[str] = None):
+        with self._pending_lock:
+            for user_id, update in updates.items():
+                pending = self._pending.get(user_id)
+                self._pending[user_id] = compose_updates(pending, update) if pending else dict(update)
+            self._stats["updates"] += len(updates)
+            if len(self._pending) >= self.max_pending:
+                self._flush_requested.set()
+
+    def _flush_loop(self):
+        while True:
+            self._flush_requested.wait(self.flush_interval)
+            self._flush_requested.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing profile updates: {str(e)}")
+
+    def _send(self, node: str, batch_id: str, batch: Dict[str, ProfileUpdate]) -> bool:
+        """
+        Send a batch to its owner and forget it once acknowledged.
+
+        Returns:
+            bool: Whether the owner acknowledged the batch
+        """
+        try:
+            self.nodes[node].apply_many(batch, source=self.source, batch_id=batch_id)
+        except Exception as e:
+            logger.warning(f"Profile flush to node {node} failed, will retry: {str(e)}")
+            with self._pending_lock:
+                self._stats["flush_errors"] += 1
+            return False
+
+        with self._pending_lock:
+            self._unacked.pop(node, None)
+            self._stats["flushes"] += 1
+            self._stats["flushed_users"] += len(batch)
+        return True
+
+    def flush(self):
+        """
+        Send buffered updates to their shard owners, one batch per node.
+
+        A batch that failed is retried first, unchanged and with its original id,
+        so an owner that applied it before the failure skips it. Updates for a node
+        stay buffered while it has such a batch outstanding, and all updates stay
+        buffered while another worker is changing the ring.
+        """
+        with self._flush_lock, self._hold_ring(wait=False) as held:
+            if not held:
+                with self._pending_lock:
+                    self._stats["fenced_flushes"] += 1
+                return
+            # Under the shared ring lock, so the owners cannot change until the batches are sent
+            self._sync_ring(force=True)
+
+            with self._pending_lock:
+                retries = list(self._unacked.items())
+                self._stats["retried_batches"] += len(retries)
+            for node, (batch_id, batch) in retries:
+                if node in self.nodes:
+                    self._send(node, batch_id, batch)
+
+            with self._pending_lock:
+                batches = []
+                for node, user_ids in self._group(self._pending).items():
+                    if node in self._unacked:
+                        continue
+                    self._batch_sequence += 1
+                    batch = {user_id: self._pending.pop(user_id) for user_id in user_ids}
+                    self._unacked[node] = (str(self._batch_sequence), batch)
+                    batches.append((node, str(self._batch_sequence), batch))
+
+            for node, batch_id, batch in batches:
+                self._send(node, batch_id, batch)
+
+    def _check_acknowledged(self):
+        """
+        Refuse a membership change while a batch may be half applied, since the
+        profiles it touches could otherwise move without it or receive it twice.
+        """
+        with self._pending_lock:
+            unacked = sorted(self._unacked)
+        if unacked:
+            raise RuntimeError(f"Profile updates to nodes {', '.join(unacked)} are not acknowledged yet")
+
+    def _change_members(self, urls: Dict[str, str]):
+        """
+        Switch to a new membership and record it for the other workers.
+        """
+        self._set_members(urls)
+        if self.ring is not None:
+            self.ring_version = self.ring.save(urls)
+
+    def _rebalance(self, old_owner: Dict[str, List[str]]) -> int:
+        """
+        Move profiles whose owner changed under the current ring.
+
+        Args:
+            old_owner (Dict[str, List[str]]): Node name -> user ids it held before the change
+
+        Returns:
+            int: Number of moved profiles
+        """
+        moved = 0
+        for node, user_ids in old_owner.items():
+            moving = [user_id for user_id in user_ids if self.owner(user_id) != node]
+            if not moving:
+                continue
+
+            profiles = self.nodes[node].get_many(moving)
+            for new_node, new_user_ids in self._group(moving).items():
+                self.nodes[new_node].put_many(
+                    {user_id: profiles[user_id] for user_id in new_user_ids if user_id in profiles}
+                )
+            self.nodes[node].delete_many(moving)
+            moved += len(moving)
+        return moved
+
+    def add_node(self, name: str, url: str, migrate: bool = True) -> int:
+        """
+        Add a node to the ring and move the profiles it now owns to it.
+
+        The new membership is recorded for the other workers on this machine, whose
+        flushes wait until the move is done. Updates arriving during the move stay
+        in the write-behind buffer and are flushed to the new owners afterwards.
+        Apply the same membership change on every node; only one of them needs to
+        migrate.
+
+        Args:
+            name (str): Node name
+            url (str): Node url, or "file:<path>" for a local SQLite shard
+            migrate (bool): Move the profiles the node now owns to it
+
+        Returns:
+            int: Number of moved profiles
+        """
+        with self._flush_lock:
+            self.flush()
+            self._check_acknowledged()
+            with self._hold_ring(exclusive=True):
+                self._sync_ring(force=True)
+                if name in self.nodes:
+                    raise ValueError(f"Profile node {name} is already on the ring")
+                old_owner = {node: shard.user_ids() for node, shard in self.nodes.items()} if migrate else {}
+                self._change_members({**self.urls, name: url})
+                moved = self._rebalance(old_owner)
+
+        with self._pending_lock:
+            self._stats["moved"] += moved
+        logger.info(f"Added profile node {name}, moved {moved} profiles")
+        return moved
+
+    def remove_node(self, name: str, migrate: bool = True) -> int:
+        """
+        Remove a node from the ring, moving its profiles to their new owners first.
+
+        Returns:
+            int: Number of moved profiles
+        """
+        with self._flush_lock:
+            self.flush()
+            self._check_acknowledged()
+            with self._hold_ring(exclusive=True):
+                self._sync_ring(force=True)
+                if name not in self.nodes:
+                    raise KeyError(name)
+                if len(self.nodes) == 1:
+                    raise ValueError("Cannot remove the last profile node")
+                shard = self.nodes[name]
+                old_user_ids = shard.user_ids() if migrate else []
+                self._change_members({node: url for node, url in self.urls.items() if node != name})
+
+                # The removed node is no longer on the ring, so every one of its users moves
+                moved = 0
+                if old_user_ids:
+                    profiles = shard.get_many(old_user_ids)
+                    for new_node, user_ids in self._group(profiles).items():
+                        self.nodes[new_node].put_many({user_id: profiles[user_id] for user_id in user_ids})
+                    shard.delete_many(old_user_ids)
+                    moved = len(profiles)
+
+        with self._pending_lock:
+            self._stats["moved"] += moved
+        logger.info(f"Removed profile node {name}, moved {moved} profiles")
+        return moved
+
+    def user_ids(self) -> List[str]:
+        return [user_id for shard in self.nodes.values() for user_id in shard.user_ids()]
+
+    def put_many(self, profiles: Dict[str, Dict[str, float]]):
+        self.flush()
+        with self._hold_ring():
+            self._sync_ring(force=True)
+            for node, user_ids in self._group(profiles).items():
+                self.nodes[node].put_many({user_id: profiles[user_id] for user_id in user_ids})
+
+    def delete_many(self, user_ids: Iterable[str]):
+        user_ids = list(user_ids)
+        with self._pending_lock:
+            for user_id in user_ids:
+                self._pending.pop(user_id, None)
+                # A retried batch must not recreate a deleted profile
+                for _, batch in self._unacked.values():
+                    batch.pop(user_id, None)
+        with self._hold_ring():
+            self._sync_ring(force=True)
+            for node, node_user_ids in self._group(user_ids).items():
+                self.nodes[node].delete_many(node_user_ids)
+
+    def memory_usage(self) -> Dict:
+        # Only the write-behind buffer is held in memory; shards are files or other nodes
+        with self._pending_lock:
+            unacked = sum(sampled_sizeof(batch.items(), len(batch)) for _, batch in self._unacked.values())
+            return {"bytes": sampled_sizeof(self._pending.items(), len(self._pending)) + unacked,
+                    "entries": len(self._pending) + sum(len(batch) for _, batch in self._unacked.values())}
+
+    def stats(self) -> Dict:
+        with self._pending_lock:
+            stats = dict(self._stats)
+            stats["pending_users"] = len(self._pending)
+            stats["unacked_batches"] = len(self._unacked)
+        return {
+            "backend": type(self).__name__,
+            "local_node": self.local_node,
+            "ring_version": self.ring_version,
+            "nodes": {name: shard.stats() if shard is self.local_shard else type(shard).__name__
+                      for name, shard in self.nodes.items()},
+            **stats
+        }
+
+
+def profile_store_from_env(categories: Sequence[str] = ()) -> ProfileStore:
+    """
+    Build the profile store configured by environment variables.
+
+    ML_PROFILE_STORE selects "memory" (default), "sqlite" (ML_PROFILE_DB) or "sharded".
+    A sharded store keeps its membership in ML_PROFILE_DB, shared by every worker on
+    the machine; ML_PROFILE_NODES ("name=url" pairs) only seeds it the first time.
+    A "file:<path>" url is a local SQLite shard, which lets a cluster be run on one
+    machine. ML_PROFILE_NODE_NAME names this node, whose shard is used directly.
+
+    Args:
+        categories (Sequence[str]): Categories a new profile starts with at 0.0
+
+    Returns:
+        ProfileStore: The configured store
+    """
+    backend = os.getenv("ML_PROFILE_STORE", "memory").lower()
+
+    if backend == "sqlite":
+        return SQLiteProfileStore(PROFILE_DB_PATH, categories=categories)
+
+    if backend == "sharded":
+        nodes: Dict[str, str] = {}
+        for entry in os.getenv("ML_PROFILE_NODES", "").split(","):
+            if "=" not in entry:
+                continue
+            name, url = (part.strip() for part in entry.split("=", 1))
+            nodes[name] = url
+
+        ring = ProfileRing(PROFILE_DB_PATH)
+        if not nodes and not ring.version():
+            raise ValueError("ML_PROFILE_STORE=sharded requires ML_PROFILE_NODES")
+
+        return ShardedProfileStore(
+            nodes,
+            local_node=os.getenv("ML_PROFILE_NODE_NAME") or None,
+            virtual_nodes=int(os.getenv("ML_PROFILE_VIRTUAL_NODES", 64)),
+            flush_interval=float(os.getenv("ML_PROFILE_FLUSH_INTERVAL", 0.5)),
+            max_pending=int(os.getenv("ML_PROFILE_MAX_PENDING", 1000)),
+            token=os.getenv("ML_CLUSTER_TOKEN", ""),
+            ring=ring,
+            categories=categories
+        )
+
+    return InMemoryProfileStore(categories)
@@ -0,0 +1,232 @@
+"""
+Materialized Recommendation Store
+
+Keeps a precomputed top-N list per active user so that repeated recommendation
+requests can be served as a lookup. An entry is reused while the user's profile
+stays within a tolerance of the profile it was computed from, and is refreshed
+incrementally when only new items have entered the content pool.
+
+Entries do not hold their pool: the pools themselves are kept once, in a small
+LRU shared by every user, and entries refer to them by version. Requests drawn
+from the same catalog query share a pool, so memory grows with the number of
+distinct recent pools rather than with the number of users.
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from utils.logger import get_logger
+from utils.memory import sampled_sizeof
+
+logger = get_logger(__name__)
+
+
+class MaterializedEntry:
+    """
+    A materialized top-N list for one user.
+    """
+
+    __slots__ = ("ranked", "pool_version", "pool_size", "profile", "computed_at")
+
+    def __init__(self, ranked: List[Tuple[float, str]], pool_version: int, pool_size: int,
+                 profile: Dict[str, float], computed_at: float):
+        self.ranked = ranked              # (score, item_id) pairs sorted by score, descending
+        self.pool_version = pool_version  # Version of the pool the ranking was computed over
+        self.pool_size = pool_size        # Number of items in that pool
+        self.profile = profile            # Snapshot of the user profile used for scoring
+        self.computed_at = computed_at
+
+
+class MaterializedRecommendations:
+    """
+    LRU-bounded store of per-user top-N recommendation lists.
+    """
+
+    def __init__(self, top_n: int = 50, max_users: int = 10000,
+                 max_staleness: float = 3600.0, profile_tolerance: float = 0.05,
+                 max_pools: int = 16):
+        """
+        Initialize the store.
+
+        Args:
+            top_n (int): Number of ranked items kept per user
+            max_users (int): Maximum number of users kept; least recently used are evicted
+            max_staleness (float): Seconds after which an entry is recomputed from scratch
+            profile_tolerance (float): L1 distance between profiles below which an entry is reused
+            max_pools (int): Number of recent content pools kept for incremental refreshes
+        """
+        self.top_n = top_n
+        self.max_users = max_users
+        self.max_staleness = max_staleness
+        self.profile_tolerance = profile_tolerance
+        self.max_pools = max_pools
+
+        self._entries: "OrderedDict[str, MaterializedEntry]" = OrderedDict()
+        # Recent pools by content, and by version for the entries that refer to them
+        self._pool_versions: "OrderedDict[FrozenSet[str], int]" = OrderedDict()
+        self._pools: Dict[int, FrozenSet[str]] = {}
+        self._next_pool_version = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "incremental": 0, "recomputed": 0, "evicted": 0}
+
+    @classmethod
+    def from_env(cls) -> "MaterializedRecommendations":
+        """
+        Build a store configured from environment variables.
+
+        Returns:
+            MaterializedRecommendations: Configured store
+        """
+        return cls(
+            top_n=int(os.getenv("ML_RECOMMEND_MATERIALIZE_SIZE", 50)),
+            max_users=int(os.getenv("ML_RECOMMEND_MAX_USERS", 10000)),
+            max_staleness=float(os.getenv("ML_RECOMMEND_MAX_STALENESS", 3600)),
+            profile_tolerance=float(os.getenv("ML_RECOMMEND_PROFILE_TOLERANCE", 0.05)),
+            max_pools=int(os.getenv("ML_RECOMMEND_MAX_POOLS", 16))
+        )
+
+    @staticmethod
+    def profile_distance(a: Dict[str, float], b: Dict[str, float]) -> float:
+        """
+        L1 distance between two interest profiles.
+        """
+        return sum(abs(a.get(key, 0.0) - b.get(key, 0.0)) for key in set(a) | set(b))
+
+    def pool_version(self, pool_ids: FrozenSet[str]) -> int:
+        """
+        Get the version of a content pool, registering it if it is not among the recent pools.
+
+        Args:
+            pool_ids (FrozenSet[str]): Item ids of the pool
+
+        Returns:
+            int: Version shared by every request with the same pool
+        """
+        with self._lock:
+            version = self._pool_versions.get(pool_ids)
+            if version is None:
+                version = self._next_pool_version
+                self._next_pool_version += 1
+                self._pool_versions[pool_ids] = version
+                self._pools[version] = pool_ids
+                while len(self._pool_versions) > self.max_pools:
+                    _, evicted = self._pool_versions.popitem(last=False)
+                    del self._pools[evicted]
+            self._pool_versions.move_to_end(pool_ids)
+            return version
+
+    def pool(self, version: int) -> Optional[FrozenSet[str]]:
+        """
+        Get the item ids of a recent pool, or None if it has been evicted.
+        """
+        with self._lock:
+            return self._pools.get(version)
+
+    def get(self, user_id: str, profile: Dict[str, float]) -> Optional[MaterializedEntry]:
+        """
+        Get a user's entry if it is still fresh for the given profile.
+
+        Args:
+            user_id (str): User ID
+            profile (Dict[str, float]): The user's current profile
+
+        Returns:
+            MaterializedEntry or None: The entry, or None if missing or stale
+        """
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+
+            if (time.time() - entry.computed_at > self.max_staleness
+                    or self.profile_distance(entry.profile, profile) > self.profile_tolerance):
+                del self._entries[user_id]
+                return None
+
+            self._entries.move_to_end(user_id)
+            return entry
+
+    def put(self, user_id: str, ranked: List[Tuple[float, str]], pool_version: int, pool_size: int,
+            profile: Dict[str, float], computed_at: Optional[float] = None):
+        """
+        Store a user's ranking, keeping only the top_n items.
+
+        Args:
+            user_id (str): User ID
+            ranked (List[Tuple[float, str]]): (score, item_id) pairs sorted by score, descending
+            pool_version (int): Version of the pool the ranking covers, from pool_version()
+            pool_size (int): Number of items in the pool
+            profile (Dict[str, float]): Profile used for scoring
+            computed_at (float, optional): When the full ranking was computed, defaults to now
+        """
+        entry = MaterializedEntry(
+            ranked[:self.top_n], pool_version, pool_size, dict(profile), computed_at or time.time()
+        )
+        with self._lock:
+            self._entries[user_id] = entry
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+                self._stats["evicted"] += 1
+
+    def invalidate(self, user_id: Optional[str] = None):
+        """
+        Drop one user's entry, or every entry when user_id is None.
+        """
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+                self._pool_versions.clear()
+                self._pools.clear()
+            else:
+                self._entries.pop(user_id, None)
+
+    def shrink(self, fraction: float):
+        """
+        Drop the given fraction of the least recently used entries.
+        """
+        with self._lock:
+            for _ in range(int(len(self._entries) * fraction)):
+                self._entries.popitem(last=False)
+                self._stats["evicted"] += 1
+
+    def memory_usage(self) -> Dict[str, int]:
+        """
+        Estimated bytes held by the materialized rankings and the recent pools.
+        """
+        with self._lock:
+            entry_bytes = sampled_sizeof(self._entries.values(), len(self._entries), sample=20)
+            pool_bytes = sum(
+                sys.getsizeof(pool) + sampled_sizeof(pool, len(pool), sample=20)
+                for pool in self._pools.values()
+            )
+            return {"bytes": entry_bytes + pool_bytes, "entries": len(self._entries), "pools": len(self._pools)}
+
+    def record(self, outcome: str):
+        """
+        Count a lookup outcome ("hits", "incremental" or "recomputed").
+        """
+        with self._lock:
+            self._stats[outcome] += 1
+
+    def stats(self) -> Dict:
+        """
+        Get store counters and configuration.
+
+        Returns:
+            Dict: Lookup outcomes, number of users and limits
+        """
+        with self._lock:
+            return {
+                **self._stats,
+                "users": len(self._entries),
+                "pools": len(self._pools),
+                "top_n": self.top_n,
+                "max_users": self.max_users,
+                "max_staleness": self.max_staleness,
+                "profile_tolerance": self.profile_tolerance
+            }
@@ -0,0 +1,282 @@
+"""
+Shadow Evaluation
+
+Mirrors a sampled fraction of live classification inputs to a candidate model
+off the request path, so a new TechContentClassifier artifact can be compared
+with the serving model on real traffic before it is promoted. The live result
+and latency of the serving model are recorded with each sampled input, and only
+the candidate is run, on its own executor carved out of the worker's thread
+budget, so it never takes an inference thread from live requests. Latency distributions, top-k agreement and model memory are
+collected into a comparison report. The queue is bounded and drops work when
+full, so live requests never wait on shadow work.
+"""
+
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+from utils.logger import get_logger
+from utils.memory import model_bytes, rss_bytes
+from utils.thread_budget import get_shadow_executor
+
+logger = get_logger(__name__)
+
+# Number of latency samples kept per model
+LATENCY_WINDOW = 5000
+
+
+def _percentiles(samples: deque) -> Dict[str, Optional[float]]:
+    if not samples:
+        return {"count": 0, "mean_ms": None, "p50_ms": None, "p95_ms": None, "p99_ms": None}
+
+    ordered = sorted(samples)
+
+    def pick(pct: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(pct / 100.0 * len(ordered)))], 3)
+
+    return {
+        "count": len(ordered),
+        "mean_ms": round(sum(ordered) / len(ordered), 3),
+        "p50_ms": pick(50),
+        "p95_ms": pick(95),
+        "p99_ms": pick(99)
+    }
+
+
+class ShadowEvaluator:
+    """
+    Background comparison of a candidate classifier against the serving classifier.
+    """
+
+    def __init__(self, primary, candidate_loader, sample_rate: float = 0.05, queue_size: int = 100,
+                 top_k: int = 3, max_latency_regression: float = 0.2,
+                 max_memory_regression: float = 0.2, min_agreement: float = 0.9):
+        """
+        Initialize the evaluator.
+
+        Args:
+            primary: Serving classifier (TechContentClassifier or CascadeClassifier); only used for its memory
+            candidate_loader (Callable): Returns the candidate classifier; called on the shadow thread
+            sample_rate (float): Fraction of live inputs mirrored to the shadow queue
+            queue_size (int): Maximum queued inputs; new inputs are dropped when full
+            top_k (int): Number of top categories compared for agreement
+            max_latency_regression (float): Allowed relative p99 latency increase of the candidate
+            max_memory_regression (float): Allowed relative model memory increase of the candidate
+            min_agreement (float): Minimum top-1 agreement before the candidate is flagged
+        """
+        self.primary = primary
+        self.candidate_loader = candidate_loader
+        self.candidate = None
+        self.sample_rate = sample_rate
+        self.top_k = top_k
+        self.max_latency_regression = max_latency_regression
+        self.max_memory_regression = max_memory_regression
+        self.min_agreement = min_agreement
+
+        self._queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+        self._latencies = {"primary": deque(maxlen=LATENCY_WINDOW), "candidate": deque(maxlen=LATENCY_WINDOW)}
+        self._memory: Dict[str, Optional[int]] = {}
+        self._counts = {
+            "sampled": 0, "dropped": 0, "compared": 0, "errors": 0,
+            "top1_agreed": 0, "both_empty": 0
+        }
+        self._overlap_sum = 0.0
+
+    @classmethod
+    def from_env(cls, primary) -> Optional["ShadowEvaluator"]:
+        """
+        Build an evaluator from environment variables.
+
+        The candidate is configured with ML_SHADOW_MODEL_TYPE and ML_SHADOW_MODEL_PATH
+        (a saved traditional model or a fine-tuned transformer directory).
+
+        Args:
+            primary: Serving classifier
+
+        Returns:
+            ShadowEvaluator or None: Configured evaluator, or None if shadow mode is off
+        """
+        model_path = os.getenv("ML_SHADOW_MODEL_PATH", "")
+        if not model_path:
+            return None
+
+        model_type = os.getenv("ML_SHADOW_MODEL_TYPE", "traditional")
+
+        def load_candidate():
+            from models.classifier_model import TechContentClassifier
+
+            candidate = TechContentClassifier(model_type=model_type)
+            candidate.load(model_path)
+            return candidate
+
+        return cls(
+            primary,
+            load_candidate,
+            sample_rate=float(os.getenv("ML_SHADOW_SAMPLE_RATE", 0.05)),
+            queue_size=int(os.getenv("ML_SHADOW_QUEUE_SIZE", 100)),
+            top_k=int(os.getenv("ML_SHADOW_TOP_K", 3)),
+            max_latency_regression=float(os.getenv("ML_SHADOW_MAX_LATENCY_REGRESSION", 0.2)),
+            max_memory_regression=float(os.getenv("ML_SHADOW_MAX_MEMORY_REGRESSION", 0.2)),
+            min_agreement=float(os.getenv("ML_SHADOW_MIN_AGREEMENT", 0.9))
+        )
+
+    def start(self):
+        """
+        Start the shadow thread, which loads the candidate and then drains the queue.
+        """
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="shadow-evaluator", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """
+        Stop the shadow thread; queued inputs are discarded.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def submit(self, text: str, threshold: float, primary_result: Dict[str, float],
+               primary_latency_ms: Optional[float] = None, top_k: Optional[int] = None):
+        """
+        Mirror a live input and the serving model's result to the shadow queue if it is sampled.
+
+        Never blocks: inputs are dropped when the queue is full.
+
+        Args:
+            text (str): Classifier input, as passed to the serving model
+            threshold (float): Confidence threshold of the live request
+            primary_result (Dict[str, float]): Categories returned to the live request
+            primary_latency_ms (float, optional): Time the live request waited for its inference; None for cached or micro-batched
+                results, which are compared but left out of the latency report
+            top_k (int, optional): top_k of the live request
+        """
+        if self._thread is None or random.random() >= self.sample_rate:
+            return
+
+        try:
+            self._queue.put_nowait((text, threshold, top_k, primary_result, primary_latency_ms))
+        except queue.Full:
+            with self._lock:
+                self._counts["dropped"] += 1
+            return
+
+        with self._lock:
+            self._counts["sampled"] += 1
+
+    def _run(self):
+        rss_before = rss_bytes()
+        try:
+            self.candidate = self.candidate_loader()
+        except Exception as e:
+            logger.error(f"Shadow candidate failed to load: {str(e)}")
+            self._thread = None
+            return
+        rss_after = rss_bytes()
+
+        with self._lock:
+            self._memory = {
+                "primary_model_bytes": model_bytes(self.primary),
+                "candidate_model_bytes": model_bytes(self.candidate),
+                "candidate_load_rss_bytes": (
+                    rss_after - rss_before if rss_before is not None and rss_after is not None else None
+                )
+            }
+        logger.info(f"Shadow evaluation started with {self._memory}")
+
+        while not self._stop.is_set():
+            try:
+                text, threshold, top_k, primary_result, primary_latency_ms = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+            # Timed like the live request, from submission to result
+            start = time.perf_counter()
+            try:
+                candidate_result = get_shadow_executor().submit(
+                    self.candidate.predict, text, threshold=threshold, top_k=top_k
+                ).result()
+            except Exception as e:
+                logger.warning(f"Shadow comparison failed: {str(e)}")
+                with self._lock:
+                    self._counts["errors"] += 1
+                continue
+
+            if primary_latency_ms is not None:
+                self._latencies["primary"].append(primary_latency_ms)
+                self._latencies["candidate"].append((time.perf_counter() - start) * 1000.0)
+            self._compare(primary_result, candidate_result)
+
+    def _top(self, categories: Dict[str, float]) -> List[str]:
+        return [name for name, _ in sorted(categories.items(), key=lambda x: x[1], reverse=True)[:self.top_k]]
+
+    def _compare(self, primary: Dict[str, float], candidate: Dict[str, float]):
+        primary_top, candidate_top = self._top(primary), self._top(candidate)
+
+        with self._lock:
+            self._counts["compared"] += 1
+            if not primary_top and not candidate_top:
+                self._counts["both_empty"] += 1
+                self._counts["top1_agreed"] += 1
+                self._overlap_sum += 1.0
+                return
+
+            if primary_top[:1] == candidate_top[:1]:
+                self._counts["top1_agreed"] += 1
+            union = set(primary_top) | set(candidate_top)
+            self._overlap_sum += len(set(primary_top) & set(candidate_top)) / len(union)
+
+    def report(self) -> Dict[str, Any]:
+        """
+        Compare the candidate with the serving model.
+
+        Returns:
+            Dict[str, Any]: Latency, agreement and memory of both models, plus the
+                regressions that would block promotion
+        """
+        with self._lock:
+            counts = dict(self._counts)
+            memory = dict(self._memory)
+            overlap_sum = self._overlap_sum
+            latency = {name: _percentiles(samples) for name, samples in self._latencies.items()}
+
+        compared = counts["compared"]
+        agreement = {
+            "top1": counts["top1_agreed"] / compared if compared else None,
+            f"top{self.top_k}_overlap": overlap_sum / compared if compared else None
+        }
+
+        regressions = []
+        primary_p99, candidate_p99 = latency["primary"]["p99_ms"], latency["candidate"]["p99_ms"]
+        if primary_p99 and candidate_p99 and candidate_p99 > primary_p99 * (1 + self.max_latency_regression):
+            regressions.append(f"p99 latency {candidate_p99}ms vs {primary_p99}ms")
+
+        primary_bytes, candidate_bytes = memory.get("primary_model_bytes"), memory.get("candidate_model_bytes")
+        if primary_bytes and candidate_bytes and candidate_bytes > primary_bytes * (1 + self.max_memory_regression):
+            regressions.append(f"model memory {candidate_bytes} vs {primary_bytes} bytes")
+
+        if agreement["top1"] is not None and agreement["top1"] < self.min_agreement:
+            regressions.append(f"top-1 agreement {agreement['top1']:.3f} below {self.min_agreement}")
+
+        return {
+            "running": self._thread is not None,
+            "candidate_loaded": self.candidate is not None,
+            "sample_rate": self.sample_rate,
+            "queue_depth": self._queue.qsize(),
+            "counts": counts,
+            "latency": latency,
+            "agreement": agreement,
+            "memory": memory,
+            "regressions": regressions
+        }
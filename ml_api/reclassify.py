@@ -0,0 +1,286 @@
+"""
+Offline bulk re-classification tool
+
+Streams a JSONL or CSV export of posts, videos and shorts through TechContentClassifier
+using a process pool, writes results to a JSONL file in input order, and checkpoints
+progress so that an interrupted run resumes where it stopped.
+
+Usage:
+    python reclassify.py catalog.jsonl labels.jsonl --workers 8 --batch-size 256
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+from utils.logger import get_logger
+from utils.text_preprocessing import prepare_text
+from utils.thread_budget import ThreadBudget, apply_thread_budget, available_cores
+
+logger = get_logger("reclassify")
+
+# Fields used by the backend content models (models/post.js, video.js, short.js)
+DEFAULT_TEXT_FIELDS = ["title", "description", "content", "transcript", "text"]
+DEFAULT_ID_FIELDS = ["id", "_id"]
+
+# Per-worker state, set up once by _init_worker
+_worker_classifier = None
+_worker_options: Dict = {}
+
+
+def read_records(path: str, input_format: str) -> Iterator[Dict]:
+    """
+    Stream records from a JSONL or CSV file without loading it into memory.
+
+    Args:
+        path (str): Input file path
+        input_format (str): Either "jsonl" or "csv"
+
+    Yields:
+        Dict: One record per line / row
+    """
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        if input_format == "csv":
+            for row in csv.DictReader(f):
+                yield row
+        else:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+
+def build_text(record: Dict, text_fields: List[str]) -> str:
+    """
+    Combine the text fields of a record the same way the analysis endpoints do.
+
+    Args:
+        record (Dict): Content record
+        text_fields (List[str]): Fields to include, in order
+
+    Returns:
+        str: Combined text for classification
+    """
+    return prepare_text({field: record.get(field) for field in text_fields}).text
+
+
+def _load_classifier(model_type: str, model_path: Optional[str]):
+    """
+    Build the classifier used by a worker process.
+    """
+    from models.classifier_model import TechContentClassifier, MODEL_DIR
+
+    if model_type == "transformer":
+        return TechContentClassifier(model_type="transformer")
+
+    traditional = TechContentClassifier(model_type="traditional")
+    path = model_path or MODEL_DIR / "tech_classifier_traditional.joblib"
+    if Path(path).exists():
+        traditional.load(str(path))
+    else:
+        logger.warning(f"No traditional model found at {path}")
+
+    if model_type == "cascade":
+        from models.cascade_classifier import CascadeClassifier
+        return CascadeClassifier.from_env(fast_classifier=traditional)
+
+    return traditional
+
+
+def _init_worker(model_type: str, model_path: Optional[str], budget: ThreadBudget, options: Dict):
+    """
+    Initialize a pool worker: limit its thread pools and load the model once.
+    """
+    global _worker_classifier, _worker_options
+
+    apply_thread_budget(budget)
+
+    _worker_classifier = _load_classifier(model_type, model_path)
+    _worker_options = options
+
+
+def _classify_batch(records: List[Dict]) -> List[str]:
+    """
+    Classify a batch of records in a worker process.
+
+    Returns:
+        List[str]: Serialized JSONL output lines, in input order
+    """
+    options = _worker_options
+    texts = [build_text(record, options["text_fields"]) for record in records]
+    predictions = _worker_classifier.predict_batch(
+        texts,
+        threshold=options["threshold"],
+        top_k=options["top_k"],
+        batch_size=options["model_batch_size"]
+    )
+
+    lines = []
+    for record, categories in zip(records, predictions):
+        content_id = next((record[field] for field in options["id_fields"] if record.get(field) is not None), None)
+        primary_category, confidence = (
+            max(categories.items(), key=lambda x: x[1]) if categories else (None, 0.0)
+        )
+        lines.append(json.dumps({
+            "id": content_id,
+            "content_type": record.get("type") or record.get("content_type"),
+            "categories": categories,
+            "primary_category": primary_category,
+            "confidence": confidence,
+            "is_tech_content": bool(categories)
+        }))
+    return lines
+
+
+def _batched(records: Iterator[Dict], size: int) -> Iterator[List[Dict]]:
+    while True:
+        batch = list(itertools.islice(records, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _read_checkpoint(path: Path) -> Dict:
+    if not path.exists():
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_checkpoint(path: Path, state: Dict):
+    """
+    Atomically replace the checkpoint file.
+    """
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def run(args) -> int:
+    """
+    Run the re-classification job.
+
+    Returns:
+        int: Number of records classified in this run
+    """
+    input_format = args.format or ("csv" if args.input.lower().endswith(".csv") else "jsonl")
+    output_path = Path(args.output)
+    checkpoint_path = Path(args.checkpoint or f"{args.output}.ckpt")
+
+    # Resume from the last checkpoint: skip classified records and drop any
+    # output written after the checkpoint was taken
+    state = {} if args.no_resume else _read_checkpoint(checkpoint_path)
+    if state and state.get("input") != os.path.abspath(args.input):
+        logger.warning("Checkpoint belongs to a different input file, starting from scratch")
+        state = {}
+    if state and not output_path.exists():
+        logger.warning("Output file is missing, starting from scratch")
+        state = {}
+
+    records_done = state.get("records_done", 0)
+    output_bytes = state.get("output_bytes", 0)
+
+    mode = "r+b" if output_path.exists() and records_done else "wb"
+    output = open(output_path, mode)
+    output.truncate(output_bytes)
+    output.seek(output_bytes)
+
+    if records_done:
+        logger.info(f"Resuming after {records_done} records")
+
+    records = itertools.islice(read_records(args.input, input_format), records_done, None)
+    batches = _batched(records, args.batch_size)
+
+    workers = args.workers or len(available_cores())
+    # Each worker classifies one batch at a time with its share of the cores
+    budget = ThreadBudget(cores=len(available_cores()), workers=workers, executor_threads=1)
+    options = {
+        "text_fields": args.text_fields.split(","),
+        "id_fields": DEFAULT_ID_FIELDS,
+        "threshold": args.threshold,
+        "top_k": args.top_k,
+        "model_batch_size": args.model_batch_size
+    }
+
+    context = multiprocessing.get_context(args.start_method)
+    started = time.time()
+    last_report = started
+    processed = 0
+    batches_since_checkpoint = 0
+
+    with context.Pool(
+        processes=workers,
+        initializer=_init_worker,
+        initargs=(args.model_type, args.model_path, budget, options)
+    ) as pool:
+        try:
+            # imap keeps results in input order while workers run ahead
+            for lines in pool.imap(_classify_batch, batches, chunksize=1):
+                output.write(("\n".join(lines) + "\n").encode("utf-8"))
+                processed += len(lines)
+                batches_since_checkpoint += 1
+
+                if batches_since_checkpoint >= args.checkpoint_every:
+                    output.flush()
+                    os.fsync(output.fileno())
+                    _write_checkpoint(checkpoint_path, {
+                        "input": os.path.abspath(args.input),
+                        "records_done": records_done + processed,
+                        "output_bytes": output.tell()
+                    })
+                    batches_since_checkpoint = 0
+
+                now = time.time()
+                if now - last_report >= args.report_interval:
+                    rate = processed / (now - started)
+                    logger.info(f"Classified {records_done + processed} records ({rate:.1f} items/s)")
+                    last_report = now
+        finally:
+            output.flush()
+            os.fsync(output.fileno())
+            _write_checkpoint(checkpoint_path, {
+                "input": os.path.abspath(args.input),
+                "records_done": records_done + processed,
+                "output_bytes": output.tell()
+            })
+            output.close()
+
+    elapsed = time.time() - started
+    rate = processed / elapsed if elapsed else 0.0
+    logger.info(f"Done: {processed} records in {elapsed:.1f}s ({rate:.1f} items/s)")
+    return processed
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Bulk re-classify content with TechContentClassifier")
+    parser.add_argument("input", help="Input JSONL or CSV file")
+    parser.add_argument("output", help="Output JSONL file")
+    parser.add_argument("--format", choices=["jsonl", "csv"], help="Input format (default: from extension)")
+    parser.add_argument("--model-type", choices=["traditional", "transformer", "cascade"], default="traditional")
+    parser.add_argument("--model-path", help="Path to a saved traditional model")
+    parser.add_argument("--workers", type=int, default=0, help="Worker processes (default: CPU count)")
+    parser.add_argument("--batch-size", type=int, default=512, help="Records sent to a worker at a time")
+    parser.add_argument("--model-batch-size", type=int, default=64, help="Texts per model call")
+    parser.add_argument("--threshold", type=float, default=0.5)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--text-fields", default=",".join(DEFAULT_TEXT_FIELDS),
+                        help="Comma separated record fields to classify")
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: <output>.ckpt)")
+    parser.add_argument("--checkpoint-every", type=int, default=10, help="Batches between checkpoints")
+    parser.add_argument("--report-interval", type=float, default=5.0, help="Seconds between progress reports")
+    parser.add_argument("--no-resume", action="store_true", help="Ignore an existing checkpoint")
+    parser.add_argument("--start-method", choices=["spawn", "fork", "forkserver"], default="spawn")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    run(parse_args())
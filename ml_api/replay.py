@@ -0,0 +1,252 @@
+"""
+Traffic replay load generator
+
+Replays requests recorded by the traffic capture (ML_CAPTURE_ENABLED) with
+their original mix and arrival pattern, either against the app in-process or
+against a running server over HTTP, at the captured speed or N times faster.
+Requests are sent on schedule whether or not earlier ones have completed, like
+real clients, so a slower build shows up as higher latency and schedule lag
+rather than a lower request rate. Reports throughput, latency percentiles and
+error rates overall and per route, next to the latencies seen in production.
+
+Usage:
+    python replay.py cache/captures --speed 2
+    python replay.py captures/ --target http://localhost:8000 --speed 0 --concurrency 64 --output report.json
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+from utils.logger import get_logger
+from utils.traffic_capture import load_captures
+
+logger = get_logger("replay")
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+
+def _summary(values: List[float]) -> Dict[str, float]:
+    return {
+        "p50": round(_percentile(values, 50), 2),
+        "p95": round(_percentile(values, 95), 2),
+        "p99": round(_percentile(values, 99), 2),
+        "max": round(max(values), 2) if values else 0.0
+    }
+
+
+def select_records(records: List[Dict], paths: Optional[List[str]] = None,
+                   limit: Optional[int] = None) -> List[Dict]:
+    """
+    Keep the replayable records, optionally only those under the given path prefixes.
+
+    Records whose body was not captured (non-JSON or over the size limit) cannot
+    be reproduced and are left out.
+
+    Returns:
+        List[Dict]: Records in arrival order
+    """
+    selected = [
+        record for record in records
+        if not record.get("body_skipped") and (not paths or any(record["path"].startswith(p) for p in paths))
+    ]
+    return selected[:limit] if limit else selected
+
+
+async def _wait_ready(client, timeout: float):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            response = await client.get("/ready")
+            if response.status_code == 200:
+                return
+        except Exception:
+            pass
+        await asyncio.sleep(0.5)
+    raise RuntimeError(f"Target was not ready after {timeout} seconds")
+
+
+async def replay(records: List[Dict], client, speed: float = 1.0, concurrency: int = 256,
+                 timeout: float = 30.0) -> List[Dict[str, Any]]:
+    """
+    Send the records on their captured schedule.
+
+    Args:
+        records (List[Dict]): Capture records in arrival order
+        client (httpx.AsyncClient): Client bound to the target
+        speed (float): Replay speed relative to the capture; 0 sends everything at once
+        concurrency (int): Maximum requests outstanding; later requests wait and lag behind schedule
+        timeout (float): Per-request timeout in seconds
+
+    Returns:
+        List[Dict[str, Any]]: One result per record, in record order
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+    results: List[Optional[Dict[str, Any]]] = [None] * len(records)
+    first_ts = records[0]["ts"] if records else 0.0
+    started = loop.time()
+
+    async def send(index: int, record: Dict, scheduled: float):
+        async with semaphore:
+            lag = max(0.0, loop.time() - scheduled)
+            url = record["path"] + (f"?{record['query']}" if record.get("query") else "")
+            request_start = time.perf_counter()
+            status, error = None, None
+            try:
+                response = await client.request(
+                    record["method"], url, headers=record.get("headers") or {},
+                    content=json.dumps(record["body"]).encode("utf-8") if record.get("body") is not None else None,
+                    timeout=timeout
+                )
+                status = response.status_code
+            except Exception as e:
+                error = type(e).__name__
+            results[index] = {
+                "path": record["path"],
+                "status": status,
+                "error": error,
+                "latency_ms": (time.perf_counter() - request_start) * 1000.0,
+                "lag_ms": lag * 1000.0,
+                "captured_status": record.get("status"),
+                "captured_latency_ms": record.get("duration_ms")
+            }
+
+    tasks = []
+    for index, record in enumerate(records):
+        scheduled = started + ((record["ts"] - first_ts) / speed if speed > 0 else 0.0)
+        delay = scheduled - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.ensure_future(send(index, record, scheduled)))
+    await asyncio.gather(*tasks)
+
+    return results
+
+
+def build_report(results: List[Dict[str, Any]], wall_seconds: float, speed: float) -> Dict[str, Any]:
+    """
+    Summarize replay results overall and per route.
+
+    Returns:
+        Dict[str, Any]: Throughput, error rates and latency percentiles, with the captured latencies for comparison
+    """
+    def summarize(group: List[Dict[str, Any]]) -> Dict[str, Any]:
+        server_errors = sum(1 for r in group if r["status"] is not None and r["status"] >= 500)
+        client_errors = sum(1 for r in group if r["status"] is not None and 400 <= r["status"] < 500)
+        failures = sum(1 for r in group if r["error"] is not None)
+        # Statuses that differ from production, e.g. 404s from unknown ids in a fresh instance
+        changed = sum(1 for r in group if r["captured_status"] is not None and r["status"] != r["captured_status"])
+        return {
+            "requests": len(group),
+            "error_rate": round((server_errors + failures) / len(group), 4) if group else 0.0,
+            "server_errors": server_errors,
+            "client_errors": client_errors,
+            "failures": failures,
+            "status_changed": changed,
+            "latency_ms": _summary([r["latency_ms"] for r in group if r["error"] is None]),
+            "captured_latency_ms": _summary([
+                r["captured_latency_ms"] for r in group if r["captured_latency_ms"] is not None
+            ])
+        }
+
+    by_path = defaultdict(list)
+    for result in results:
+        by_path[result["path"]].append(result)
+
+    return {
+        "speed": speed,
+        "wall_seconds": round(wall_seconds, 2),
+        "requests_per_second": round(len(results) / wall_seconds, 1) if wall_seconds else 0.0,
+        **summarize(results),
+        "schedule_lag_ms": _summary([r["lag_ms"] for r in results]),
+        "by_path": {path: summarize(group) for path, group in sorted(by_path.items())}
+    }
+
+
+def print_report(report: Dict[str, Any]):
+    print(f"{report['requests']} requests in {report['wall_seconds']}s at {report['speed']}x: "
+          f"{report['requests_per_second']} req/s, error rate {report['error_rate']:.2%}, "
+          f"p99 schedule lag {report['schedule_lag_ms']['p99']}ms")
+    print(f"{'path':<34} {'count':>6} {'err%':>6} {'p50':>8} {'p95':>8} {'p99':>8} {'prod p99':>9}")
+    for path, stats in [("(all)", report)] + list(report["by_path"].items()):
+        latency = stats["latency_ms"]
+        print(f"{path:<34} {stats['requests']:>6} {stats['error_rate'] * 100:>6.2f} {latency['p50']:>8} "
+              f"{latency['p95']:>8} {latency['p99']:>8} {stats['captured_latency_ms']['p99']:>9}")
+
+
+async def run(args) -> Dict[str, Any]:
+    """
+    Load the captures, replay them against the target and report.
+
+    Returns:
+        Dict[str, Any]: The report
+    """
+    import httpx
+
+    records = select_records(load_captures(args.captures), args.paths, args.limit)
+    if not records:
+        raise SystemExit("No replayable records found")
+    span = records[-1]["ts"] - records[0]["ts"]
+    logger.info(f"Replaying {len(records)} requests captured over {span:.1f}s at {args.speed or 'max'}x")
+
+    app = None
+    if args.target:
+        client = httpx.AsyncClient(base_url=args.target)
+    else:
+        # Imported here so the ML API is only loaded for in-process replays
+        from main import app
+        from utils.traffic_capture import traffic_capture
+
+        # Replayed requests must not be captured again
+        traffic_capture.enabled = False
+
+        await app.router.startup()
+        client = httpx.AsyncClient(app=app, base_url="http://replay")
+
+    try:
+        if not args.no_wait_ready:
+            await _wait_ready(client, args.ready_timeout)
+        started = time.time()
+        results = await replay(records, client, args.speed, args.concurrency, args.timeout)
+        report = build_report(results, time.time() - started, args.speed)
+    finally:
+        await client.aclose()
+        if app is not None:
+            await app.router.shutdown()
+
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        logger.info(f"Wrote report to {args.output}")
+    return report
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Replay captured ML API traffic and report latency")
+    parser.add_argument("captures", nargs="+", help="Capture files or directories")
+    parser.add_argument("--target", help="Base URL of a running server (default: replay in-process)")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="Replay speed relative to the capture (0: send as fast as possible)")
+    parser.add_argument("--concurrency", type=int, default=256, help="Maximum requests outstanding")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Per-request timeout in seconds")
+    parser.add_argument("--paths", type=lambda value: [p for p in value.split(",") if p],
+                        help="Comma separated path prefixes to replay")
+    parser.add_argument("--limit", type=int, help="Replay only the first N requests")
+    parser.add_argument("--no-wait-ready", action="store_true", help="Do not wait for /ready before replaying")
+    parser.add_argument("--ready-timeout", type=float, default=300.0, help="Seconds to wait for /ready")
+    parser.add_argument("--output", help="Write the report as JSON to this file")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(run(parse_args()))
@@ -0,0 +1,187 @@
+"""
+Micro-batching of concurrent inference requests.
+
+Requests that arrive close together are grouped and sent to the model as one
+predict_batch call, which amortizes the per-call overhead of vectorization and
+transformer forward passes. A batch starts as soon as it is full or its oldest
+request has waited max_wait_ms. While every inference thread is busy, batches
+keep filling instead, so batch size grows with load and the wait stays short
+when the server is idle.
+"""
+
+import asyncio
+import os
+import threading
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+from utils.logger import get_logger
+from utils.thread_budget import get_inference_executor, get_thread_budget
+
+logger = get_logger(__name__)
+
+# (item, future, enqueued at loop time)
+_Pending = Tuple[Any, "asyncio.Future", float]
+
+
+class MicroBatcher:
+    """
+    Groups items submitted from the event loop into batches for a blocking batch function.
+    """
+
+    def __init__(self, batch_fn: Callable[..., List[Any]], max_batch_size: int = 32,
+                 max_wait_ms: float = 5.0, max_in_flight: Optional[int] = None):
+        """
+        Initialize the batcher.
+
+        Args:
+            batch_fn (Callable): Called as batch_fn(items, *key) on the inference executor;
+                returns one result per item, in order
+            max_batch_size (int): Maximum number of items per batch
+            max_wait_ms (float): Longest time an item waits for its batch to fill
+            max_in_flight (int, optional): Batches run at once, defaults to the inference executor size
+        """
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_in_flight = max_in_flight or get_thread_budget().executor_threads
+
+        # Items are grouped by key, e.g. the prediction parameters they share
+        self._pending: Dict[Hashable, List[_Pending]] = {}
+        self._in_flight = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+        self._lock = threading.Lock()
+        self._stats = {"items": 0, "batches": 0, "max_batch_size": 0, "cancelled": 0, "errors": 0}
+
+    @classmethod
+    def from_env(cls, batch_fn: Callable[..., List[Any]]) -> "MicroBatcher":
+        """
+        Build a batcher configured from environment variables.
+
+        Args:
+            batch_fn (Callable): Blocking batch function
+
+        Returns:
+            MicroBatcher: Configured batcher
+        """
+        in_flight = os.getenv("ML_BATCH_MAX_IN_FLIGHT", "")
+        return cls(
+            batch_fn,
+            max_batch_size=int(os.getenv("ML_BATCH_MAX_SIZE", 32)),
+            max_wait_ms=float(os.getenv("ML_BATCH_MAX_WAIT_MS", 5)),
+            max_in_flight=int(in_flight) if in_flight else None
+        )
+
+    async def submit(self, item: Any, *key: Hashable) -> Any:
+        """
+        Run an item as part of the next batch with the same key.
+
+        Must be called from the event loop. Cancelling the caller drops the item
+        if its batch has not started yet.
+
+        Args:
+            item: Input for batch_fn
+            *key: Extra arguments of batch_fn, shared by every item of a batch
+
+        Returns:
+            Any: The result batch_fn returned for this item
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.setdefault(key, []).append((item, future, loop.time()))
+        self._schedule()
+        return await future
+
+    def _schedule(self):
+        """
+        Start every batch that is due while inference threads are free, and arm
+        the timer for the next one.
+        """
+        loop = asyncio.get_running_loop()
+        while self._in_flight < self.max_in_flight:
+            key = self._next_key(loop.time())
+            if key is None:
+                break
+            self._start(key)
+
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._pending and self._in_flight < self.max_in_flight:
+            oldest = min(batch[0][2] for batch in self._pending.values())
+            self._timer = loop.call_at(oldest + self.max_wait, self._on_timer)
+
+    def _on_timer(self):
+        self._timer = None
+        self._schedule()
+
+    def _next_key(self, now: float) -> Optional[Hashable]:
+        """
+        Key of a full batch, else of the batch waiting longest past max_wait.
+        """
+        due_key, due_since = None, None
+        for key, batch in self._pending.items():
+            if len(batch) >= self.max_batch_size:
+                return key
+            enqueued = batch[0][2]
+            if now - enqueued >= self.max_wait and (due_since is None or enqueued < due_since):
+                due_key, due_since = key, enqueued
+        return due_key
+
+    def _start(self, key: Hashable):
+        batch = self._pending[key][:self.max_batch_size]
+        rest = self._pending[key][self.max_batch_size:]
+        if rest:
+            self._pending[key] = rest
+        else:
+            del self._pending[key]
+
+        # Callers that went away while waiting do not cost inference
+        live = [(item, future) for item, future, _ in batch if not future.done()]
+        with self._lock:
+            self._stats["cancelled"] += len(batch) - len(live)
+        if not live:
+            return
+
+        self._in_flight += 1
+        asyncio.ensure_future(self._run(key, live))
+
+    async def _run(self, key: Tuple, batch: List[Tuple[Any, "asyncio.Future"]]):
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(
+                get_inference_executor(), self.batch_fn, [item for item, _ in batch], *key
+            )
+            if len(results) != len(batch):
+                raise ValueError(f"Batch function returned {len(results)} results for {len(batch)} items")
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+            with self._lock:
+                self._stats["items"] += len(batch)
+                self._stats["batches"] += 1
+                self._stats["max_batch_size"] = max(self._stats["max_batch_size"], len(batch))
+        except Exception as e:
+            logger.error(f"Batch of {len(batch)} items failed: {str(e)}")
+            with self._lock:
+                self._stats["errors"] += 1
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self._in_flight -= 1
+            self._schedule()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Batch counters and current queue depth.
+
+        Returns:
+            Dict[str, Any]: Items, batches, mean and max batch size, pending items and running batches
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        stats["mean_batch_size"] = round(stats["items"] / stats["batches"], 2) if stats["batches"] else None
+        stats["pending"] = sum(len(batch) for batch in self._pending.values())
+        stats["in_flight"] = self._in_flight
+        return stats
@@ -3,17 +3,32 @@ Caching utility for the ML API
 
 Implements caching for expensive operations like model inference
 to improve performance and reduce unnecessary processing.
+
+Entries live in a single SQLite database in WAL mode, so every uvicorn worker
+process shares one cache with atomic writes. Values are stored as JSON, the total
+size is bounded with least-recently-used eviction, and expired entries are
+removed by a background sweeper.
+
+Async callers go through Cache.aget and Cache.aset, which run the SQLite calls on a
+small dedicated thread pool so that lock contention between workers never stalls
+the event loop. Connections wait at most ML_CACHE_BUSY_TIMEOUT_MS for a lock held
+by another worker; a busy database is treated as a miss and the write is skipped.
 """
 
+import asyncio
 import functools
 import hashlib
 import json
 import os
-import pickle
+import sqlite3
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Any, Callable, Dict, Optional, Tuple, Union
 
+from starlette.requests import Request
+
 from utils.logger import get_logger
 
 logger = get_logger(__name__)
@@ -25,166 +40,508 @@ CACHE_DIR.mkdir(exist_ok=True)
 # Default cache expiration time (in seconds)
 DEFAULT_EXPIRATION = 60 * 60 * 24  # 24 hours
 
+# Cache database file, byte budget and sweep interval
+CACHE_PATH = Path(os.getenv("ML_CACHE_PATH", str(CACHE_DIR / "ml_api_cache.sqlite3")))
+CACHE_MAX_BYTES = int(os.getenv("ML_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+CACHE_SWEEP_INTERVAL = float(os.getenv("ML_CACHE_SWEEP_INTERVAL", 300))
+
+# Longest wait for another worker's write lock, and threads running cache calls for async callers
+CACHE_BUSY_TIMEOUT_MS = int(os.getenv("ML_CACHE_BUSY_TIMEOUT_MS", 100))
+CACHE_IO_THREADS = int(os.getenv("ML_CACHE_IO_THREADS", 2))
+
+# Hits only refresh the LRU timestamp when it is older than this, to keep reads cheap
+TOUCH_INTERVAL = 60.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    expires_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at);
+CREATE INDEX IF NOT EXISTS entries_expires_at ON entries (expires_at);
+CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+INSERT OR IGNORE INTO meta (name, value) VALUES ('total_bytes', 0);
+CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries BEGIN
+    UPDATE meta SET value = value + NEW.size WHERE name = 'total_bytes';
+END;
+CREATE TRIGGER IF NOT EXISTS entries_update AFTER UPDATE OF size ON entries BEGIN
+    UPDATE meta SET value = value - OLD.size + NEW.size WHERE name = 'total_bytes';
+END;
+CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries BEGIN
+    UPDATE meta SET value = value - OLD.size WHERE name = 'total_bytes';
+END;
+"""
+
+
+class SQLiteCacheStore:
+    """
+    Size-bounded cache store in a single SQLite file, safe to share between processes
+    """
+
+    def __init__(self, path: Path = CACHE_PATH, max_bytes: int = CACHE_MAX_BYTES,
+                 sweep_interval: float = CACHE_SWEEP_INTERVAL, busy_timeout_ms: int = CACHE_BUSY_TIMEOUT_MS):
+        """
+        Initialize the store. The database is opened lazily in each process and thread.
+
+        Args:
+            path: Database file path
+            max_bytes: Byte budget for stored values; least recently used entries are evicted
+            sweep_interval: Seconds between background removals of expired entries
+            busy_timeout_ms: Longest wait for a lock held by another process before giving up
+        """
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        self.busy_timeout_ms = busy_timeout_ms
+
+        self._local = threading.local()
+        self._sweeper_pid: Optional[int] = None
+        self._sweeper_lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "sets": 0, "evictions": 0, "expired": 0, "busy": 0, "errors": 0}
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        Get this thread's connection, reopening it after a fork.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.path), timeout=self.busy_timeout_ms / 1000.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+            conn.executescript(_SCHEMA)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+            self._start_sweeper()
+        return conn
+
+    def _start_sweeper(self):
+        """
+        Start the TTL sweeper thread once per process.
+        """
+        if self.sweep_interval <= 0:
+            return
+
+        with self._sweeper_lock:
+            if self._sweeper_pid == os.getpid():
+                return
+            self._sweeper_pid = os.getpid()
+
+        thread = threading.Thread(target=self._sweep_loop, name="cache-sweeper", daemon=True)
+        thread.start()
+
+    def _sweep_loop(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                removed = self.sweep()
+                if removed:
+                    logger.debug(f"Cache sweeper removed {removed} expired entries")
+            except Exception as e:
+                logger.error(f"Error sweeping cache: {str(e)}")
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        """
+        Get a value from the cache
+
+        Args:
+            key: The cache key
+
+        Returns:
+            Tuple[bool, Any]: (found, value) pair
+        """
+        try:
+            conn = self._connection()
+            row = conn.execute(
+                "SELECT value, expires_at, accessed_at FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row is None:
+                self._stats["misses"] += 1
+                return False, None
+
+            value, expires_at, accessed_at = row
+            now = time.time()
+            if expires_at < now:
+                conn.execute("DELETE FROM entries WHERE key = ? AND expires_at < ?", (key, now))
+                self._stats["expired"] += 1
+                self._stats["misses"] += 1
+                return False, None
+
+            if now - accessed_at > TOUCH_INTERVAL:
+                conn.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key))
+
+            self._stats["hits"] += 1
+            return True, json.loads(value)
+        except sqlite3.OperationalError as e:
+            if not self._busy(e):
+                logger.error(f"Error reading from cache: {str(e)}")
+                self._stats["errors"] += 1
+            self._stats["misses"] += 1
+            return False, None
+        except Exception as e:
+            logger.error(f"Error reading from cache: {str(e)}")
+            self._stats["errors"] += 1
+            return False, None
+
+    def set(self, key: str, value: Any, expiration: int = DEFAULT_EXPIRATION) -> bool:
+        """
+        Set a value in the cache
+
+        Args:
+            key: The cache key
+            value: A JSON-serializable value
+            expiration: Time in seconds until the cache expires
+
+        Returns:
+            bool: True if the value was stored
+        """
+        try:
+            payload = json.dumps(value)
+        except (TypeError, ValueError):
+            logger.debug(f"Value for cache key {key} is not JSON-serializable, skipping")
+            return False
+
+        try:
+            now = time.time()
+            conn = self._connection()
+            conn.execute(
+                """
+                INSERT INTO entries (key, value, size, expires_at, accessed_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET
+                    value = excluded.value,
+                    size = excluded.size,
+                    expires_at = excluded.expires_at,
+                    accessed_at = excluded.accessed_at
+                """,
+                (key, payload, len(key) + len(payload), now + expiration, now)
+            )
+            self._stats["sets"] += 1
+            self._enforce_budget(conn)
+            return True
+        except sqlite3.OperationalError as e:
+            if not self._busy(e):
+                logger.error(f"Error writing to cache: {str(e)}")
+                self._stats["errors"] += 1
+            return False
+        except Exception as e:
+            logger.error(f"Error writing to cache: {str(e)}")
+            self._stats["errors"] += 1
+            return False
+
+    def _busy(self, error: sqlite3.OperationalError) -> bool:
+        """
+        Count the error if it means another process held the lock for longer than the busy timeout.
+        """
+        message = str(error).lower()
+        if "locked" in message or "busy" in message:
+            self._stats["busy"] += 1
+            return True
+        return False
+
+    def _total_bytes(self, conn: sqlite3.Connection) -> int:
+        return conn.execute("SELECT value FROM meta WHERE name = 'total_bytes'").fetchone()[0]
+
+    def _enforce_budget(self, conn: sqlite3.Connection, max_bytes: Optional[int] = None):
+        """
+        Evict expired, then least recently used entries until the store fits its budget.
+        """
+        budget = self.max_bytes if max_bytes is None else max_bytes
+        if self._total_bytes(conn) <= budget:
+            return
+
+        self._stats["expired"] += conn.execute(
+            "DELETE FROM entries WHERE expires_at < ?", (time.time(),)
+        ).rowcount
+
+        while self._total_bytes(conn) > budget:
+            evicted = conn.execute(
+                "DELETE FROM entries WHERE key IN "
+                "(SELECT key FROM entries ORDER BY accessed_at LIMIT 64)"
+            ).rowcount
+            if not evicted:
+                break
+            self._stats["evictions"] += evicted
+
+    def shrink(self, max_bytes: int):
+        """
+        Evict least recently used entries until at most max_bytes remain.
+
+        Args:
+            max_bytes: Byte budget to shrink to
+        """
+        try:
+            self._enforce_budget(self._connection(), max_bytes)
+        except Exception as e:
+            logger.error(f"Error shrinking cache: {str(e)}")
+
+    def delete(self, key: str) -> bool:
+        """
+        Delete a value from the cache
+
+        Args:
+            key: The cache key
+
+        Returns:
+            bool: True if the key was deleted, False otherwise
+        """
+        try:
+            return self._connection().execute("DELETE FROM entries WHERE key = ?", (key,)).rowcount > 0
+        except Exception as e:
+            logger.error(f"Error deleting cache: {str(e)}")
+            return False
+
+    def sweep(self) -> int:
+        """
+        Remove all expired entries
+
+        Returns:
+            int: Number of entries removed
+        """
+        removed = self._connection().execute(
+            "DELETE FROM entries WHERE expires_at < ?", (time.time(),)
+        ).rowcount
+        self._stats["expired"] += removed
+        return removed
+
+    def clear(self) -> None:
+        """
+        Clear all cached values
+        """
+        try:
+            self._connection().execute("DELETE FROM entries")
+        except Exception as e:
+            logger.error(f"Error clearing cache: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get entry count, stored bytes and this process's hit/miss counters
+
+        Returns:
+            Dict[str, Any]: Cache statistics
+        """
+        conn = self._connection()
+        return {
+            "path": str(self.path),
+            "entries": conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0],
+            "bytes": self._total_bytes(conn),
+            "max_bytes": self.max_bytes,
+            **self._stats
+        }
+
+
+_store = SQLiteCacheStore()
+
+_io_executor: Optional[ThreadPoolExecutor] = None
+_io_executor_lock = threading.Lock()
+
+
+def _get_io_executor() -> ThreadPoolExecutor:
+    """
+    The thread pool that runs cache calls for async callers, kept apart from inference.
+    """
+    global _io_executor
+    with _io_executor_lock:
+        if _io_executor is None:
+            _io_executor = ThreadPoolExecutor(max_workers=CACHE_IO_THREADS, thread_name_prefix="cache-io")
+        return _io_executor
+
+
 class Cache:
     """
-    Simple file-based cache implementation for ML API results
+    Shared persistent cache for ML API results
     """
-    
+
     @staticmethod
     def _get_cache_key(func: Callable, *args, **kwargs) -> str:
         """
         Generate a unique cache key from function name and arguments
-        
+
         Args:
             func: The function being cached
             *args: Positional arguments to the function
             **kwargs: Keyword arguments to the function
-            
+
         Returns:
             str: A hash key representing the function call
         """
-        # Create a string representation of the function and its arguments
+        # Create a string representation of the function and its arguments,
+        # leaving out per-connection objects such as the raw request
         func_repr = func.__name__
-        args_repr = str(args)
-        kwargs_repr = str(sorted(kwargs.items()))
-        
+        args_repr = str(tuple(arg for arg in args if not isinstance(arg, Request)))
+        kwargs_repr = str(sorted(
+            (name, value) for name, value in kwargs.items() if not isinstance(value, Request)
+        ))
+
         # Create a hash of the combined string
         key_string = f"{func_repr}:{args_repr}:{kwargs_repr}"
         return hashlib.md5(key_string.encode()).hexdigest()
-    
+
     @staticmethod
-    def _get_cache_path(key: str) -> Path:
+    def get(key: str) -> Tuple[bool, Any]:
         """
-        Get the file path for a cache key
-        
+        Get a value from the cache
+
         Args:
             key: The cache key
-            
+
         Returns:
-            Path: Path to the cache file
+            Tuple[bool, Any]: (found, value) pair, where found is True if the
+                             key exists and hasn't expired
         """
-        return CACHE_DIR / f"{key}.pkl"
-    
+        return _store.get(key)
+
     @staticmethod
-    def get(key: str) -> Tuple[bool, Any]:
+    def set(key: str, value: Any, expiration: int = DEFAULT_EXPIRATION) -> None:
         """
-        Get a value from the cache
-        
+        Set a value in the cache
+
+        Args:
+            key: The cache key
+            value: The value to cache (must be JSON-serializable)
+            expiration: Time in seconds until the cache expires
+        """
+        _store.set(key, value, expiration)
+
+    @staticmethod
+    async def aget(key: str) -> Tuple[bool, Any]:
+        """
+        Get a value from the cache without blocking the event loop
+
         Args:
             key: The cache key
-            
+
         Returns:
-            Tuple[bool, Any]: (found, value) pair, where found is True if the 
-                             key exists and hasn't expired
+            Tuple[bool, Any]: (found, value) pair, as returned by get
         """
-        cache_path = Cache._get_cache_path(key)
-        
-        if not cache_path.exists():
-            return False, None
-        
-        try:
-            with open(cache_path, 'rb') as f:
-                expiration, value = pickle.load(f)
-            
-            # Check if the cache has expired
-            if expiration < time.time():
-                # Remove expired cache
-                os.remove(cache_path)
-                return False, None
-            
-            return True, value
-        except Exception as e:
-            logger.error(f"Error reading from cache: {str(e)}")
-            # Remove corrupt cache file
-            if cache_path.exists():
-                os.remove(cache_path)
-            return False, None
-    
+        return await asyncio.get_running_loop().run_in_executor(_get_io_executor(), _store.get, key)
+
     @staticmethod
-    def set(key: str, value: Any, expiration: int = DEFAULT_EXPIRATION) -> None:
+    async def aset(key: str, value: Any, expiration: int = DEFAULT_EXPIRATION) -> None:
         """
-        Set a value in the cache
-        
+        Set a value in the cache without blocking the event loop
+
         Args:
             key: The cache key
-            value: The value to cache
+            value: The value to cache (must be JSON-serializable)
             expiration: Time in seconds until the cache expires
         """
-        cache_path = Cache._get_cache_path(key)
-        
-        try:
-            # Calculate expiration timestamp
-            expiration_time = time.time() + expiration
-            
-            with open(cache_path, 'wb') as f:
-                pickle.dump((expiration_time, value), f)
-        except Exception as e:
-            logger.error(f"Error writing to cache: {str(e)}")
-    
+        await asyncio.get_running_loop().run_in_executor(_get_io_executor(), _store.set, key, value, expiration)
+
     @staticmethod
     def delete(key: str) -> bool:
         """
         Delete a value from the cache
-        
+
         Args:
             key: The cache key
-            
+
         Returns:
             bool: True if the key was deleted, False otherwise
         """
-        cache_path = Cache._get_cache_path(key)
-        
-        if cache_path.exists():
-            try:
-                os.remove(cache_path)
-                return True
-            except Exception as e:
-                logger.error(f"Error deleting cache: {str(e)}")
-        
-        return False
-    
+        return _store.delete(key)
+
     @staticmethod
     def clear() -> None:
         """
         Clear all cached values
         """
+        _store.clear()
+
+        # Remove files left behind by the previous one-file-per-key layout
         try:
             for cache_file in CACHE_DIR.glob("*.pkl"):
                 os.remove(cache_file)
         except Exception as e:
-            logger.error(f"Error clearing cache: {str(e)}")
+            logger.error(f"Error clearing legacy cache files: {str(e)}")
+
+    @staticmethod
+    def shrink(max_bytes: int) -> None:
+        """
+        Evict least recently used values until at most max_bytes remain
+
+        Args:
+            max_bytes: Byte budget to shrink to
+        """
+        _store.shrink(max_bytes)
+
+    @staticmethod
+    def memory_usage() -> Dict[str, Any]:
+        """
+        Bytes of cached values; they live in the SQLite file, not in process memory
+
+        Returns:
+            Dict[str, Any]: Stored bytes and entry count
+        """
+        stats = _store.stats()
+        return {"bytes": stats["bytes"], "entries": stats["entries"], "resident": False}
+
+    @staticmethod
+    def stats() -> Dict[str, Any]:
+        """
+        Get cache statistics
+
+        Returns:
+            Dict[str, Any]: Entry count, stored bytes and hit/miss counters
+        """
+        return _store.stats()
 
 
 def cached(expiration: int = DEFAULT_EXPIRATION):
     """
     Decorator to cache function results
-    
+
+    Works with both regular and async functions; for async functions the awaited
+    result is cached rather than the coroutine.
+
     Args:
         expiration: Time in seconds until the cache expires
-        
+
     Returns:
         Callable: Decorated function with caching
     """
     def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                cache_key = Cache._get_cache_key(func, *args, **kwargs)
+
+                found, cached_result = await Cache.aget(cache_key)
+                if found:
+                    logger.debug(f"Cache hit for {func.__name__}")
+                    return cached_result
+
+                logger.debug(f"Cache miss for {func.__name__}")
+                result = await func(*args, **kwargs)
+                await Cache.aset(cache_key, result, expiration)
+
+                return result
+            return async_wrapper
+
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
             # Generate cache key from function and arguments
             cache_key = Cache._get_cache_key(func, *args, **kwargs)
-            
+
             # Check if result is in cache
             found, cached_result = Cache.get(cache_key)
-            
+
             if found:
                 logger.debug(f"Cache hit for {func.__name__}")
                 return cached_result
-            
+
             # Not in cache, execute function
             logger.debug(f"Cache miss for {func.__name__}")
             result = func(*args, **kwargs)
-            
+
             # Store result in cache
             Cache.set(cache_key, result, expiration)
-            
+
             return result
         return wrapper
     return decorator
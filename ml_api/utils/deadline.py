@@ -0,0 +1,232 @@
+"""
+Deadline propagation and cancellation for inference work.
+
+Every request gets a deadline, either from the caller (X-Request-Deadline as epoch
+milliseconds, or X-Request-Timeout-Ms) or from a per-route default. Work whose
+deadline has passed or whose client has disconnected is dropped before inference,
+and long running inference checks for cancellation between batches.
+"""
+
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Mapping, Optional
+
+from utils.logger import get_logger
+from utils.profiling import current_session
+from utils.thread_budget import get_inference_executor
+
+logger = get_logger(__name__)
+
+DEADLINE_HEADER = "X-Request-Deadline"
+TIMEOUT_HEADER = "X-Request-Timeout-Ms"
+
+# Default timeout for requests without deadline headers (0 disables it)
+DEFAULT_TIMEOUT_MS = int(os.getenv("ML_DEFAULT_TIMEOUT_MS", 30000))
+
+# Per-route defaults, e.g. "/api/ml/recommend=5000,/api/ml/analyze/video=15000"
+ROUTE_TIMEOUTS_MS: Dict[str, int] = {
+    route.strip(): int(timeout)
+    for route, timeout in (
+        entry.split("=", 1) for entry in os.getenv("ML_ROUTE_TIMEOUTS_MS", "").split(",") if "=" in entry
+    )
+}
+
+# How often a running request polls for client disconnects, in seconds
+DISCONNECT_POLL_INTERVAL = 0.1
+
+REASON_DEADLINE = "deadline_exceeded"
+REASON_DISCONNECTED = "client_disconnected"
+
+
+class WorkCancelled(Exception):
+    """
+    Raised when work is dropped because its deadline passed or its client went away.
+    """
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+    @property
+    def status_code(self) -> int:
+        # 499 is the de-facto status for requests closed by the client
+        return 499 if self.reason == REASON_DISCONNECTED else 504
+
+
+class RequestDeadline:
+    """
+    Deadline and cancellation flag of one request.
+    """
+
+    def __init__(self, expires_at: Optional[float]):
+        self.expires_at = expires_at
+        self._cancelled = threading.Event()
+        self.reason: Optional[str] = None
+
+    def remaining(self) -> Optional[float]:
+        """
+        Seconds left before the deadline, or None if there is no deadline.
+        """
+        return None if self.expires_at is None else self.expires_at - time.time()
+
+    def cancel(self, reason: str):
+        self.reason = reason
+        self._cancelled.set()
+
+    def cancelled_reason(self) -> Optional[str]:
+        """
+        Reason the work should stop, or None if it may continue.
+        """
+        if self._cancelled.is_set():
+            return self.reason
+        if self.expires_at is not None and time.time() > self.expires_at:
+            return REASON_DEADLINE
+        return None
+
+
+_current_deadline: contextvars.ContextVar[Optional[RequestDeadline]] = contextvars.ContextVar(
+    "request_deadline", default=None
+)
+
+
+class DeadlineStats:
+    """
+    Process-wide counters of shed and cancelled work.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {"started": 0, "completed": 0, "shed": 0, "cancelled": 0, "disconnected": 0}
+
+    def increment(self, name: str):
+        with self._lock:
+            self._counts[name] += 1
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counts)
+
+
+deadline_stats = DeadlineStats()
+
+
+def deadline_from_headers(path: str, headers: Mapping[str, str]) -> RequestDeadline:
+    """
+    Build a request deadline from headers or the route's default timeout.
+
+    Args:
+        path (str): Request path
+        headers (Mapping[str, str]): Request headers
+
+    Returns:
+        RequestDeadline: The request's deadline
+    """
+    try:
+        if headers.get(DEADLINE_HEADER):
+            return RequestDeadline(float(headers[DEADLINE_HEADER]) / 1000.0)
+        if headers.get(TIMEOUT_HEADER):
+            return RequestDeadline(time.time() + float(headers[TIMEOUT_HEADER]) / 1000.0)
+    except ValueError:
+        logger.warning(f"Ignoring malformed deadline header on {path}")
+
+    timeout_ms = ROUTE_TIMEOUTS_MS.get(path, DEFAULT_TIMEOUT_MS)
+    return RequestDeadline(time.time() + timeout_ms / 1000.0 if timeout_ms > 0 else None)
+
+
+def set_deadline(deadline: Optional[RequestDeadline]) -> contextvars.Token:
+    """
+    Make a deadline current for the calling context.
+    """
+    return _current_deadline.set(deadline)
+
+
+def reset_deadline(token: contextvars.Token):
+    _current_deadline.reset(token)
+
+
+def get_deadline() -> Optional[RequestDeadline]:
+    return _current_deadline.get()
+
+
+def check_cancelled():
+    """
+    Raise WorkCancelled if the current request's deadline passed or its client disconnected.
+
+    Cheap enough to call between batches of inference work; a no-op outside requests.
+    """
+    deadline = _current_deadline.get()
+    if deadline is None:
+        return
+    reason = deadline.cancelled_reason()
+    if reason:
+        raise WorkCancelled(reason)
+
+
+async def _watch_disconnect(request, deadline: RequestDeadline):
+    while True:
+        await asyncio.sleep(DISCONNECT_POLL_INTERVAL)
+        if await request.is_disconnected():
+            deadline.cancel(REASON_DISCONNECTED)
+            return
+
+
+async def run_inference(func: Callable, *args, request=None, **kwargs) -> Any:
+    """
+    Run blocking inference off the event loop, honouring the request's deadline.
+
+    Work runs on the inference executor sized by the thread budget. It is shed
+    before it starts if the deadline has already passed or the client is gone,
+    including time spent waiting for a free executor thread. While it runs,
+    client disconnects are detected so that cancellation checks inside the model
+    code can stop it early.
+
+    Args:
+        func (Callable): Blocking function to run
+        *args: Positional arguments for func
+        request (Request, optional): Request used to detect client disconnects
+        **kwargs: Keyword arguments for func
+
+    Returns:
+        Any: The function's result
+
+    Raises:
+        WorkCancelled: If the work was shed or cancelled
+    """
+    deadline = _current_deadline.get()
+
+    def guarded():
+        # The deadline may pass while the work waits for a thread
+        if deadline is not None:
+            reason = deadline.cancelled_reason()
+            if reason:
+                deadline_stats.increment("shed")
+                raise WorkCancelled(reason)
+        deadline_stats.increment("started")
+        try:
+            session = current_session.get()
+            result = session.call(func, *args, **kwargs) if session else func(*args, **kwargs)
+        except WorkCancelled as e:
+            deadline_stats.increment("disconnected" if e.reason == REASON_DISCONNECTED else "cancelled")
+            raise
+        deadline_stats.increment("completed")
+        return result
+
+    if deadline is not None and request is not None:
+        if await request.is_disconnected():
+            deadline_stats.increment("shed")
+            raise WorkCancelled(REASON_DISCONNECTED)
+
+    watcher = None
+    if deadline is not None and request is not None:
+        watcher = asyncio.ensure_future(_watch_disconnect(request, deadline))
+
+    try:
+        context = contextvars.copy_context()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_inference_executor(), context.run, guarded)
+    finally:
+        if watcher is not None:
+            watcher.cancel()
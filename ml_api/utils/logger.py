@@ -48,3 +48,14 @@ def get_logger(name, level=logging.INFO):
         logger.addHandler(file_handler)
     
     return logger
+
+
+def configure_logging(level=None):
+    """
+    Configure the root logging level from the LOG_LEVEL environment variable.
+    
+    Args:
+        level (str, optional): Logging level name, overrides LOG_LEVEL
+    """
+    level_name = (level or os.getenv("LOG_LEVEL", "INFO")).upper()
+    logging.getLogger().setLevel(getattr(logging, level_name, logging.INFO))
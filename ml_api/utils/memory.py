@@ -0,0 +1,444 @@
+"""
+Memory accounting for the ML API.
+
+Components (models, caches, profile stores) register an estimator of the bytes
+they hold and, where they can give memory back, a shrink callback. The report
+served on /admin/memory breaks the process's resident memory down by component,
+optional tracemalloc snapshots show which lines allocated memory since the last
+snapshot, and a monitor thread shrinks the caches once the process or its cgroup
+passes a soft limit, before the kernel OOM-kills it.
+"""
+
+import ctypes
+import gc
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Explicit soft limit on this process's RSS, in bytes (0: derive from the cgroup limit)
+SOFT_LIMIT_BYTES = int(os.getenv("ML_MEMORY_SOFT_LIMIT_BYTES", 0))
+# Fraction of the cgroup memory limit at which caches are shrunk
+SOFT_LIMIT_FRACTION = float(os.getenv("ML_MEMORY_SOFT_LIMIT_FRACTION", 0.85))
+CHECK_INTERVAL = float(os.getenv("ML_MEMORY_CHECK_INTERVAL", 10))
+# Fraction of each cache dropped per shrink step
+SHRINK_FRACTION = float(os.getenv("ML_MEMORY_SHRINK_FRACTION", 0.5))
+TRACEMALLOC_AT_START = os.getenv("ML_MEMORY_TRACEMALLOC", "false").lower() == "true"
+TRACEMALLOC_FRAMES = int(os.getenv("ML_MEMORY_TRACEMALLOC_FRAMES", 10))
+
+# cgroup v2 and v1 files with the memory limit, current usage and statistics, and the
+# statistic counting reclaimable page cache
+_CGROUP_FILES = [
+    (Path("/sys/fs/cgroup/memory.max"), Path("/sys/fs/cgroup/memory.current"),
+     Path("/sys/fs/cgroup/memory.stat"), "inactive_file"),
+    (Path("/sys/fs/cgroup/memory/memory.limit_in_bytes"), Path("/sys/fs/cgroup/memory/memory.usage_in_bytes"),
+     Path("/sys/fs/cgroup/memory/memory.stat"), "total_inactive_file"),
+]
+
+
+def rss_bytes() -> Optional[int]:
+    """
+    Resident set size of this process, where /proc is available.
+    """
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _cgroup_stat(path: Path, key: str) -> Optional[int]:
+    try:
+        for line in path.read_text().splitlines():
+            name, _, value = line.partition(" ")
+            if name == key:
+                return int(value)
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def cgroup_memory() -> Dict[str, Optional[int]]:
+    """
+    Memory limit, usage and working set of the container's cgroup, or None where unavailable.
+
+    Usage includes page cache, which the SQLite files and capture files of this
+    service fill and the kernel reclaims under pressure. The working set leaves
+    out the inactive file cache, as the kubelet does for its eviction decisions.
+    """
+    for limit_path, usage_path, stat_path, inactive_key in _CGROUP_FILES:
+        try:
+            limit_text = limit_path.read_text().strip()
+            usage = int(usage_path.read_text().strip())
+        except (OSError, ValueError):
+            continue
+        # "max" (v2) or a huge number (v1) means unlimited
+        limit = None if limit_text == "max" or int(limit_text) >= 1 << 60 else int(limit_text)
+        inactive_file = _cgroup_stat(stat_path, inactive_key) or 0
+        return {"limit": limit, "usage": usage, "working_set": max(0, usage - inactive_file)}
+    return {"limit": None, "usage": None, "working_set": None}
+
+
+def deep_sizeof(obj: Any, seen: Optional[set] = None) -> int:
+    """
+    Approximate size of an object including the containers and strings it references.
+
+    Arrays and tensors count their buffers; other objects only their own size.
+    """
+    seen = seen if seen is not None else set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    if hasattr(obj, "nbytes") and not isinstance(obj, (bytes, bytearray)):
+        return int(obj.nbytes)
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(key, seen) + deep_sizeof(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    elif hasattr(obj, "__slots__"):
+        size += sum(deep_sizeof(getattr(obj, name), seen) for name in obj.__slots__ if hasattr(obj, name))
+    return size
+
+
+def sampled_sizeof(items: Iterable[Any], count: int, sample: int = 100) -> int:
+    """
+    Estimate the total size of count similar items from the first `sample` of them.
+    """
+    sizes = []
+    for item in items:
+        sizes.append(deep_sizeof(item))
+        if len(sizes) >= sample:
+            break
+    return int(sum(sizes) / len(sizes) * count) if sizes else 0
+
+
+def _array_bytes(obj: Any) -> int:
+    """
+    Bytes of the NumPy arrays and SciPy sparse matrices held in an object's attributes.
+    """
+    total = 0
+    for value in vars(obj).values():
+        if hasattr(value, "nbytes"):
+            total += int(value.nbytes)
+        elif hasattr(value, "indptr"):
+            total += int(value.data.nbytes + value.indices.nbytes + value.indptr.nbytes)
+        elif hasattr(value, "get_params") and hasattr(value, "__dict__"):
+            total += _array_bytes(value)
+    return total
+
+
+def _sklearn_footprint(model: Any) -> Dict[str, int]:
+    parts: Dict[str, int] = {}
+    steps = getattr(model, "named_steps", None) or {"model": model}
+    for name, step in steps.items():
+        # The vocabulary and the terms pruned by max_features are plain dicts and sets of strings
+        for attribute in ("vocabulary_", "stop_words_"):
+            value = getattr(step, attribute, None)
+            if value:
+                parts[f"{name}.{attribute}"] = deep_sizeof(value)
+
+        weights = _array_bytes(step)
+        for estimator in getattr(step, "estimators_", None) or []:
+            weights += _array_bytes(estimator)
+        if weights:
+            parts[f"{name}.weights"] = weights
+    return parts
+
+
+def _torch_footprint(model: Any) -> Dict[str, int]:
+    parts = {"parameters": sum(param.numel() * param.element_size() for param in model.parameters())}
+    if hasattr(model, "buffers"):
+        parts["buffers"] = sum(buffer.numel() * buffer.element_size() for buffer in model.buffers())
+    return parts
+
+
+def model_footprint(classifier: Any) -> Dict[str, int]:
+    """
+    Estimated bytes held by a classifier, broken down by part.
+
+    Args:
+        classifier: TechContentClassifier or CascadeClassifier
+
+    Returns:
+        Dict[str, int]: Part name -> bytes
+    """
+    if hasattr(classifier, "fast_classifier"):
+        parts = {}
+        for prefix, component in (("fast", classifier.fast_classifier), ("slow", classifier.slow_classifier)):
+            parts.update({f"{prefix}.{name}": size for name, size in model_footprint(component).items()})
+        return parts
+
+    model = getattr(classifier, "model", None)
+    if model is None:
+        return {}
+
+    parts = _torch_footprint(model) if hasattr(model, "parameters") else _sklearn_footprint(model)
+
+    tokenizer = getattr(classifier, "tokenizer", None)
+    if tokenizer is not None and hasattr(tokenizer, "get_vocab"):
+        parts["tokenizer_vocabulary"] = deep_sizeof(tokenizer.get_vocab())
+
+    embeddings = getattr(classifier, "_category_embeddings", None)
+    if embeddings is not None and hasattr(embeddings, "element_size"):
+        parts["category_embeddings"] = embeddings.numel() * embeddings.element_size()
+    return parts
+
+
+def model_bytes(classifier: Any) -> Optional[int]:
+    """
+    Total estimated bytes of a classifier, or None if it cannot be measured.
+    """
+    return sum(model_footprint(classifier).values()) or None
+
+
+class _Component:
+    def __init__(self, name: str, kind: str, estimate: Callable[[], Dict[str, Any]],
+                 shrink: Optional[Callable[[float], Any]], priority: int):
+        self.name = name
+        self.kind = kind
+        self.estimate = estimate
+        self.shrink = shrink
+        self.priority = priority
+
+
+class MemoryAccountant:
+    """
+    Registry of memory-holding components with soft-limit enforcement.
+    """
+
+    def __init__(self, soft_limit_bytes: int = SOFT_LIMIT_BYTES,
+                 soft_limit_fraction: float = SOFT_LIMIT_FRACTION,
+                 check_interval: float = CHECK_INTERVAL, shrink_fraction: float = SHRINK_FRACTION):
+        """
+        Initialize the accountant.
+
+        Args:
+            soft_limit_bytes (int): Process RSS at which caches are shrunk (0 disables)
+            soft_limit_fraction (float): Fraction of the cgroup limit at which caches are shrunk
+            check_interval (float): Seconds between soft limit checks (0 disables the monitor)
+            shrink_fraction (float): Fraction of each cache dropped per shrink step
+        """
+        self.soft_limit_bytes = soft_limit_bytes
+        self.soft_limit_fraction = soft_limit_fraction
+        self.check_interval = check_interval
+        self.shrink_fraction = shrink_fraction
+
+        self._components: Dict[str, _Component] = {}
+        self._lock = threading.Lock()
+        self._shrink_lock = threading.Lock()
+        self._monitor: Optional[threading.Thread] = None
+        self._last_snapshot: Optional[tracemalloc.Snapshot] = None
+        self._stats = {"checks": 0, "shrinks": 0, "last_shrink_at": None, "last_shrink_freed": None}
+
+    def register(self, name: str, kind: str, estimate: Callable[[], Any],
+                 shrink: Optional[Callable[[float], Any]] = None, priority: int = 0):
+        """
+        Register a component.
+
+        Args:
+            name (str): Component name in reports
+            kind (str): "model", "cache" or "store"
+            estimate (Callable): Returns bytes, or a dict with "bytes" and optionally
+                "resident" (False for data on disk) and other details
+            shrink (Callable, optional): Drops the given fraction of the component's entries
+            priority (int): Components with lower priority are shrunk first
+        """
+        with self._lock:
+            self._components[name] = _Component(name, kind, estimate, shrink, priority)
+
+    def _estimate(self, component: _Component) -> Dict[str, Any]:
+        try:
+            estimate = component.estimate()
+        except Exception as e:
+            return {"bytes": None, "error": str(e)}
+        if not isinstance(estimate, dict):
+            estimate = {"bytes": estimate}
+        estimate.setdefault("resident", True)
+        return estimate
+
+    def soft_limit(self) -> Dict[str, Optional[int]]:
+        """
+        The effective soft limits on process RSS and the cgroup working set.
+        """
+        cgroup = cgroup_memory()
+        return {
+            "process_bytes": self.soft_limit_bytes or None,
+            "cgroup_bytes": int(cgroup["limit"] * self.soft_limit_fraction) if cgroup["limit"] else None
+        }
+
+    def over_soft_limit(self) -> bool:
+        limits = self.soft_limit()
+        rss = rss_bytes()
+        if limits["process_bytes"] and rss and rss >= limits["process_bytes"]:
+            return True
+        working_set = cgroup_memory()["working_set"]
+        return bool(limits["cgroup_bytes"] and working_set and working_set >= limits["cgroup_bytes"])
+
+    def report(self) -> Dict[str, Any]:
+        """
+        Break this process's memory down by registered component.
+
+        Returns:
+            Dict[str, Any]: Process and cgroup memory, soft limits, per-component
+                estimates and the resident memory not attributed to any component
+        """
+        with self._lock:
+            components = list(self._components.values())
+
+        estimates = {}
+        attributed = 0
+        for component in components:
+            estimate = self._estimate(component)
+            estimates[component.name] = {"kind": component.kind, "shrinkable": component.shrink is not None,
+                                         **estimate}
+            if estimate["resident"] and estimate.get("bytes"):
+                attributed += estimate["bytes"]
+
+        rss = rss_bytes()
+        return {
+            "process_rss_bytes": rss,
+            "cgroup": cgroup_memory(),
+            "soft_limit": self.soft_limit(),
+            "over_soft_limit": self.over_soft_limit(),
+            "components": estimates,
+            "attributed_bytes": attributed,
+            "unattributed_bytes": rss - attributed if rss is not None else None,
+            "tracemalloc": tracemalloc.is_tracing(),
+            **self._stats
+        }
+
+    def shrink(self, force: bool = False) -> Dict[str, Any]:
+        """
+        Shrink caches in priority order until the process is back under its soft limit.
+
+        Args:
+            force (bool): Shrink every shrinkable component once, even under the limit
+
+        Returns:
+            Dict[str, Any]: Shrunk component names and RSS before and after
+        """
+        with self._shrink_lock:
+            with self._lock:
+                components = sorted(
+                    (component for component in self._components.values() if component.shrink),
+                    key=lambda component: component.priority
+                )
+
+            before = rss_bytes()
+            shrunk: List[str] = []
+            for component in components:
+                if not force and not self.over_soft_limit():
+                    break
+                try:
+                    component.shrink(self.shrink_fraction)
+                    shrunk.append(component.name)
+                except Exception as e:
+                    logger.error(f"Error shrinking {component.name}: {str(e)}")
+                gc.collect()
+                _release_free_memory()
+
+            after = rss_bytes()
+            if shrunk:
+                self._stats["shrinks"] += 1
+                self._stats["last_shrink_at"] = time.time()
+                self._stats["last_shrink_freed"] = before - after if before and after else None
+                logger.warning(f"Shrunk {', '.join(shrunk)} (RSS {before} -> {after} bytes)")
+            return {"shrunk": shrunk, "rss_before": before, "rss_after": after}
+
+    def start(self):
+        """
+        Start the soft limit monitor, and tracemalloc if ML_MEMORY_TRACEMALLOC is set.
+        """
+        if TRACEMALLOC_AT_START:
+            self.start_tracing()
+        if self.check_interval <= 0 or self._monitor is not None:
+            return
+        if not self.soft_limit_bytes and not cgroup_memory()["limit"]:
+            logger.info("No memory soft limit configured and no cgroup limit found; monitor not started")
+            return
+
+        self._monitor = threading.Thread(target=self._monitor_loop, name="memory-monitor", daemon=True)
+        self._monitor.start()
+
+    def _monitor_loop(self):
+        while True:
+            time.sleep(self.check_interval)
+            self._stats["checks"] += 1
+            try:
+                if self.over_soft_limit():
+                    self.shrink()
+            except Exception as e:
+                logger.error(f"Error checking memory soft limit: {str(e)}")
+
+    def start_tracing(self, frames: int = TRACEMALLOC_FRAMES):
+        """
+        Start tracemalloc; allocations are slower while it runs.
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+            self._last_snapshot = None
+            logger.info(f"Started tracemalloc with {frames} frames")
+
+    def stop_tracing(self):
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+            self._last_snapshot = None
+            logger.info("Stopped tracemalloc")
+
+    def snapshot_diff(self, top: int = 20, group_by: str = "lineno") -> Dict[str, Any]:
+        """
+        Take a tracemalloc snapshot and diff it against the previous one.
+
+        Args:
+            top (int): Number of allocation sites to return
+            group_by (str): "lineno", "filename" or "traceback"
+
+        Returns:
+            Dict[str, Any]: Traced totals and the allocation sites that grew the most
+        """
+        if not tracemalloc.is_tracing():
+            raise RuntimeError("tracemalloc is not running")
+
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        ])
+        previous, self._last_snapshot = self._last_snapshot, snapshot
+        current, peak = tracemalloc.get_traced_memory()
+
+        if previous is None:
+            stats = snapshot.statistics(group_by)[:top]
+            sites = [{"site": str(stat.traceback), "size": stat.size, "count": stat.count} for stat in stats]
+        else:
+            stats = snapshot.compare_to(previous, group_by)[:top]
+            sites = [
+                {"site": str(stat.traceback), "size": stat.size, "size_diff": stat.size_diff,
+                 "count": stat.count, "count_diff": stat.count_diff}
+                for stat in stats
+            ]
+
+        return {"traced_bytes": current, "peak_traced_bytes": peak, "diffed": previous is not None, "sites": sites}
+
+
+def _release_free_memory():
+    """
+    Ask glibc to return freed heap pages to the OS, so shrinking shows up in RSS.
+    """
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+memory_accountant = MemoryAccountant()
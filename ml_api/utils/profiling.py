@@ -0,0 +1,557 @@
+"""
+On-demand request profiling for the ML API.
+
+Profiling is off by default. It is enabled for the next N requests or for a time
+window on a given route through the admin API, or for a single request carrying a
+signed X-Profile-Request header. Captured profiles are stored as pstats and
+flamegraph-collapsed files with caps on concurrent captures and on storage.
+
+cProfile mode only profiles the inference work a request hands to executor
+threads (through ProfileSession.call), one profiler per call, so concurrent
+sessions never share or replace each other's hooks and time spent by other
+requests' coroutines is not attributed to the profiled one. Work done on the
+event loop itself does not show up in it. Sampling mode also samples the event
+loop thread, which is shared by every request in flight, so its loop-thread
+stacks include whatever other coroutines ran while the request was profiled.
+"""
+
+import contextvars
+import cProfile
+import hashlib
+import hmac
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+PROFILE_DIR = Path(os.getenv("ML_PROFILE_DIR", str(Path(__file__).parent.parent / "profiles")))
+PROFILE_SECRET = os.getenv("ML_PROFILE_SECRET", "")
+PROFILE_HEADER = "X-Profile-Request"
+
+MODE_CPROFILE = "cprofile"
+MODE_SAMPLING = "sampling"
+
+# Session of the request being handled, so work handed to other threads can join it
+current_session: contextvars.ContextVar[Optional["ProfileSession"]] = contextvars.ContextVar(
+    "profile_session", default=None
+)
+
+
+class ProfileArm:
+    """
+    A request to profile the next requests on a route.
+    """
+
+    def __init__(self, route: str, count: Optional[int], until: Optional[float], mode: str):
+        self.route = route
+        self.remaining = count
+        self.until = until
+        self.mode = mode
+
+    def active(self, now: float) -> bool:
+        if self.until is not None and now > self.until:
+            return False
+        return self.remaining is None or self.remaining > 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"route": self.route, "remaining": self.remaining, "until": self.until, "mode": self.mode}
+
+
+def _frame_label(code) -> str:
+    """
+    Label of a code object in sampled stacks; co_qualname only exists on Python 3.11+.
+    """
+    return f"{Path(code.co_filename).stem}:{getattr(code, 'co_qualname', code.co_name)}"
+
+
+class _StackSampler:
+    """
+    Samples the stacks of registered threads at a fixed interval.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.thread_ids = set()
+        self.samples: Dict[str, int] = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id in list(self.thread_ids):
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                key = ";".join(reversed(stack))
+                self.samples[key] = self.samples.get(key, 0) + 1
+
+
+class ProfileSession:
+    """
+    Profiling state for one request.
+    """
+
+    def __init__(self, route: str, mode: str, sample_interval: float):
+        self.id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.route = route
+        self.mode = mode
+        self.started = time.time()
+        self.profilers: List[cProfile.Profile] = []
+        self._lock = threading.Lock()
+        self._sampler = _StackSampler(sample_interval) if mode == MODE_SAMPLING else None
+        self.unprofiled_calls = 0
+
+    def start(self):
+        """
+        Start sampling the calling (event loop) thread in sampling mode.
+
+        cProfile mode installs no profiler here: a profiler on the event loop
+        thread would record every coroutine that runs meanwhile, and a second
+        session enabling one on the same thread would replace the first's hook.
+        """
+        if self._sampler:
+            self._sampler.thread_ids.add(threading.get_ident())
+            self._sampler.start()
+
+    def stop(self):
+        if self._sampler:
+            self._sampler.stop()
+
+    def call(self, func: Callable, *args, **kwargs):
+        """
+        Run func in the current thread, profiling it as part of this session.
+
+        Used for work handed off to executor threads, which the event loop
+        thread's profiler cannot see.
+        """
+        if self._sampler:
+            thread_id = threading.get_ident()
+            self._sampler.thread_ids.add(thread_id)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._sampler.thread_ids.discard(thread_id)
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler already owns the interpreter (sys.monitoring on 3.12+)
+            with self._lock:
+                self.unprofiled_calls += 1
+            return func(*args, **kwargs)
+        with self._lock:
+            self.profilers.append(profiler)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profiler.disable()
+
+    def stats(self) -> Optional[pstats.Stats]:
+        profilers = [profiler for profiler in self.profilers if profiler.getstats()]
+        if not profilers:
+            return None
+        stats = pstats.Stats(profilers[0], stream=io.StringIO())
+        for profiler in profilers[1:]:
+            stats.add(profiler)
+        return stats
+
+    @property
+    def samples(self) -> Dict[str, int]:
+        return self._sampler.samples if self._sampler else {}
+
+
+def _func_label(func) -> str:
+    filename, lineno, name = func
+    return f"{Path(filename).stem}:{name}:{lineno}" if lineno else name
+
+
+def collapse_pstats(stats: pstats.Stats, max_depth: int = 64) -> Dict[str, int]:
+    """
+    Approximate flamegraph-collapsed stacks (microseconds) from a cProfile call graph.
+
+    cProfile only records caller/callee edges, so time below a function is split
+    between its callers in proportion to each edge's cumulative time.
+    """
+    raw = stats.stats
+    callees: Dict[tuple, List[tuple]] = {}
+    for func, (_, _, _, _, callers) in raw.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((func, edge[3]))
+
+    roots = [func for func, (_, _, _, _, callers) in raw.items() if not callers]
+    collapsed: Dict[str, int] = {}
+
+    def walk(func, stack, budget, depth):
+        _, _, total_time, cumulative, _ = raw[func]
+        if cumulative <= 0 or budget <= 0:
+            return
+        share = min(1.0, budget / cumulative)
+        path = stack + [_func_label(func)]
+        key = ";".join(path)
+        self_us = int(total_time * share * 1e6)
+        if self_us:
+            collapsed[key] = collapsed.get(key, 0) + self_us
+        if depth >= max_depth:
+            return
+        for callee, edge_time in callees.get(func, []):
+            if callee in stack_funcs:
+                continue
+            stack_funcs.add(callee)
+            walk(callee, path, edge_time * share, depth + 1)
+            stack_funcs.discard(callee)
+
+    for root in roots:
+        stack_funcs = {root}
+        walk(root, [], raw[root][3], 0)
+
+    return collapsed
+
+
+class ProfilerManager:
+    """
+    Decides which requests are profiled and stores the captured profiles.
+    """
+
+    def __init__(self, profile_dir: Path = PROFILE_DIR, secret: str = PROFILE_SECRET,
+                 max_concurrent: int = 1, max_files: int = 50, max_bytes: int = 100 * 1024 * 1024,
+                 max_window: float = 3600.0, sample_interval: float = 0.005):
+        """
+        Initialize the manager.
+
+        Args:
+            profile_dir (Path): Directory for captured profiles
+            secret (str): Key for signed X-Profile-Request headers; empty disables them
+            max_concurrent (int): Maximum number of requests profiled at the same time; concurrent
+                sampling sessions each see the other requests' work on the event loop thread
+            max_files (int): Maximum number of stored profiles; oldest are deleted first
+            max_bytes (int): Maximum bytes of stored profiles; oldest are deleted first
+            max_window (float): Longest time window profiling can be enabled for, in seconds
+            sample_interval (float): Seconds between stack samples in sampling mode
+        """
+        self.profile_dir = Path(profile_dir)
+        self.secret = secret
+        self.max_concurrent = max_concurrent
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.max_window = max_window
+        self.sample_interval = sample_interval
+
+        self._arms: List[ProfileArm] = []
+        self._active = 0
+        self._lock = threading.Lock()
+        self._attribution_classes: List[type] = []
+        self._stats = {"captured": 0, "skipped_busy": 0, "rejected_signatures": 0}
+
+    @classmethod
+    def from_env(cls) -> "ProfilerManager":
+        return cls(
+            max_concurrent=int(os.getenv("ML_PROFILE_MAX_CONCURRENT", 1)),
+            max_files=int(os.getenv("ML_PROFILE_MAX_FILES", 50)),
+            max_bytes=int(os.getenv("ML_PROFILE_MAX_BYTES", 100 * 1024 * 1024)),
+            max_window=float(os.getenv("ML_PROFILE_MAX_WINDOW", 3600)),
+            sample_interval=float(os.getenv("ML_PROFILE_SAMPLE_INTERVAL", 0.005))
+        )
+
+    def attribute_classes(self, classes: List[type]):
+        """
+        Register classes whose methods are summed up in each profile's attribution.
+        """
+        self._attribution_classes = list(classes)
+
+    def arm(self, route: str, count: Optional[int] = None, duration: Optional[float] = None,
+            mode: str = MODE_CPROFILE) -> ProfileArm:
+        """
+        Enable profiling for the next count requests and/or a time window on a route.
+
+        Args:
+            route (str): Request path, e.g. "/api/ml/recommend"
+            count (int, optional): Number of requests to profile
+            duration (float, optional): Seconds to keep profiling enabled
+            mode (str): "cprofile" or "sampling"
+
+        Returns:
+            ProfileArm: The registered arm
+        """
+        if mode not in (MODE_CPROFILE, MODE_SAMPLING):
+            raise ValueError(f"Unknown profiling mode: {mode}")
+        if count is None and duration is None:
+            count = 1
+
+        until = time.time() + min(duration, self.max_window) if duration else None
+        arm = ProfileArm(route, count, until, mode)
+        with self._lock:
+            self._arms.append(arm)
+        logger.info(f"Profiling armed for {route}: count={count}, duration={duration}, mode={mode}")
+        return arm
+
+    def disarm(self):
+        with self._lock:
+            self._arms = []
+
+    def arms(self) -> List[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            self._arms = [arm for arm in self._arms if arm.active(now)]
+            return [arm.to_dict() for arm in self._arms]
+
+    def sign(self, route: str, expires: int) -> str:
+        """
+        Build a signed X-Profile-Request header value for a route.
+        """
+        digest = hmac.new(self.secret.encode(), f"{route}:{expires}".encode(), hashlib.sha256).hexdigest()
+        return f"{expires}:{digest}"
+
+    def _valid_signature(self, route: str, header: str) -> bool:
+        if not self.secret:
+            return False
+        try:
+            expires, _ = header.split(":", 1)
+            if int(expires) < time.time():
+                return False
+        except ValueError:
+            return False
+        return hmac.compare_digest(self.sign(route, int(expires)), header)
+
+    def start(self, route: str, header: Optional[str] = None) -> Optional[ProfileSession]:
+        """
+        Start a profiling session if this request should be profiled.
+
+        Args:
+            route (str): Request path
+            header (str, optional): Value of the X-Profile-Request header
+
+        Returns:
+            ProfileSession or None: The started session, or None if not profiled
+        """
+        if not header and not self._arms:
+            return None
+
+        mode = None
+        now = time.time()
+        with self._lock:
+            if header:
+                if self._valid_signature(route, header):
+                    mode = MODE_CPROFILE
+                else:
+                    self._stats["rejected_signatures"] += 1
+            if mode is None:
+                for arm in self._arms:
+                    if arm.route == route and arm.active(now):
+                        mode = arm.mode
+                        if arm.remaining is not None:
+                            arm.remaining -= 1
+                        break
+            if mode is None:
+                return None
+            if self._active >= self.max_concurrent:
+                self._stats["skipped_busy"] += 1
+                return None
+            self._active += 1
+
+        session = ProfileSession(route, mode, self.sample_interval)
+        session.start()
+        current_session.set(session)
+        return session
+
+    def finish(self, session: ProfileSession, status_code: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """
+        Stop a session and store its profile files.
+
+        Args:
+            session (ProfileSession): Session returned by start
+            status_code (int, optional): Response status of the profiled request
+
+        Returns:
+            Dict or None: Summary of the stored profile
+        """
+        session.stop()
+        try:
+            return self._store(session, status_code)
+        except Exception as e:
+            logger.error(f"Error storing profile {session.id}: {str(e)}")
+            return None
+        finally:
+            with self._lock:
+                self._active -= 1
+
+    def _store(self, session: ProfileSession, status_code: Optional[int]) -> Dict[str, Any]:
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        base = self.profile_dir / session.id
+        summary = {
+            "id": session.id,
+            "route": session.route,
+            "mode": session.mode,
+            "started": session.started,
+            "duration": time.time() - session.started,
+            "status_code": status_code,
+            "files": []
+        }
+
+        if session.mode == MODE_SAMPLING:
+            collapsed = session.samples
+            summary["samples"] = sum(collapsed.values())
+            summary["attribution"] = self._attribute_samples(collapsed)
+        else:
+            stats = session.stats()
+            collapsed = collapse_pstats(stats) if stats else {}
+            summary["profiled_calls"] = len(session.profilers)
+            summary["unprofiled_calls"] = session.unprofiled_calls
+            if stats:
+                stats.dump_stats(str(base.with_suffix(".pstats")))
+                summary["files"].append("pstats")
+                summary["total_calls"] = stats.total_calls
+                summary["top_functions"] = self._top_functions(stats)
+                summary["attribution"] = self._attribute_pstats(stats)
+
+        with open(base.with_suffix(".collapsed"), "w", encoding="utf-8") as f:
+            for stack, value in sorted(collapsed.items()):
+                f.write(f"{stack} {value}\n")
+        summary["files"].append("collapsed")
+
+        with open(base.with_suffix(".json"), "w", encoding="utf-8") as f:
+            json.dump(summary, f)
+
+        with self._lock:
+            self._stats["captured"] += 1
+        self._enforce_storage()
+        logger.info(f"Stored profile {session.id} for {session.route}")
+        return summary
+
+    @staticmethod
+    def _top_functions(stats: pstats.Stats, limit: int = 20) -> List[Dict[str, Any]]:
+        rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:limit]
+        return [
+            {"function": _func_label(func), "calls": nc, "total_time": tt, "cumulative_time": ct}
+            for func, (_, nc, tt, ct, _) in rows
+        ]
+
+    def _class_codes(self) -> Dict[str, list]:
+        """
+        Map each registered class to the code objects of its methods.
+        """
+        codes = {}
+        for cls in self._attribution_classes:
+            codes[cls.__name__] = []
+            for attribute in vars(cls).values():
+                func = getattr(attribute, "__func__", attribute)
+                code = getattr(func, "__code__", None)
+                if code is not None:
+                    codes[cls.__name__].append(code)
+        return codes
+
+    def _class_methods(self) -> Dict[str, set]:
+        """
+        Map each registered class to the pstats (filename, lineno, name) keys of its methods.
+        """
+        methods = {}
+        for name, codes in self._class_codes().items():
+            keys = set()
+            for code in codes:
+                keys.add((code.co_filename, code.co_firstlineno, code.co_name))
+                keys.add((code.co_filename, code.co_firstlineno, getattr(code, "co_qualname", code.co_name)))
+            methods[name] = keys
+        return methods
+
+    def _attribute_pstats(self, stats: pstats.Stats) -> Dict[str, float]:
+        """
+        Inclusive seconds spent in each registered class, counting only calls entering it from outside.
+        """
+        attribution = {}
+        for name, keys in self._class_methods().items():
+            total = 0.0
+            for func, (_, _, _, cumulative, callers) in stats.stats.items():
+                if func not in keys:
+                    continue
+                if not callers:
+                    total += cumulative
+                total += sum(edge[3] for caller, edge in callers.items() if caller not in keys)
+            attribution[name] = total
+        return attribution
+
+    def _attribute_samples(self, samples: Dict[str, int]) -> Dict[str, float]:
+        """
+        Inclusive seconds spent in each registered class, estimated from stack samples.
+        """
+        attribution = {}
+        for name, codes in self._class_codes().items():
+            labels = {_frame_label(code) for code in codes}
+            hits = sum(
+                count for stack, count in samples.items()
+                if any(frame in labels for frame in stack.split(";"))
+            )
+            attribution[name] = hits * self.sample_interval
+        return attribution
+
+    def _enforce_storage(self):
+        """
+        Delete the oldest profiles beyond the file count and byte caps.
+        """
+        summaries = sorted(self.profile_dir.glob("*.json"), key=lambda path: path.stat().st_mtime)
+        sizes = {
+            path: sum(f.stat().st_size for f in self.profile_dir.glob(f"{path.stem}.*"))
+            for path in summaries
+        }
+        total = sum(sizes.values())
+        while summaries and (len(summaries) > self.max_files or total > self.max_bytes):
+            oldest = summaries.pop(0)
+            total -= sizes[oldest]
+            for f in self.profile_dir.glob(f"{oldest.stem}.*"):
+                f.unlink()
+
+    def list_profiles(self) -> List[Dict[str, Any]]:
+        """
+        List stored profile summaries, newest first.
+        """
+        if not self.profile_dir.exists():
+            return []
+        summaries = []
+        for path in sorted(self.profile_dir.glob("*.json"), key=lambda p: p.stat().st_mtime, reverse=True):
+            with open(path, "r", encoding="utf-8") as f:
+                summaries.append(json.load(f))
+        return summaries
+
+    def profile_path(self, profile_id: str, file_format: str) -> Optional[Path]:
+        """
+        Get the path of a stored profile file.
+
+        Args:
+            profile_id (str): Profile ID
+            file_format (str): "pstats", "collapsed" or "json"
+
+        Returns:
+            Path or None: The file path if it exists
+        """
+        if file_format not in ("pstats", "collapsed", "json") or Path(profile_id).name != profile_id:
+            return None
+        path = self.profile_dir / f"{profile_id}.{file_format}"
+        return path if path.exists() else None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._stats, "active": self._active}
+
+
+profiler_manager = ProfilerManager.from_env()
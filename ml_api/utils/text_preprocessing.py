@@ -0,0 +1,339 @@
+"""
+Text normalization ahead of the classifier.
+
+Content reaches the API with HTML, markdown, code blocks, URLs and a lot of
+repeated whitespace. This module turns the fields of a piece of content into a
+single normalized classifier input: markup is stripped, sentences repeated
+within or across fields are dropped, each field is capped to its own length
+budget and weighted, and the result gets a fingerprint that downstream caches
+can key on instead of the raw request text.
+
+Raw fields are cut to a multiple of their budget before any regex runs, and the
+field cache is keyed by a hash of that cut and keeps only the sentences within
+reach of the budget, so neither the work nor the memory per field grows with
+the size of the request. Large inputs are prepared on the inference executor
+rather than the event loop.
+"""
+
+import asyncio
+import hashlib
+import html
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from utils.logger import get_logger
+from utils.thread_budget import get_inference_executor
+
+logger = get_logger(__name__)
+
+# Number of cleaned fields kept in memory
+CLEAN_CACHE_SIZE = int(os.getenv("ML_PREPROCESS_CACHE_SIZE", 4096))
+
+# Overall cap on the classifier input, in characters
+MAX_TEXT_CHARS = int(os.getenv("ML_PREPROCESS_MAX_CHARS", 10000))
+
+# Raw characters of a field cleaned, as a multiple of its budget; markup and code take room
+RAW_CHARS_FACTOR = int(os.getenv("ML_PREPROCESS_RAW_FACTOR", 4))
+# Cleaned sentences kept per field, as a multiple of its budget, so that sentences
+# dropped as duplicates of an earlier field can be made up for
+CACHED_CHARS_FACTOR = 2
+
+# Inputs up to this many raw characters are prepared inline on the event loop
+INLINE_MAX_CHARS = int(os.getenv("ML_PREPROCESS_INLINE_MAX_CHARS", 4096))
+
+
+class FieldSpec(NamedTuple):
+    max_chars: int
+    weight: int  # How many times the field is repeated in the classifier input
+
+
+# Fields in the order they appear in the classifier input
+FIELD_SPECS: Dict[str, FieldSpec] = {
+    "title": FieldSpec(max_chars=300, weight=2),
+    "description": FieldSpec(max_chars=2000, weight=1),
+    "text": FieldSpec(max_chars=8000, weight=1),
+    "content": FieldSpec(max_chars=8000, weight=1),
+    "transcript": FieldSpec(max_chars=8000, weight=1),
+}
+DEFAULT_FIELD_SPEC = FieldSpec(max_chars=2000, weight=1)
+
+_FENCED_CODE = re.compile(r"```[ \t]*([\w#+.-]*)[^\n]*\n.*?(?:```|$)", re.DOTALL)
+_INLINE_CODE = re.compile(r"`[^`\n]*`")
+_HTML_BLOCKS = re.compile(r"<(script|style|pre|code)\b[^>]*>.*?</\1\s*>", re.DOTALL | re.IGNORECASE)
+_HTML_BLOCK_TAG = re.compile(
+    r"</?(?:p|div|br|hr|li|ul|ol|h[1-6]|tr|td|th|table|section|article|blockquote|header|footer)\b[^>]*>",
+    re.IGNORECASE
+)
+_HTML_TAG = re.compile(r"<[^>]+>")
+_MD_IMAGE = re.compile(r"!\[[^\]]*\]\([^)]*\)")
+_MD_LINK = re.compile(r"\[([^\]]*)\]\([^)]*\)")
+_URL = re.compile(r"\b(?:https?://|www\.)\S+", re.IGNORECASE)
+_MD_SYNTAX = re.compile(
+    r"^\s{0,3}(?:#{1,6}|>+|[-*+]|\d+\.)\s+|(?<!\w)[*_~]{1,3}(?=\S)|(?<=\S)[*_~]{1,3}(?!\w)", re.MULTILINE
+)
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+|\n+")
+_WHITESPACE = re.compile(r"\s+")
+_NON_WORD = re.compile(r"\W+")
+
+
+class PreparedText(NamedTuple):
+    text: str
+    fingerprint: str
+    original_chars: int
+
+
+class _PreprocessingStats:
+    """
+    Counters of how much text the preprocessing stage removed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.prepared = 0
+        self.original_chars = 0
+        self.output_chars = 0
+        self.cleaned_fields = 0
+        self.cleaned_chars = 0
+        self.clean_cache_hits = 0
+
+    def record_cleaned(self, chars: int):
+        with self._lock:
+            self.cleaned_fields += 1
+            self.cleaned_chars += chars
+
+    def record_clean_hit(self):
+        with self._lock:
+            self.clean_cache_hits += 1
+
+    def record(self, original_chars: int, output_chars: int):
+        with self._lock:
+            self.prepared += 1
+            self.original_chars += original_chars
+            self.output_chars += output_chars
+
+    def snapshot(self) -> Dict[str, float]:
+        entries = _clean_cache.size()
+        with self._lock:
+            lookups = self.clean_cache_hits + self.cleaned_fields
+            return {
+                "prepared": self.prepared,
+                "original_chars": self.original_chars,
+                "output_chars": self.output_chars,
+                "reduction": 1 - self.output_chars / self.original_chars if self.original_chars else 0.0,
+                "clean_cache_size": entries,
+                "clean_cache_hit_rate": self.clean_cache_hits / lookups if lookups else 0.0,
+            }
+
+
+_stats = _PreprocessingStats()
+
+
+def _replace_code_block(match: "re.Match") -> str:
+    # Keep the language tag, it is a strong category signal; drop the code itself
+    return f"\n{match.group(1)}\n" if match.group(1) else "\n"
+
+
+class _CleanCache:
+    """
+    LRU cache of cleaned fields, keyed by a hash of the cut raw text and the budget.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[bytes, int], Tuple[str, ...]]" = OrderedDict()
+        self._chars = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple[bytes, int]) -> Optional[Tuple[str, ...]]:
+        with self._lock:
+            sentences = self._entries.get(key)
+            if sentences is not None:
+                self._entries.move_to_end(key)
+            return sentences
+
+    def put(self, key: Tuple[bytes, int], sentences: Tuple[str, ...]):
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = sentences
+            self._chars += sum(len(sentence) for sentence in sentences)
+            self._evict(len(self._entries) - self.max_entries)
+
+    def _evict(self, count: int):
+        for _ in range(max(0, count)):
+            _, sentences = self._entries.popitem(last=False)
+            self._chars -= sum(len(sentence) for sentence in sentences)
+
+    def shrink(self, fraction: float):
+        with self._lock:
+            self._evict(int(len(self._entries) * fraction))
+
+    def size(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def memory_usage(self) -> Dict[str, int]:
+        with self._lock:
+            # Sentence strings, the key digest and tuple, and OrderedDict bookkeeping
+            return {"bytes": self._chars + len(self._entries) * 250, "entries": len(self._entries)}
+
+
+_clean_cache = _CleanCache(CLEAN_CACHE_SIZE)
+
+
+def _clean(text: str) -> List[str]:
+    text = _FENCED_CODE.sub(_replace_code_block, text)
+    text = _HTML_BLOCKS.sub("\n", text)
+    text = _HTML_BLOCK_TAG.sub("\n", text)
+    text = _HTML_TAG.sub("", text)
+    text = html.unescape(text)
+    text = _MD_IMAGE.sub(" ", text)
+    text = _MD_LINK.sub(r"\1", text)
+    text = _URL.sub(" ", text)
+    text = _INLINE_CODE.sub(" ", text)
+    text = _MD_SYNTAX.sub("", text)
+
+    sentences = []
+    for sentence in _SENTENCE_END.split(text):
+        sentence = _WHITESPACE.sub(" ", sentence).strip()
+        if sentence:
+            sentences.append(sentence)
+    return sentences
+
+
+def clean_field(text: str, max_chars: int = DEFAULT_FIELD_SPEC.max_chars) -> Tuple[str, ...]:
+    """
+    Strip markup from a single field and split it into normalized sentences.
+
+    Only the first RAW_CHARS_FACTOR * max_chars characters are cleaned, and only
+    the distinct sentences that fit in CACHED_CHARS_FACTOR * max_chars are returned
+    and cached.
+
+    Args:
+        text (str): Raw field text, possibly containing HTML or markdown
+        max_chars (int): Length budget of the field
+
+    Returns:
+        Tuple[str, ...]: Sentences with markup, code and URLs removed
+    """
+    text = text[:max_chars * RAW_CHARS_FACTOR]
+    key = (hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest(), max_chars)
+    cached = _clean_cache.get(key)
+    if cached is not None:
+        _stats.record_clean_hit()
+        return cached
+
+    _stats.record_cleaned(len(text))
+
+    kept = []
+    seen = set()
+    remaining = max_chars * CACHED_CHARS_FACTOR
+    for sentence in _clean(text):
+        sentence_key = _sentence_key(sentence)
+        if not sentence_key or sentence_key in seen:
+            continue
+        seen.add(sentence_key)
+        kept.append(sentence[:remaining])
+        remaining -= len(kept[-1]) + 1
+        if remaining <= 0:
+            break
+
+    sentences = tuple(kept)
+    _clean_cache.put(key, sentences)
+    return sentences
+
+
+def _sentence_key(sentence: str) -> str:
+    return _NON_WORD.sub(" ", sentence.lower()).strip()
+
+
+def prepare_text(fields: Dict[str, Optional[str]]) -> PreparedText:
+    """
+    Build the normalized classifier input for a piece of content.
+
+    Fields are cleaned, capped to their FIELD_SPECS budget and repeated by their
+    weight. Sentences already seen in an earlier field (such as a description
+    that starts with the title) or earlier in the same field are dropped.
+
+    Args:
+        fields (Dict[str, Optional[str]]): Field name -> raw text, e.g. title and description
+
+    Returns:
+        PreparedText: The normalized text, its fingerprint and the raw input size
+    """
+    ordered = sorted(
+        ((name, value) for name, value in fields.items() if value),
+        key=lambda field: list(FIELD_SPECS).index(field[0]) if field[0] in FIELD_SPECS else len(FIELD_SPECS)
+    )
+
+    seen = set()
+    parts: List[str] = []
+    original_chars = 0
+    for name, value in ordered:
+        original_chars += len(value)
+        spec = FIELD_SPECS.get(name, DEFAULT_FIELD_SPEC)
+
+        kept = []
+        budget = spec.max_chars
+        for sentence in clean_field(value, spec.max_chars):
+            key = _sentence_key(sentence)
+            if not key or key in seen:
+                continue
+            seen.add(key)
+            kept.append(sentence[:budget])
+            budget -= len(kept[-1]) + 1
+            if budget <= 0:
+                break
+
+        if kept:
+            field_text = " ".join(kept)
+            parts.extend([field_text] * spec.weight)
+
+    text = "\n".join(parts)[:MAX_TEXT_CHARS]
+    fingerprint = hashlib.blake2b(text.encode("utf-8"), digest_size=12).hexdigest()
+
+    _stats.record(original_chars, len(text))
+    return PreparedText(text=text, fingerprint=fingerprint, original_chars=original_chars)
+
+
+async def prepare_text_async(fields: Dict[str, Optional[str]]) -> PreparedText:
+    """
+    Build the normalized classifier input from the event loop.
+
+    Inputs over INLINE_MAX_CHARS raw characters are prepared on the inference
+    executor, so long transcripts do not stall other requests while their regexes run.
+
+    Args:
+        fields (Dict[str, Optional[str]]): Field name -> raw text
+
+    Returns:
+        PreparedText: As returned by prepare_text
+    """
+    if sum(len(value) for value in fields.values() if value) <= INLINE_MAX_CHARS:
+        return prepare_text(fields)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_inference_executor(), prepare_text, fields)
+
+
+def clean_cache_memory_usage() -> Dict[str, int]:
+    """
+    Estimated bytes held by the cleaned-field cache.
+    """
+    return _clean_cache.memory_usage()
+
+
+def shrink_clean_cache(fraction: float):
+    """
+    Drop the given fraction of the least recently used cleaned fields.
+    """
+    _clean_cache.shrink(fraction)
+
+
+def preprocessing_stats() -> Dict[str, float]:
+    """
+    Get the input reduction and field cache counters of the preprocessing stage.
+    """
+    return _stats.snapshot()
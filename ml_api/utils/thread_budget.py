@@ -0,0 +1,287 @@
+"""
+CPU thread budget for API worker processes.
+
+Every uvicorn worker runs torch and NumPy/sklearn, and by default each of them
+sizes its thread pools to the whole machine. With several workers that
+oversubscribes the cores and makes tail latency erratic. This module splits the
+available cores between workers and, within a worker, between the inference
+executor, the shadow evaluation executor, torch's intra/inter-op pools and BLAS. The budget is applied once at
+worker start, before NumPy or torch create their pools.
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Environment variables read by BLAS/OpenMP runtimes when they are first loaded
+BLAS_ENV_VARS = [
+    "OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS", "NUMEXPR_NUM_THREADS"
+]
+
+SLOT_DIR = Path(os.getenv("ML_CPU_SLOT_DIR", str(Path(__file__).parent.parent / "cache" / "cpu_slots")))
+
+
+def _env_int(name: str) -> Optional[int]:
+    value = os.getenv(name, "").strip()
+    return int(value) if value else None
+
+
+def available_cores() -> List[int]:
+    """
+    CPU ids this process may run on (respects cgroup / taskset restrictions).
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+class ThreadBudget:
+    """
+    Thread counts of one worker process.
+    """
+
+    def __init__(self, cores: int, workers: int = 1, executor_threads: Optional[int] = None,
+                 intra_op_threads: Optional[int] = None, inter_op_threads: Optional[int] = None,
+                 blas_threads: Optional[int] = None, pin_cores: bool = False, shadow_threads: int = 0):
+        """
+        Split the cores between workers and the thread pools of each worker.
+
+        Unset values are derived so that (executor_threads + shadow_threads) *
+        intra_op_threads matches the cores of one worker.
+
+        Args:
+            cores (int): Cores available to all workers together
+            workers (int): Number of worker processes sharing the cores
+            executor_threads (int, optional): Inference requests run concurrently per worker
+            intra_op_threads (int, optional): Threads torch uses inside one operation
+            inter_op_threads (int, optional): Threads torch uses to run independent operations
+            blas_threads (int, optional): Threads of the BLAS/OpenMP runtime used by NumPy and sklearn
+            pin_cores (bool): Pin each worker to its own slice of cores
+            shadow_threads (int): Threads running the shadow candidate model, taken out of the
+                default executor threads so shadow work never queues behind live inference
+        """
+        self.cores = max(1, cores)
+        self.workers = max(1, workers)
+        self.worker_cores = max(1, self.cores // self.workers)
+        self.shadow_threads = max(0, shadow_threads)
+        self.executor_threads = executor_threads or max(1, min(4, self.worker_cores) - self.shadow_threads)
+        self.intra_op_threads = intra_op_threads or max(
+            1, self.worker_cores // (self.executor_threads + self.shadow_threads)
+        )
+        self.inter_op_threads = inter_op_threads or 1
+        self.blas_threads = blas_threads or self.intra_op_threads
+        self.pin_cores = pin_cores
+
+    @classmethod
+    def from_env(cls) -> "ThreadBudget":
+        """
+        Build the budget from environment variables.
+
+        Returns:
+            ThreadBudget: Budget of this worker process
+        """
+        return cls(
+            cores=_env_int("ML_CPU_CORES") or len(available_cores()),
+            workers=_env_int("ML_WORKERS") or 1,
+            executor_threads=_env_int("ML_INFERENCE_THREADS"),
+            intra_op_threads=_env_int("ML_TORCH_THREADS"),
+            inter_op_threads=_env_int("ML_TORCH_INTEROP_THREADS"),
+            blas_threads=_env_int("ML_BLAS_THREADS"),
+            pin_cores=os.getenv("ML_CPU_AFFINITY", "false").lower() == "true",
+            # One thread for the candidate model when shadow evaluation is configured
+            shadow_threads=_env_int("ML_SHADOW_THREADS") or (1 if os.getenv("ML_SHADOW_MODEL_PATH") else 0)
+        )
+
+    @property
+    def oversubscription(self) -> float:
+        """
+        Threads that may be busy at once across all workers, per core.
+        """
+        busy = (self.workers * (self.executor_threads + self.shadow_threads)
+                * max(self.intra_op_threads, self.blas_threads))
+        return busy / self.cores
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "cores": self.cores,
+            "workers": self.workers,
+            "worker_cores": self.worker_cores,
+            "executor_threads": self.executor_threads,
+            "shadow_threads": self.shadow_threads,
+            "intra_op_threads": self.intra_op_threads,
+            "inter_op_threads": self.inter_op_threads,
+            "blas_threads": self.blas_threads,
+            "pin_cores": self.pin_cores,
+            "oversubscription": round(self.oversubscription, 2)
+        }
+
+
+_budget: Optional[ThreadBudget] = None
+_executor: Optional[ThreadPoolExecutor] = None
+_shadow_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+_applied: Dict[str, Any] = {}
+# Keeps the claimed CPU slot locked for the lifetime of the process
+_slot_file = None
+
+
+def _claim_slot(workers: int) -> Optional[int]:
+    """
+    Claim a free worker slot with a file lock, so each worker pins a different slice.
+    """
+    global _slot_file
+
+    try:
+        import fcntl
+    except ImportError:
+        return None
+
+    SLOT_DIR.mkdir(parents=True, exist_ok=True)
+    for slot in range(workers):
+        f = open(SLOT_DIR / f"slot_{slot}.lock", "w")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            continue
+        _slot_file = f
+        return slot
+    return None
+
+
+def _pin_cores(budget: ThreadBudget) -> Optional[List[int]]:
+    if not hasattr(os, "sched_setaffinity"):
+        return None
+
+    slot = _claim_slot(budget.workers)
+    if slot is None:
+        logger.warning("No free CPU slot to pin this worker to; leaving affinity unchanged")
+        return None
+
+    cores = available_cores()
+    pinned = cores[slot * budget.worker_cores:(slot + 1) * budget.worker_cores] or cores
+    os.sched_setaffinity(0, pinned)
+    return pinned
+
+
+def apply_thread_budget(budget: Optional[ThreadBudget] = None) -> ThreadBudget:
+    """
+    Apply a thread budget to the current process.
+
+    Must run before NumPy, sklearn or torch are imported for the BLAS limits to
+    take effect through the environment; if they are already loaded, threadpoolctl
+    is used when available.
+
+    Args:
+        budget (ThreadBudget, optional): Budget to apply, defaults to ThreadBudget.from_env()
+
+    Returns:
+        ThreadBudget: The applied budget
+    """
+    global _budget
+
+    budget = budget or ThreadBudget.from_env()
+    _budget = budget
+
+    for name in BLAS_ENV_VARS:
+        os.environ[name] = str(budget.blas_threads)
+    # Tokenizers would start their own pool per call otherwise
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+
+    if budget.pin_cores:
+        _applied["pinned_cores"] = _pin_cores(budget)
+
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(limits=budget.blas_threads)
+    except ImportError:
+        pass
+
+    try:
+        import torch
+        torch.set_num_threads(budget.intra_op_threads)
+        try:
+            torch.set_num_interop_threads(budget.inter_op_threads)
+        except RuntimeError:
+            # Only allowed before torch runs its first parallel operation
+            logger.warning("torch inter-op threads were already initialized; keeping the current value")
+    except ImportError:
+        pass
+
+    logger.info(f"Applied thread budget: {budget.to_dict()}")
+    return budget
+
+
+def get_thread_budget() -> ThreadBudget:
+    """
+    The budget applied to this process, or the environment's budget if none was applied.
+    """
+    return _budget or ThreadBudget.from_env()
+
+
+def get_inference_executor() -> ThreadPoolExecutor:
+    """
+    The executor that runs blocking inference, sized by the thread budget.
+    """
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=get_thread_budget().executor_threads, thread_name_prefix="inference"
+            )
+        return _executor
+
+
+def get_shadow_executor() -> ThreadPoolExecutor:
+    """
+    The executor that runs shadow evaluation, separate from live inference and sized by the thread budget.
+    """
+    global _shadow_executor
+
+    with _executor_lock:
+        if _shadow_executor is None:
+            _shadow_executor = ThreadPoolExecutor(
+                max_workers=max(1, get_thread_budget().shadow_threads), thread_name_prefix="shadow"
+            )
+        return _shadow_executor
+
+
+def effective_thread_settings() -> Dict[str, Any]:
+    """
+    Report the thread settings actually in effect, which may differ from the budget
+    if a library ignored it.
+    """
+    settings: Dict[str, Any] = {
+        "budget": get_thread_budget().to_dict(),
+        "env": {name: os.environ.get(name) for name in BLAS_ENV_VARS},
+        "affinity": available_cores(),
+        "pinned_cores": _applied.get("pinned_cores"),
+        "process_threads": threading.active_count()
+    }
+
+    try:
+        import torch
+        settings["torch"] = {
+            "intra_op_threads": torch.get_num_threads(),
+            "inter_op_threads": torch.get_num_interop_threads()
+        }
+    except ImportError:
+        settings["torch"] = None
+
+    try:
+        from threadpoolctl import threadpool_info
+        settings["blas"] = [
+            {"library": pool["internal_api"], "threads": pool["num_threads"]} for pool in threadpool_info()
+        ]
+    except ImportError:
+        settings["blas"] = None
+
+    return settings
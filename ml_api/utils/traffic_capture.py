@@ -0,0 +1,448 @@
+"""
+Production traffic capture for offline replay.
+
+When enabled, the timing middleware records a sample of API requests, with
+their arrival time, JSON body, status and latency, so replay.py can reproduce
+the real request mix and arrival pattern against a new build. The request
+path only queues the raw record; a background thread parses it, scrubs it of
+personal data and writes it to gzip-compressed NDJSON files, so a failing
+scrubber hook can never fail a response. Files rotate by size, and each worker
+keeps only its newest ones.
+"""
+
+import gzip
+import hashlib
+import importlib
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+CAPTURE_DIR = Path(os.getenv("ML_CAPTURE_DIR", str(Path(__file__).parent.parent / "cache" / "captures")))
+CAPTURE_FILE_PATTERN = "capture-*.ndjson.gz"
+# capture-<date>-<time>-<pid>-<sequence>.ndjson.gz
+_CAPTURE_FILE_NAME = re.compile(r"capture-\d{8}-\d{6}-(\d+)-\d+\.ndjson\.gz$")
+
+# Request headers kept with a record; absolute deadlines would be stale at replay time
+CAPTURED_HEADERS = ["content-type", "x-request-timeout-ms"]
+
+# Takes a record and returns it scrubbed, or None to drop it
+Scrubber = Callable[[Dict[str, Any]], Optional[Dict[str, Any]]]
+
+_EMAIL = re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+")
+
+
+def _map_strings(value: Any, func: Callable[[str], str]) -> Any:
+    if isinstance(value, str):
+        return func(value)
+    if isinstance(value, dict):
+        return {key: _map_strings(item, func) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_map_strings(item, func) for item in value]
+    return value
+
+
+def redact_emails(record: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Replace email addresses anywhere in the request body with a placeholder.
+    """
+    record["body"] = _map_strings(record.get("body"), lambda text: _EMAIL.sub("[email]", text))
+    return record
+
+
+def pseudonymize_fields(fields: Iterable[str], salt: str) -> Scrubber:
+    """
+    Build a scrubber that replaces the values of the given body keys with salted hashes.
+
+    The same value always maps to the same pseudonym, so per-user patterns such as
+    interaction bursts survive in the capture.
+
+    Args:
+        fields (Iterable[str]): Keys to pseudonymize at any depth, e.g. user_id
+        salt (str): Secret mixed into the hashes
+
+    Returns:
+        Scrubber: The scrubber
+    """
+    names = set(fields)
+
+    def pseudonym(value: Any) -> str:
+        digest = hashlib.blake2b(f"{salt}:{value}".encode("utf-8"), digest_size=8).hexdigest()
+        return f"anon-{digest}"
+
+    def scrub(value: Any) -> Any:
+        if isinstance(value, dict):
+            return {
+                key: pseudonym(item) if key in names and item is not None else scrub(item)
+                for key, item in value.items()
+            }
+        if isinstance(value, list):
+            return [scrub(item) for item in value]
+        return value
+
+    def scrubber(record: Dict[str, Any]) -> Dict[str, Any]:
+        record["body"] = scrub(record.get("body"))
+        return record
+
+    return scrubber
+
+
+def _load_hook(spec: str) -> Scrubber:
+    module_name, _, attribute = spec.partition(":")
+    return getattr(importlib.import_module(module_name), attribute)
+
+
+def _owned_by_other_process(path: Path) -> bool:
+    """
+    Whether a capture file belongs to another worker process that is still running.
+    """
+    match = _CAPTURE_FILE_NAME.match(path.name)
+    if match is None:
+        return False
+    pid = int(match.group(1))
+    if pid == os.getpid():
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class TrafficCapture:
+    """
+    Sampled request recorder with a rotating, compressed output file.
+    """
+
+    def __init__(self, directory: Path = CAPTURE_DIR, enabled: bool = False, sample_rate: float = 0.01,
+                 paths: Optional[List[str]] = None, max_body_bytes: int = 1048576,
+                 max_file_bytes: int = 64 * 1048576, max_files: int = 20, queue_size: int = 10000,
+                 scrubbers: Optional[List[Scrubber]] = None):
+        """
+        Initialize the capture.
+
+        Args:
+            directory (Path): Directory of the capture files
+            enabled (bool): Whether requests are captured
+            sample_rate (float): Fraction of matching requests captured
+            paths (List[str], optional): Path prefixes to capture, defaults to the ML API routes
+            max_body_bytes (int): Larger or non-JSON bodies are recorded without the body
+            max_file_bytes (int): Compressed size at which a file is rotated
+            max_files (int): Capture files kept per worker process; older ones are deleted
+            queue_size (int): Records waiting for the writer; new ones are dropped when full
+            scrubbers (List[Scrubber], optional): Applied in order to every record before it is written
+        """
+        self.directory = Path(directory)
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.paths = paths or ["/api/ml/", "/classify"]
+        self.max_body_bytes = max_body_bytes
+        self.max_file_bytes = max_file_bytes
+        self.max_files = max_files
+        self.scrubbers: List[Scrubber] = list(scrubbers or [])
+
+        self._queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._file = None
+        self._raw = None
+        self._path: Optional[Path] = None
+        self._sequence = 0
+        self._stats = {"captured": 0, "dropped": 0, "scrubbed_out": 0, "body_skipped": 0, "files": 0, "errors": 0}
+
+    @classmethod
+    def from_env(cls) -> "TrafficCapture":
+        """
+        Build a capture configured from environment variables.
+
+        Returns:
+            TrafficCapture: Configured capture, disabled unless ML_CAPTURE_ENABLED is true
+        """
+        salt = os.getenv("ML_CAPTURE_SALT", "")
+        if not salt:
+            # Pseudonyms then only match within one worker process
+            salt = os.urandom(16).hex()
+
+        scrubbers: List[Scrubber] = [redact_emails]
+        fields = [name.strip() for name in os.getenv(
+            "ML_CAPTURE_PSEUDONYMIZE_FIELDS", "user_id,creator_id,email"
+        ).split(",") if name.strip()]
+        if fields:
+            scrubbers.append(pseudonymize_fields(fields, salt))
+        # Custom hooks as module:function, e.g. "scrubbing:drop_private_posts"
+        for spec in os.getenv("ML_CAPTURE_SCRUBBERS", "").split(","):
+            if spec.strip():
+                scrubbers.append(_load_hook(spec.strip()))
+
+        paths = [path.strip() for path in os.getenv("ML_CAPTURE_PATHS", "").split(",") if path.strip()]
+        return cls(
+            enabled=os.getenv("ML_CAPTURE_ENABLED", "false").lower() == "true",
+            sample_rate=float(os.getenv("ML_CAPTURE_SAMPLE_RATE", 0.01)),
+            paths=paths or None,
+            max_body_bytes=int(os.getenv("ML_CAPTURE_MAX_BODY_BYTES", 1048576)),
+            max_file_bytes=int(os.getenv("ML_CAPTURE_MAX_FILE_BYTES", 64 * 1048576)),
+            max_files=int(os.getenv("ML_CAPTURE_MAX_FILES", 20)),
+            scrubbers=scrubbers
+        )
+
+    def add_scrubber(self, scrubber: Scrubber):
+        """
+        Register a hook that scrubs or drops records before they are written.
+
+        Args:
+            scrubber (Scrubber): Returns the scrubbed record, or None to drop it
+        """
+        self.scrubbers.append(scrubber)
+
+    def sampled(self, method: str, path: str) -> bool:
+        """
+        Decide whether a request is captured.
+        """
+        if not self.enabled or random.random() >= self.sample_rate:
+            return False
+        return any(path.startswith(prefix) for prefix in self.paths)
+
+    async def buffer_request(self, request):
+        """
+        Read a JSON request body so it can be captured, and return a request that
+        replays it to the route.
+
+        Args:
+            request (Request): Incoming request
+
+        Returns:
+            Tuple[Request, bytes or None]: Request to pass on and its body, or None if the
+                body is not captured
+        """
+        from starlette.requests import Request
+
+        content_type = request.headers.get("content-type", "")
+        try:
+            length = int(request.headers.get("content-length") or 0)
+        except ValueError:
+            # Left for the route to reject; the size is checked after reading
+            length = 0
+        if "json" not in content_type or length > self.max_body_bytes:
+            return request, None
+
+        body = await request.body()
+        receive = request.receive
+        body_sent = False
+
+        async def replay_body():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            # Later reads only wait for the client to disconnect
+            return await receive()
+
+        # Chunked bodies have no content-length
+        replayed = Request(request.scope, replay_body)
+        return replayed, body if len(body) <= self.max_body_bytes else None
+
+    def record(self, request, body: Optional[bytes], arrived_at: float, status: int, duration: float):
+        """
+        Queue a captured request for the writer; never blocks and never raises.
+
+        Args:
+            request (Request): The request
+            body (bytes, optional): Body returned by buffer_request
+            arrived_at (float): Arrival time as epoch seconds
+            status (int): Response status
+            duration (float): Seconds the API took to respond
+        """
+        try:
+            entry: Dict[str, Any] = {
+                "ts": round(arrived_at, 6),
+                "method": request.method,
+                "path": request.url.path,
+                "query": request.url.query,
+                "headers": {name: request.headers[name] for name in CAPTURED_HEADERS if name in request.headers},
+                "status": status,
+                "duration_ms": round(duration * 1000.0, 3)
+            }
+            if body is None and request.method not in ("GET", "HEAD", "DELETE"):
+                entry["body_skipped"] = True
+                with self._lock:
+                    self._stats["body_skipped"] += 1
+            # Parsed and scrubbed on the writer thread
+            self._queue.put_nowait((entry, body))
+        except queue.Full:
+            with self._lock:
+                self._stats["dropped"] += 1
+        except Exception as e:
+            logger.error(f"Traffic capture failed: {str(e)}")
+            with self._lock:
+                self._stats["errors"] += 1
+
+    def _prepare(self, entry: Dict[str, Any], body: Optional[bytes]) -> Optional[Dict[str, Any]]:
+        """
+        Parse a queued record's body and run the scrubbers; None if a scrubber dropped it.
+        """
+        try:
+            entry["body"] = json.loads(body) if body else None
+        except ValueError:
+            entry["body"] = None
+
+        for scrubber in self.scrubbers:
+            entry = scrubber(entry)
+            if entry is None:
+                with self._lock:
+                    self._stats["scrubbed_out"] += 1
+                return None
+        return entry
+
+    def start(self):
+        """
+        Start the writer thread.
+        """
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="traffic-capture", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """
+        Write the queued records and close the current file.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        last_flush = time.time()
+        while not (self._stop.is_set() and self._queue.empty()):
+            try:
+                queued = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                queued = None
+
+            try:
+                # A record that a scrubber fails on is dropped, never written unscrubbed
+                entry = self._prepare(*queued) if queued is not None else None
+                if entry is not None:
+                    self._write(json.dumps(entry, separators=(",", ":")) + "\n")
+                if self._file is not None and time.time() - last_flush >= 1.0:
+                    # Keeps what was written readable if the process dies
+                    self._file.flush()
+                    last_flush = time.time()
+            except Exception as e:
+                logger.error(f"Traffic capture write failed: {str(e)}")
+                with self._lock:
+                    self._stats["errors"] += 1
+
+        self._close_file()
+
+    def _write(self, line: str):
+        if self._file is None or self._raw.tell() >= self.max_file_bytes:
+            self._rotate()
+        self._file.write(line.encode("utf-8"))
+        with self._lock:
+            self._stats["captured"] += 1
+
+    def _rotate(self):
+        self._close_file()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._sequence += 1
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        self._path = self.directory / f"capture-{stamp}-{os.getpid()}-{self._sequence}.ndjson.gz"
+        self._raw = open(self._path, "wb")
+        self._file = gzip.GzipFile(fileobj=self._raw, mode="wb")
+        with self._lock:
+            self._stats["files"] += 1
+
+        # Files of other running workers are theirs to rotate; those of exited workers are fair game
+        files = []
+        for path in self.directory.glob(CAPTURE_FILE_PATTERN):
+            if _owned_by_other_process(path):
+                continue
+            try:
+                files.append((path.stat().st_mtime, path))
+            except FileNotFoundError:
+                # Removed by another worker cleaning up after the same exited process
+                continue
+        files.sort()
+        for _, old in files[:-self.max_files]:
+            if old != self._path:
+                old.unlink(missing_ok=True)
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._raw.close()
+            self._file = None
+            self._raw = None
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Capture settings and counters.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        return {
+            "enabled": self.enabled,
+            "sample_rate": self.sample_rate,
+            "paths": self.paths,
+            "directory": str(self.directory),
+            "current_file": str(self._path) if self._path else None,
+            "queued": self._queue.qsize(),
+            **stats
+        }
+
+
+def iter_captures(paths: Iterable[str]) -> Iterator[Dict[str, Any]]:
+    """
+    Read capture records from files or directories of capture files.
+
+    A file cut off by a crash is read up to its last complete record.
+
+    Args:
+        paths (Iterable[str]): Capture files or directories
+
+    Yields:
+        Dict[str, Any]: Records in file order
+    """
+    files: List[Path] = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            files.extend(sorted(path.glob(CAPTURE_FILE_PATTERN)))
+        else:
+            files.append(path)
+
+    for path in files:
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    if not line.endswith("\n"):
+                        break
+                    yield json.loads(line)
+        except (EOFError, OSError) as e:
+            logger.warning(f"Capture file {path} is truncated: {str(e)}")
+
+
+def load_captures(paths: Iterable[str]) -> List[Dict[str, Any]]:
+    """
+    Read capture records and order them by arrival time.
+
+    Returns:
+        List[Dict[str, Any]]: Records sorted by arrival, with ties kept in file order
+    """
+    return sorted(iter_captures(paths), key=lambda record: record["ts"])
+
+
+traffic_capture = TrafficCapture.from_env()
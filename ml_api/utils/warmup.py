@@ -0,0 +1,258 @@
+"""
+Startup warm-up and readiness tracking for the ML API.
+
+Loads and validates model artifacts, runs warm-up batches at the configured batch
+sizes, precomputes category embeddings and restores hot caches from a snapshot.
+The /ready endpoint only reports ready once all of this has finished, so the first
+real requests after a deploy see steady-state latency.
+"""
+
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+WARMUP_ENABLED = os.getenv("ML_WARMUP_ENABLED", "true").lower() == "true"
+WARMUP_BATCH_SIZES = [
+    int(size) for size in os.getenv("ML_WARMUP_BATCH_SIZES", "1,8,32,64").split(",") if size.strip()
+]
+WARMUP_SNAPSHOT_PATH = Path(os.getenv(
+    "ML_WARMUP_SNAPSHOT", str(Path(__file__).parent.parent / "cache" / "warmup_snapshot.json")
+))
+
+# Representative texts of different lengths for warm-up batches
+WARMUP_TEXTS = [
+    "Python tutorial",
+    "Building REST APIs with FastAPI and PostgreSQL, covering authentication and deployment",
+    "This video explains React hooks with TypeScript, state management with Redux and testing "
+    "components with Jest. We also deploy the app to AWS using Docker and GitHub Actions.",
+    "The weather is nice today and I like to go for walks in the park",
+    " ".join(["Machine learning with PyTorch: tensors, autograd, training loops and evaluation."] * 40),
+]
+
+
+class ReadinessState:
+    """
+    Tracks startup progress and the result of each warm-up step.
+    """
+
+    def __init__(self):
+        self.ready = False
+        self.phase = "starting"
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.checks: Dict[str, Any] = {}
+        self.errors: List[str] = []
+        self._lock = threading.Lock()
+
+    def set_phase(self, phase: str):
+        with self._lock:
+            self.phase = phase
+        logger.info(f"Warm-up phase: {phase}")
+
+    def record(self, name: str, value: Any):
+        with self._lock:
+            self.checks[name] = value
+
+    def fail(self, message: str):
+        with self._lock:
+            self.errors.append(message)
+        logger.error(f"Warm-up error: {message}")
+
+    def mark_ready(self):
+        with self._lock:
+            self.ready = True
+            self.phase = "ready"
+            self.finished_at = time.time()
+        logger.info(f"ML API ready after {self.finished_at - self.started_at:.2f}s")
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "ready": self.ready,
+                "phase": self.phase,
+                "warmup_seconds": (self.finished_at or time.time()) - self.started_at,
+                "checks": dict(self.checks),
+                "errors": list(self.errors)
+            }
+
+
+readiness = ReadinessState()
+
+
+def _component_classifiers(classifier) -> List:
+    """
+    The TechContentClassifier instances behind a (possibly cascaded) classifier.
+    """
+    if hasattr(classifier, "fast_classifier"):
+        return [classifier.fast_classifier, classifier.slow_classifier]
+    return [classifier]
+
+
+def model_version(classifier) -> str:
+    """
+    Identify the loaded model artifacts, so snapshots from another model are not reused.
+    """
+    from models.classifier_model import MODEL_DIR
+
+    parts = []
+    for component in _component_classifiers(classifier):
+        artifact = MODEL_DIR / f"tech_classifier_{component.model_type}"
+        if component.model_type == "traditional":
+            artifact = artifact.with_suffix(".joblib")
+        mtime = int(artifact.stat().st_mtime) if artifact.exists() else 0
+        parts.append(f"{component.model_type}:{mtime}")
+    return ",".join(parts)
+
+
+def load_artifacts(classifier, state: ReadinessState = readiness) -> bool:
+    """
+    Load saved model weights and check that they produce predictions of the right shape.
+
+    Args:
+        classifier: TechContentClassifier or CascadeClassifier
+        state (ReadinessState): Readiness state to record results in
+
+    Returns:
+        bool: True if every model is usable
+    """
+    from models.classifier_model import MODEL_DIR, TECH_CATEGORIES
+
+    usable = True
+    for component in _component_classifiers(classifier):
+        name = f"model_{component.model_type}"
+
+        if component.model_type == "traditional":
+            artifact = MODEL_DIR / "tech_classifier_traditional.joblib"
+            if not component.is_fitted() and artifact.exists():
+                component.load(str(artifact))
+
+            if not component.is_fitted():
+                state.record(name, "not_fitted")
+                state.fail(f"Traditional model has not been trained ({artifact} missing)")
+                # The cascade can still answer through its keyword and transformer stages
+                usable = usable and hasattr(classifier, "fast_classifier")
+                continue
+
+        try:
+            scores = component._batch_scores([WARMUP_TEXTS[0]])
+            if len(scores[0]) != len(TECH_CATEGORIES):
+                raise ValueError(f"expected {len(TECH_CATEGORIES)} scores, got {len(scores[0])}")
+            state.record(name, "ok")
+        except Exception as e:
+            state.record(name, "invalid")
+            state.fail(f"{component.model_type} model failed validation: {str(e)}")
+            usable = False
+
+    return usable
+
+
+def run_warmup_batches(classifier, batch_sizes: List[int] = WARMUP_BATCH_SIZES,
+                       state: ReadinessState = readiness):
+    """
+    Run inference at each configured batch size so allocators and kernels are warm.
+    """
+    for component in _component_classifiers(classifier):
+        embeddings = component.category_embeddings()
+        if embeddings is not None:
+            state.record("category_embeddings", len(embeddings))
+
+    timings = {}
+    for batch_size in batch_sizes:
+        texts = [WARMUP_TEXTS[i % len(WARMUP_TEXTS)] for i in range(batch_size)]
+        start = time.time()
+        try:
+            classifier.predict_batch(texts, batch_size=batch_size)
+            classifier.predict(texts[0])
+        except Exception as e:
+            state.fail(f"Warm-up batch of {batch_size} failed: {str(e)}")
+            continue
+        timings[str(batch_size)] = round(time.time() - start, 4)
+
+    state.record("warmup_batches", timings)
+
+    # Warm-up traffic should not show up in the cascade's exit rates
+    if hasattr(classifier, "reset_stats"):
+        classifier.reset_stats()
+
+
+def restore_snapshot(recommender, path: Path = WARMUP_SNAPSHOT_PATH,
+                     state: ReadinessState = readiness) -> int:
+    """
+    Prefill the recommender's item classifications from the snapshot written at shutdown.
+
+    Returns:
+        int: Number of restored items
+    """
+    if not path.exists():
+        state.record("snapshot_items", 0)
+        return 0
+
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            snapshot = json.load(f)
+        if snapshot.get("model_version") != model_version(recommender.classifier):
+            # Classifications from a different model would be stale
+            state.record("snapshot_items", "skipped_model_changed")
+            return 0
+        restored = recommender.restore_items(snapshot.get("items", []))
+    except Exception as e:
+        state.fail(f"Could not restore warm-up snapshot: {str(e)}")
+        return 0
+
+    state.record("snapshot_items", restored)
+    return restored
+
+
+def save_snapshot(recommender, path: Path = WARMUP_SNAPSHOT_PATH, limit: int = 10000):
+    """
+    Write the recommender's hottest item classifications for the next startup.
+    """
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "saved_at": time.time(),
+                "model_version": model_version(recommender.classifier),
+                "items": recommender.snapshot_items(limit)
+            }, f)
+        os.replace(tmp_path, path)
+        logger.info(f"Saved warm-up snapshot to {path}")
+    except Exception as e:
+        logger.error(f"Could not save warm-up snapshot: {str(e)}")
+
+
+def warm_up(classifier, recommender, state: ReadinessState = readiness):
+    """
+    Run the full startup sequence and flip readiness when done.
+
+    Readiness is only granted when the models validated; otherwise the
+    instance stays unready and reports its errors on /ready.
+    """
+    if not WARMUP_ENABLED:
+        state.mark_ready()
+        return
+
+    try:
+        state.set_phase("loading_models")
+        usable = load_artifacts(classifier, state)
+
+        state.set_phase("restoring_snapshot")
+        restore_snapshot(recommender, state=state)
+
+        if usable:
+            state.set_phase("warming_up")
+            run_warmup_batches(classifier, state=state)
+            state.mark_ready()
+        else:
+            state.set_phase("failed")
+    except Exception as e:
+        state.fail(str(e))
+        state.set_phase("failed")